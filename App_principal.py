@@ -1,7 +1,11 @@
 import streamlit as st
 # Importaciones necesarias para la autenticación y la base de datos
 from utils.auth import check_login, authenticate, register_user, sign_out
-from utils.db import get_supabase_client, test_supabase_connection 
+from utils.db import get_supabase_client
+from utils.health import show_health_sidebar
+from utils.replica import replica_activa, show_replica_sidebar
+from utils.assets import get_thumbnail
+from utils.cache import precalentar_sesion
 
 # Configuración de página
 st.set_page_config(page_title="GRINO", page_icon="🌱", layout="wide")
@@ -46,13 +50,11 @@ if is_logged_in:
 
         st.divider()
         
-        # 🚦 Verificar la conexión (Solo mostramos el estado en el sidebar)
+        # 🚦 Estado de la conexión (leído del monitor en segundo plano, sin bloquear)
         st.subheader("Conexión DB")
-        if test_supabase_connection(supabase):
-            st.success("✅ Supabase conectado.")
-        else:
-            # Si hay un error, el 'test_supabase_connection' ya habrá mostrado el error
-            st.warning("⚠️ Error en la conexión a Supabase.")
+        show_health_sidebar()
+        if replica_activa():
+            show_replica_sidebar(st.session_state.user_id)
 
 
     # ------------------- Contenido Principal de la App -------------------
@@ -102,8 +104,9 @@ if is_logged_in:
                     # Usamos un truco de columnas internas para centrar la imagen
                     col_img_1, col_img_2, col_img_3 = st.columns([1, 2, 1]) 
                     with col_img_2:
+                        # Miniatura WebP cacheada en disco/memoria en vez del JPG completo
                         st.image(
-                            p['imagen_path'], 
+                            get_thumbnail(p['imagen_path']), 
                             width=150,  
                             caption=p['titulo']
                         ) 
@@ -137,6 +140,8 @@ else:
                     st.error("⚠️ Por favor ingrese correo y contraseña.")
                 else:
                     if authenticate(email, password):
+                        # Catálogos, primera página del historial y PDF se cargan mientras se ve la portada
+                        precalentar_sesion(st.session_state.user_id)
                         st.rerun()
                     else:
                         st.error("❌ Credenciales incorrectas o usuario no existe.")
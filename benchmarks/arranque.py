@@ -0,0 +1,150 @@
+"""Tiempo de importación en frío de cada página de la app.
+
+Para cada página se ejecutan, en un proceso nuevo, solo sus imports de nivel superior (la página
+en sí no se ejecuta) con `python -X importtime`, y se registra cuánto tarda cada módulo. Luego se
+compara con benchmarks/presupuesto_arranque.json: falla (exit 1) si una página pasa su tiempo
+máximo o si carga un módulo que debería importarse recién al usarse (p. ej. fpdf o pandas).
+
+    python benchmarks/arranque.py                 # medir y comparar con el presupuesto
+    python benchmarks/arranque.py --detalle 15    # además, los 15 módulos más lentos por página
+    python benchmarks/arranque.py --salida r.json # guardar la medición completa
+    python benchmarks/arranque.py --actualizar    # fijar los tiempos máximos a partir de esta medición
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+# ==================== CONFIGURACIÓN ====================
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRESUPUESTO = os.path.join(RAIZ, "benchmarks", "presupuesto_arranque.json")
+REPETICIONES = 3
+MARGEN_ACTUALIZAR = 1.5  # --actualizar fija max_ms = mediana medida * margen
+MARCA = "--grino-inicio--"
+
+# ==================== MEDICIÓN ====================
+def paginas() -> List[str]:
+    """Rutas relativas de la página principal y de pages/"""
+    rutas = ["App_principal.py"] + sorted(glob.glob(os.path.join(RAIZ, "pages", "*.py")))
+    return [os.path.relpath(os.path.join(RAIZ, r), RAIZ) for r in rutas]
+
+def imports_de_pagina(ruta: str) -> str:
+    """Código con solo los import de nivel superior de la página"""
+    with open(os.path.join(RAIZ, ruta), encoding="utf-8") as f:
+        arbol = ast.parse(f.read(), filename=ruta)
+    nodos = [n for n in arbol.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return ast.unparse(ast.Module(body=nodos, type_ignores=[]))
+
+def _parsear_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """(módulo, propio_us, acumulado_us) de lo importado después de la marca"""
+    modulos, activo = [], False
+    for linea in stderr.splitlines():
+        if MARCA in linea:
+            activo = True
+            continue
+        if not activo or not linea.startswith("import time:") or "|" not in linea:
+            continue
+        propio, acumulado, nombre = [c.strip() for c in linea[len("import time:"):].split("|")]
+        if propio.isdigit():
+            modulos.append((nombre, int(propio), int(acumulado)))
+    return modulos
+
+def medir_pagina(ruta: str) -> Dict[str, Any]:
+    """Importa los módulos de la página en un intérprete nuevo y devuelve tiempos por módulo"""
+    codigo = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {RAIZ!r})\n"
+        f"sys.stderr.write({MARCA!r} + '\\n'); sys.stderr.flush()\n"
+        "_t = time.perf_counter()\n"
+        f"{imports_de_pagina(ruta)}\n"
+        "print((time.perf_counter() - _t) * 1000)\n"
+    )
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        cwd=RAIZ, capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(f"No se pudieron importar los módulos de {ruta}:\n{proceso.stderr[-2000:]}")
+    modulos = _parsear_importtime(proceso.stderr)
+    return {
+        "total_ms": float(proceso.stdout.strip().splitlines()[-1]),
+        "modulos": {nombre: {"propio_ms": propio / 1000, "acumulado_ms": acumulado / 1000} for nombre, propio, acumulado in modulos},
+    }
+
+def medir(repeticiones: int = REPETICIONES) -> Dict[str, Dict[str, Any]]:
+    """Mediana de varias corridas por página (cada corrida en un proceso nuevo)"""
+    resultado = {}
+    for ruta in paginas():
+        corridas = [medir_pagina(ruta) for _ in range(repeticiones)]
+        mediana = statistics.median(c["total_ms"] for c in corridas)
+        representativa = min(corridas, key=lambda c: abs(c["total_ms"] - mediana))
+        resultado[ruta] = {"total_ms": mediana, "modulos": representativa["modulos"]}
+    return resultado
+
+# ==================== PRESUPUESTO ====================
+def comparar(medicion: Dict[str, Dict[str, Any]], presupuesto: Dict[str, Any]) -> List[str]:
+    """Lista de violaciones del presupuesto (vacía si todo está dentro)"""
+    errores = []
+    prohibidos_global = presupuesto.get("prohibidos", [])
+    for ruta, datos in medicion.items():
+        limite = presupuesto.get("paginas", {}).get(ruta, {})
+        max_ms = limite.get("max_ms")
+        if max_ms is not None and datos["total_ms"] > max_ms:
+            errores.append(f"{ruta}: {datos['total_ms']:.0f} ms > {max_ms:.0f} ms")
+        for prohibido in prohibidos_global + limite.get("prohibidos", []):
+            if any(m == prohibido or m.startswith(prohibido + ".") for m in datos["modulos"]):
+                errores.append(f"{ruta}: importa '{prohibido}' al cargar (debería importarse al usarse)")
+    return errores
+
+def actualizar(medicion: Dict[str, Dict[str, Any]], presupuesto: Dict[str, Any]) -> Dict[str, Any]:
+    paginas_presupuesto = presupuesto.setdefault("paginas", {})
+    for ruta, datos in medicion.items():
+        paginas_presupuesto.setdefault(ruta, {})["max_ms"] = round(datos["total_ms"] * MARGEN_ACTUALIZAR, -1)
+    return presupuesto
+
+# ==================== SALIDA ====================
+def imprimir(medicion: Dict[str, Dict[str, Any]], presupuesto: Dict[str, Any], detalle: int) -> None:
+    for ruta, datos in medicion.items():
+        max_ms = presupuesto.get("paginas", {}).get(ruta, {}).get("max_ms")
+        limite = f" / {max_ms:.0f} ms" if max_ms is not None else ""
+        print(f"{ruta:<40} {datos['total_ms']:8.0f} ms{limite}")
+        if detalle:
+            lentos = sorted(datos["modulos"].items(), key=lambda m: m[1]["propio_ms"], reverse=True)[:detalle]
+            for nombre, t in lentos:
+                print(f"    {nombre:<50} {t['propio_ms']:7.1f} ms (acumulado {t['acumulado_ms']:.1f})")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--detalle", type=int, default=0, help="módulos más lentos a listar por página")
+    parser.add_argument("--salida", help="archivo JSON donde guardar la medición")
+    parser.add_argument("--actualizar", action="store_true", help="reescribe los max_ms del presupuesto")
+    args = parser.parse_args()
+
+    with open(PRESUPUESTO, encoding="utf-8") as f:
+        presupuesto = json.load(f)
+    medicion = medir(args.repeticiones)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(medicion, f, ensure_ascii=False, indent=2)
+    if args.actualizar:
+        presupuesto = actualizar(medicion, presupuesto)
+        with open(PRESUPUESTO, "w", encoding="utf-8") as f:
+            json.dump(presupuesto, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+    imprimir(medicion, presupuesto, args.detalle)
+    errores = comparar(medicion, presupuesto)
+    for error in errores:
+        print(f"❌ {error}")
+    if not errores:
+        print("✅ Todas las páginas dentro del presupuesto de arranque")
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
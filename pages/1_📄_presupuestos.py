@@ -1,9 +1,12 @@
 from typing import Any, Dict
 import streamlit as st
 import os
+import uuid
 from utils.pdf import generar_pdf
 from utils.auth import check_login
+from utils.perfil import perfil_rerun
 from utils.components import (
+    cargar_catalogos,
     show_cliente_lugar_selector,
     show_items_presupuesto,
     show_mano_obra,
@@ -11,6 +14,7 @@ from utils.components import (
     safe_numeric_value
 )
 from utils.database import save_presupuesto_completo
+from utils.cache import invalidar_historial
 
 st.set_page_config(page_title="GRINO", page_icon="🌱", layout="wide")
 
@@ -43,12 +47,13 @@ def main():
 
     # ========== SECCIÓN CLIENTE, LUGAR y TRABAJO A REALIZAR ==========
     st.subheader("Datos del Cliente", divider="blue")
-    cliente_id, cliente_nombre, lugar_trabajo_id, lugar_nombre, descripcion = show_cliente_lugar_selector()
+    catalogos = cargar_catalogos(st.session_state.user_id)
+    cliente_id, cliente_nombre, lugar_trabajo_id, lugar_nombre, descripcion = show_cliente_lugar_selector(catalogos)
     st.session_state.descripcion = descripcion
 
     # ========== SECCIÓN ITEMS ==========
     st.subheader("Datos del Presupuesto", divider="blue")
-    items_data = show_items_presupuesto()
+    items_data = show_items_presupuesto(catalogos['categorias'])
 
     if not items_data or all(len(cat['items']) == 0 for cat in items_data.values()):
         st.warning("⚠️ Agrega al menos un ítem al presupuesto")
@@ -84,6 +89,8 @@ def main():
     
     if st.button("📂 Guardar Presupuesto Completo", ...):
     
+        # Una clave por presupuesto en curso: si el guardado falla a medias, reintentar no lo duplica
+        clave = st.session_state.setdefault('presupuesto_clave', uuid.uuid4().hex)
         with st.spinner("Guardando presupuesto..."):
             try:
                 presupuesto_id = save_presupuesto_completo(
@@ -92,10 +99,13 @@ def main():
                     lugar_trabajo_id=lugar_trabajo_id,
                     descripcion=descripcion,
                     items_data=items_data,
-                    total=total_general
+                    total=total_general,
+                    clave_idempotencia=clave
                 )
 
                 if presupuesto_id:
+                    st.session_state.pop('presupuesto_clave', None)
+                    invalidar_historial()
 
                     # VALIDACIÓN DE items_data
                     if not isinstance(items_data, dict):
@@ -151,7 +161,8 @@ is_logged_in = check_login()
 
 if __name__ == "__main__":
     if is_logged_in:
-        main()
+        with perfil_rerun("presupuestos"):
+            main()
     else:
         st.error("🔒 Por favor inicie sesión primero")
         st.page_link("App_principal.py", label="Ir a página de inicio")
\ No newline at end of file
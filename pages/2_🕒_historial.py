@@ -1,116 +1,111 @@
+import hashlib
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, Any, Optional
-from utils.database import get_clientes_detallados, create_cliente, update_cliente, delete_cliente
 from utils.auth import check_login
+from utils.perfil import perfil_rerun
+from utils.cache import (
+    get_catalogos,
+    get_detalle_cacheado,
+    get_detalle_version,
+    get_pagina_historial,
+    get_suma_historial,
+    invalidar_historial,
+    invalidar_detalle,
+    prefetch_detalles,
+    PAGINA_ACTUAL_KEY,
+    POR_PAGINA
+)
 from utils.database import (
-    get_presupuestos_usuario, 
-    get_presupuesto_detallado,
-    get_clientes,
-    get_lugares_trabajo,
+    get_versiones_presupuesto,
     delete_presupuesto
 )
 from utils.pdf import (
     mostrar_boton_descarga_pdf
 )
 from utils.components import safe_numeric_value
+from utils.db import con_cliente_actual
+from utils.export import exportar_historial, FORMATOS
 
 st.set_page_config(page_title="Historial", page_icon="🌱", layout="wide")
 
 def _show_presupuesto_detail(presupuesto_id: int, cliente_nombre: str, lugar_nombre: str):
-    """Obtiene el detalle completo y lo muestra agrupado por categoría."""
+    """Muestra el detalle (cacheado y ya agrupado por categoría) de un presupuesto."""
     try:
-        detalle = get_presupuesto_detallado(presupuesto_id)
+        detalle = get_detalle_cacheado(presupuesto_id)
         if not detalle:
             st.error("No se pudo cargar el detalle del presupuesto.")
             return
 
-        st.markdown(f"**Cliente:** {cliente_nombre} | **Lugar:** {lugar_nombre} | **Descripción:** {detalle.get('descripcion', 'N/A')}")
-          
-        total_general = 0
-        
-        # 1. Agrupar ítems por nombre de categoría
-        categorias_agrupadas = {}
-        for item in detalle.get('items', []):
-            cat = item.get('categoria', 'Sin Categoría') or 'Sin Categoría'
-            if cat not in categorias_agrupadas:
-                categorias_agrupadas[cat] = {'items': [], 'mano_obra': 0.0}
-            
-            # Usamos la función segura para obtener el total del ítem
-            item_total_safe = safe_numeric_value(item.get('total'))
-            
-            # Lógica para separar Mano de Obra (asumiendo que tiene ese nombre)
-            if 'mano de obra' in item.get('nombre', '').lower():
-                 # Sumamos al total de mano de obra
-                categorias_agrupadas[cat]['mano_obra'] += item_total_safe
-            else:
-                categorias_agrupadas[cat]['items'].append(item)
+        # Versiones anteriores: se reconstruyen a partir de los deltas guardados en cada edición
+        if detalle['version'] > 1:
+            versiones = {v['version']: v for v in get_versiones_presupuesto(presupuesto_id)}
+            opciones = [detalle['version']] + sorted(versiones, reverse=True)
+            version = st.selectbox(
+                "Versión",
+                options=opciones,
+                format_func=lambda v: f"v{v} (vigente)" if v == detalle['version'] else
+                    f"v{v} · {versiones[v]['fecha']:%d/%m/%Y %H:%M} · {versiones[v]['cambios_items']} ítems cambiados",
+                key=f"hist_version_{presupuesto_id}"
+            )
+            if version != detalle['version']:
+                detalle = get_detalle_version(presupuesto_id, version)
+                if not detalle:
+                    st.error("No se pudo reconstruir esa versión.")
+                    return
+                st.info(f"Mostrando la versión {version}; los listados y el PDF usan siempre la vigente.")
 
-        # 2. Mostrar la vista previa agrupada por categoría
-        for cat, data in categorias_agrupadas.items():
-            items = data['items']
-            mano_obra = data.get('mano_obra', 0.0)
-            
-            # Filtramos la MO General si es un ítem aparte
-            is_mano_obra_general = 'mano de obra general' in cat.lower() or cat.lower() == 'general'
+        st.markdown(f"**Cliente:** {cliente_nombre} | **Lugar:** {lugar_nombre} | **Descripción:** {detalle.get('descripcion') or 'N/A'}")
+
+        for cat, data in detalle['categorias'].items():
+            df_items = data['items']
+            mano_obra = data['mano_obra']
             
-            if items or mano_obra > 0:
-                # Usamos la función segura para calcular el total de la categoría
-                total_items_suma = sum(safe_numeric_value(item.get('total')) for item in items)
-                total_categoria = total_items_suma + mano_obra
-                total_general += total_categoria
+            if df_items.empty and mano_obra <= 0:
+                continue
 
-                # Si es MO general, no mostramos tabla de ítems
-                if is_mano_obra_general and total_items_suma == 0:
-                    st.markdown(f"**🔹 Mano de Obra General**")
-                else:
-                    st.markdown(f"**🔹 {cat}**")
+            st.markdown(f"**🔹 {cat}**")
+            
+            if not df_items.empty:
+                # Seleccionar y renombrar columnas para la visualización
+                df_display = df_items[[
+                    'nombre', 
+                    'unidad', 
+                    'cantidad', 
+                    'precio_unitario', 
+                    'total', 
+                    'notas'
+                ]].rename(columns={'nombre': 'Descripción', 'precio_unitario': 'P. Unitario'})
+                # El detalle cacheado guarda los montos exactos; aquí se redondean solo para mostrarlos
+                for col in ['cantidad', 'P. Unitario', 'total']:
+                    df_display[col] = df_display[col].round().astype(int)
                 
-                if items:
-                    df_items = pd.DataFrame(items)
+                st.dataframe(
+                    df_display,
+                    column_config={
+                        "P. Unitario": st.column_config.NumberColumn("P. Unitario", format="$%d"),
+                        "total": st.column_config.NumberColumn("Total", format="$%d"),
+                        "cantidad": st.column_config.NumberColumn("Cantidad", format="%d"),
+                        "notas": "Notas" 
+                    },
+                    hide_index=True,
+                    width='stretch'
+                )
+            
+            col_mo, col_total = st.columns([1, 1]) # Divide el espacio en dos columnas iguales
 
-                    # Aplicamos la función segura a las columnas numéricas en el DataFrame
-                    for col in ['cantidad', 'precio_unitario', 'total']:
-                        # Convertimos a int para el display, ya que el formato de moneda usa enteros
-                        df_items[col] = df_items[col].apply(lambda x: int(round(safe_numeric_value(x)))) 
+            # Solo mostramos la Mano de Obra si es > 0
+            if mano_obra > 0:
+                with col_mo:
+                    st.markdown(f"**Mano de obra {cat}:** **${mano_obra:,.0f}**")
 
-                    # Seleccionar y renombrar columnas para la visualización
-                    df_display = df_items[[
-                        'nombre', 
-                        'unidad', 
-                        'cantidad', 
-                        'precio_unitario', 
-                        'total', 
-                        'notas'
-                    ]].rename(columns={'nombre': 'Descripción', 'precio_unitario': 'P. Unitario'})
-                    
-                    st.dataframe(
-                        df_display,
-                        column_config={
-                            "P. Unitario": st.column_config.NumberColumn("P. Unitario", format="$%d"),
-                            "total": st.column_config.NumberColumn("Total", format="$%d"),
-                            "cantidad": st.column_config.NumberColumn("Cantidad", format="%d"),
-                            "notas": "Notas" 
-                        },
-                        hide_index=True,
-                        width='stretch'
-                    )
+            # El total de la categoría siempre se muestra
+            with col_total:
+                st.markdown(f"**Total {cat}:** **${data['total']:,.0f}**") 
                 
-                col_mo, col_total = st.columns([1, 1]) # Divide el espacio en dos columnas iguales
-
-                # Solo mostramos la Mano de Obra si es > 0
-                if mano_obra > 0:
-                    with col_mo:
-                        mo_label = "Mano de obra General" if is_mano_obra_general else f"Mano de obra {cat}"
-                        st.markdown(f"**{mo_label}:** **${mano_obra:,.0f}**")
-
-                # El total de la categoría siempre se muestra
-                with col_total:
-                    st.markdown(f"**Total {cat}:** **${total_categoria:,.0f}**") 
-                    
-                st.divider()
-        st.markdown(f"#### 💵 **Total General del Presupuesto:** **${total_general:,.0f}**")
+            st.divider()
+        st.markdown(f"#### 💵 **Total General del Presupuesto:** **${detalle['total_general']:,.0f}**")
     except Exception as e:
         st.error(f"Error al mostrar detalle del presupuesto: {str(e)}")
 
@@ -131,22 +126,29 @@ def main():
             'user_email': st.session_state.get('user_email')
         })
         
-        # Probar la carga de datos básicos
+        # Probar la carga de datos básicos (los mismos catálogos que usan los filtros, sin volver a pedirlos)
         try:
-            clientes_test = get_clientes()
-            lugares_test = get_lugares_trabajo()
-            st.success(f"✅ Clientes cargados: {len(clientes_test)}")
-            st.success(f"✅ Lugares cargados: {len(lugares_test)}")
+            catalogos = get_catalogos(st.session_state.user_id)
+            st.success(f"✅ Clientes cargados: {len(catalogos['clientes'])}")
+            st.success(f"✅ Lugares cargados: {len(catalogos['lugares'])}")
         except Exception as e:
             st.error(f"❌ Error cargando datos básicos: {e}")
     
+    # ========== BÚSQUEDA ==========
+    busqueda = st.text_input(
+        "🔎 Buscar presupuestos",
+        placeholder="Descripción, ítem, cliente o lugar (ej: Pino Deck 1x4)",
+        key="hist_busqueda"
+    ).strip()
+
     # ========== FILTROS ==========
-    with st.expander("🔍 Filtros", expanded=True):
+    with st.expander("🔍 Filtros", expanded=not busqueda):
         col1, col2, col3 = st.columns(3)
         
         try:
-            clientes = get_clientes()
-            lugares = get_lugares_trabajo()
+            catalogos = get_catalogos(st.session_state.user_id)
+            clientes = catalogos['clientes']
+            lugares = catalogos['lugares']
             
             # Mapeo de IDs a Nombres para filtros
             clientes_map = {id: nombre for id, nombre in clientes}
@@ -169,8 +171,9 @@ def main():
             with col3:
                 fecha_filtro = st.selectbox(
                     "Filtrar por fecha:",
-                    options=["Últimos 7 días", "Últimos 30 días", "Últimos 90 días", "Todos"],
-                    index=3  # Por defecto "Todos"
+                    options=["Últimos 7 días", "Últimos 30 días", "Últimos 90 días", "Todos", "Todos (incluye archivados)"],
+                    index=3,  # Por defecto "Todos": solo los presupuestos no archivados
+                    help="Los presupuestos antiguos se archivan; solo se consultan si el filtro lo pide."
                 )
                 
         except Exception as e:
@@ -184,22 +187,53 @@ def main():
     if lugar_filtro:
         filtros['lugar_trabajo_id'] = lugar_filtro
     
+    # Se parte desde la medianoche para que la clave de caché de páginas sea estable en el día
+    hoy = datetime.combine(date.today(), datetime.min.time())
     if fecha_filtro == "Últimos 7 días":
-        filtros['fecha_inicio'] = datetime.now() - timedelta(days=7)
+        filtros['fecha_inicio'] = hoy - timedelta(days=7)
     elif fecha_filtro == "Últimos 30 días":
-        filtros['fecha_inicio'] = datetime.now() - timedelta(days=30)
+        filtros['fecha_inicio'] = hoy - timedelta(days=30)
     elif fecha_filtro == "Últimos 90 días":
-        filtros['fecha_inicio'] = datetime.now() - timedelta(days=90)
+        filtros['fecha_inicio'] = hoy - timedelta(days=90)
+    elif fecha_filtro == "Todos (incluye archivados)":
+        filtros['incluir_archivo'] = True
+
+    # La búsqueda por relevancia se hace en la DB y no combina los filtros de arriba
+    if busqueda:
+        filtros = {'busqueda': busqueda, 'incluir_archivo': fecha_filtro == "Todos (incluye archivados)"}
+        st.caption("Mostrando resultados de búsqueda ordenados por relevancia (solo se aplica el filtro de archivados).")
     
-    # ========== CARGAR PRESUPUESTOS ==========
+    # ========== EXPORTAR ==========
+    with st.expander("📤 Exportar historial completo", expanded=False):
+        st.caption("Incluye todos los presupuestos, también los archivados, y sus ítems (una fila por ítem), sin aplicar filtros.")
+        col_formato, col_descarga = st.columns([1, 2])
+        with col_formato:
+            formato = st.selectbox("Formato:", options=list(FORMATOS), key="hist_export_formato")
+        with col_descarga:
+            st.write("")
+            export_user_id = st.session_state.user_id
+            # El archivo se genera por lotes recién al hacer clic, en un hilo aparte
+            st.download_button(
+                f"⬇️ Descargar {formato}",
+                data=con_cliente_actual(lambda: exportar_historial(export_user_id, formato)),
+                file_name=f"historial_presupuestos_{date.today().isoformat()}.{FORMATOS[formato][0]}",
+                mime=FORMATOS[formato][1],
+                key="hist_export_btn",
+                width='stretch'
+            )
+
+    # ========== CARGAR PÁGINA DE PRESUPUESTOS ==========
+    user_id = st.session_state.user_id
     try:
-        st.write("🔄 Cargando presupuestos...")
-        presupuestos = get_presupuestos_usuario(st.session_state.user_id, filtros)
+        pagina = st.session_state.get(PAGINA_ACTUAL_KEY, 0)
+        presupuestos, total_presupuestos = get_pagina_historial(user_id, filtros, pagina)
+        # Si los filtros cambiaron, la caché reinicia la página actual a 0
+        pagina = st.session_state.get(PAGINA_ACTUAL_KEY, 0)
         
         # Diagnóstico de los resultados
         with st.expander("🔧 Ver datos crudos de presupuestos", expanded=False):
             if presupuestos:
-                st.write(f"Se encontraron {len(presupuestos)} presupuestos")
+                st.write(f"Se encontraron {total_presupuestos} presupuestos")
                 st.json(presupuestos[:2])  # Mostrar solo los primeros 2 para diagnóstico
             else:
                 st.write("No se encontraron presupuestos")
@@ -224,13 +258,12 @@ def main():
         
         # Botón para crear nuevo presupuesto
         if st.button("📋 Crear mi primer presupuesto"):
-            st.switch_page("pages/1_📋_generar_presupuesto.py")
+            st.switch_page("pages/1_📄_presupuestos.py")
         return
     
     # ========== MOSTRAR PRESUPUESTOS ==========
-    # Resumen estadístico
-    suma_total = sum(safe_numeric_value(p.get('total', 0)) for p in presupuestos)
-    total_presupuestos = len(presupuestos)
+    # Resumen estadístico: el conteo viene con la página y la suma la calcula la DB (RPC resumen_presupuestos)
+    suma_total = get_suma_historial(user_id, filtros)
     avg_total = suma_total / total_presupuestos if total_presupuestos else 0
     
     col1, col2, col3 = st.columns(3)
@@ -241,110 +274,136 @@ def main():
     with col3:
         st.metric("Promedio", f"${avg_total:,.0f}")
     
-    st.subheader("📋 Lista de Presupuestos")
+    col_titulo, col_prefetch = st.columns([3, 1])
+    with col_titulo:
+        st.subheader("📋 Lista de Presupuestos")
+    with col_prefetch:
+        # Precarga en segundo plano el detalle de las primeras filas visibles
+        if st.toggle("⚡ Precargar vistas previas", value=True, key="hist_prefetch"):
+            prefetch_detalles([p['id'] for p in presupuestos])
 
-    # Encabezado tipo tabla
-    with st.container():
-        col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 2, 2, 1, 3])
-        col1.markdown("**Cliente**")
-        col2.markdown("**Lugar**")
-        col3.markdown("**Fecha**")
-        col4.markdown("**Total**")
-        col5.markdown("**Ítems**")
-        col6.markdown("**Acciones**")
+    # Una sola tabla con selección de fila en vez de contenedores y botones por presupuesto
+    df_pagina = pd.DataFrame([{
+        'ID': p['id'],
+        'Cliente': ((p.get('cliente') or {}).get('nombre') or 'N/A').title(),
+        'Lugar': ((p.get('lugar') or {}).get('nombre') or 'N/A').title(),
+        'Fecha': str(p.get('fecha_creacion') or '')[:10],
+        'Total': safe_numeric_value(p.get('total', 0)),
+        'Ítems': p.get('num_items', 0),
+        'Descripción': p.get('descripcion') or '',
+        'Archivado': bool(p.get('archivado'))
+    } for p in presupuestos])
+    if not df_pagina['Archivado'].any():
+        df_pagina = df_pagina.drop(columns=['Archivado'])
+    if busqueda:
+        # Los resultados de búsqueda no traen nº de ítems, sino el texto que coincidió
+        df_pagina = df_pagina.drop(columns=['Ítems'])
+        df_pagina['Coincidencia'] = [p.get('coincidencia') or '' for p in presupuestos]
 
-    # Filas tipo tabla
-    for i, p in enumerate(presupuestos):
-        # Usamos safe_numeric_value para el display del total
-        total_display = safe_numeric_value(p.get('total', 0))
-        
-        with st.container(border=True):
-            col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 2, 2, 1, 3])
+    # Streamlit conserva la selección de una tabla con key aunque cambien sus datos: con los filtros
+    # en la key, otros filtros son otra tabla y no heredan una fila que quizá ya no existe
+    clave_tabla = hashlib.sha1(repr(sorted((k, str(v)) for k, v in filtros.items())).encode("utf-8")).hexdigest()[:12]
+    seleccion = st.dataframe(
+        df_pagina,
+        column_config={
+            "ID": st.column_config.NumberColumn("ID", format="%d", width="small"),
+            "Total": st.column_config.NumberColumn("Total", format="$%d"),
+            "Ítems": st.column_config.NumberColumn("Ítems", width="small"),
+        },
+        hide_index=True,
+        width='stretch',
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"historial_tabla_{clave_tabla}_{pagina}"
+    )
 
-            # Datos - con manejo de errores para cada campo
-            try:
-                cliente_nombre = p.get('cliente', {}).get('nombre', 'N/A')
-                col1.write(cliente_nombre.title() if cliente_nombre else 'N/A')
-            except:
-                col1.write('Error')
-                
-            try:
-                lugar_nombre = p.get('lugar', {}).get('nombre', 'N/A')
-                col2.write(lugar_nombre.title() if lugar_nombre else 'N/A')
-            except:
-                col2.write('Error')
-                
-            try:
-                fecha = p.get('fecha', datetime.now())
-                if isinstance(fecha, str):
-                    col3.write(fecha)
-                else:
-                    col3.write(fecha.strftime('%Y-%m-%d'))
-            except:
-                col3.write('Error')
-                
-            col4.write(f"**${total_display:,.2f}**")
-            col5.write(str(p.get('num_items', 0)))
+    # Paginación
+    num_paginas = max(1, -(-total_presupuestos // POR_PAGINA))
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ Anterior", disabled=pagina == 0, width='stretch'):
+            st.session_state[PAGINA_ACTUAL_KEY] = pagina - 1
+            st.rerun()
+    with col_info:
+        st.markdown(f"<p style='text-align: center;'>Página {pagina + 1} de {num_paginas}</p>", unsafe_allow_html=True)
+    with col_next:
+        if st.button("Siguiente ▶", disabled=pagina + 1 >= num_paginas, width='stretch'):
+            st.session_state[PAGINA_ACTUAL_KEY] = pagina + 1
+            st.rerun()
 
-            # Acciones
-            with col6:
-                b1, b2, b3, b4 = st.columns([1, 1, 1, 1])
-                
-                # Clave de estado para el toggle del expander
-                state_key = f"expander_toggle_{p['id']}"
-                if state_key not in st.session_state:
-                    st.session_state[state_key] = False
+    # Con los mismos filtros la página puede achicarse (p. ej. al eliminar su última fila)
+    filas_seleccionadas = [i for i in seleccion.selection.rows if i < len(presupuestos)]
+    if not filas_seleccionadas:
+        st.caption("Selecciona un presupuesto en la tabla para ver sus acciones.")
+        return
 
-                with b1: # BOTÓN EDITAR
-                    if st.button("✏️", key=f"edit_{p['id']}", help="Editar"):
-                        st.session_state['presupuesto_a_editar_id'] = p['id'] 
-                        st.switch_page("pages/3_✏️_editar.py")
+    fila = filas_seleccionadas[0]
+    p = presupuestos[fila]
+    cliente_nombre = df_pagina.iloc[fila]['Cliente']
+    lugar_nombre = df_pagina.iloc[fila]['Lugar']
 
-                with b2: # BOTÓN DESCARGA
-                    try:
-                        pdf_bytes, file_name, success = mostrar_boton_descarga_pdf(p['id'])
-                        if success and pdf_bytes:
-                            st.download_button(
-                                label="⬇️",
-                                data=pdf_bytes,
-                                file_name=file_name,
-                                mime="application/pdf",
-                                key=f"down_{p['id']}",
-                                help="Descargar PDF"
-                            )
-                        else:
-                            st.button("🚫", key=f"down_{p['id']}_disabled", disabled=True, help="PDF no disponible")
-                    except Exception as e:
-                        st.button("🚫", key=f"down_{p['id']}_error", disabled=True, help=f"Error: {e}")
-                
-                with b3: # BOTÓN VISTA PREVIA
-                    if st.button("👁️", key=f"view_{p['id']}", help="Ver Presupuesto"):
-                        st.session_state[state_key] = not st.session_state[state_key]
-                        st.rerun()
+    # ========== ACCIONES SOBRE EL PRESUPUESTO SELECCIONADO ==========
+    with st.container(border=True):
+        st.markdown(f"**Presupuesto #{p['id']}** · {cliente_nombre} · {lugar_nombre}")
+        b1, b2, b3, b4 = st.columns(4)
 
-                with b4: # BOTÓN ELIMINAR
-                    if st.button("🗑️", key=f"del_{p['id']}", help="Eliminar"):
-                        if delete_presupuesto(p['id'], st.session_state.user_id):
-                            st.success("Presupuesto eliminado correctamente")
-                            st.rerun()
-                        else:
-                            st.error("No se pudo eliminar el presupuesto.")
-            
-            # LÓGICA DEL EXPANDER
-            if st.session_state.get(state_key, False):
-                with st.expander(f"Detalle Presupuesto ID: {p['id']}", expanded=True):
-                    _show_presupuesto_detail(
-                        presupuesto_id=p['id'],
-                        cliente_nombre=cliente_nombre,
-                        lugar_nombre=lugar_nombre
+        # Los archivados son de solo lectura: se ven y se descargan, pero no se editan ni eliminan
+        archivado = bool(p.get('archivado'))
+
+        with b1: # BOTÓN EDITAR
+            if st.button("✏️ Editar", key="hist_edit", width='stretch', disabled=archivado,
+                         help="Presupuesto archivado (solo lectura)" if archivado else None):
+                st.session_state['presupuesto_a_editar_id'] = p['id']
+                st.session_state.pop('categorias_edicion', None)
+                st.session_state.pop('categorias', None)
+                st.switch_page("pages/_✏️ Editar.py")
+
+        with b2: # BOTÓN DESCARGA
+            try:
+                pdf_bytes, file_name, success = mostrar_boton_descarga_pdf(p['id'])
+                if success and pdf_bytes:
+                    st.download_button(
+                        label="⬇️ PDF",
+                        data=pdf_bytes,
+                        file_name=file_name,
+                        mime="application/pdf",
+                        key=f"down_{p['id']}",
+                        width='stretch'
                     )
+                else:
+                    st.button("🚫 PDF", key="hist_down_disabled", disabled=True, help="PDF no disponible", width='stretch')
+            except Exception as e:
+                st.button("🚫 PDF", key="hist_down_error", disabled=True, help=f"Error: {e}", width='stretch')
+
+        with b3: # BOTÓN VISTA PREVIA
+            ver_detalle = st.toggle("👁️ Ver detalle", key="hist_ver_detalle")
+
+        with b4: # BOTÓN ELIMINAR
+            if st.button("🗑️ Eliminar", key="hist_del", width='stretch', disabled=archivado,
+                         help="Presupuesto archivado (solo lectura)" if archivado else None):
+                if delete_presupuesto(p['id'], user_id):
+                    invalidar_historial()
+                    invalidar_detalle(p['id'])
+                    st.success("Presupuesto eliminado correctamente")
+                    st.rerun()
+                else:
+                    st.error("No se pudo eliminar el presupuesto.")
+
+        if ver_detalle:
+            with st.expander(f"Detalle Presupuesto ID: {p['id']}", expanded=True):
+                _show_presupuesto_detail(
+                    presupuesto_id=p['id'],
+                    cliente_nombre=cliente_nombre,
+                    lugar_nombre=lugar_nombre
+                )
 
 # Verificación de login
 is_logged_in = check_login()
 
 if __name__ == "__main__":
     if is_logged_in:
-        main()
+        with perfil_rerun("historial"):
+            main()
     else:
         st.error("🔒 Por favor inicie sesión primero")
         st.page_link("App_principal.py", label="Ir a página de inicio")
\ No newline at end of file
@@ -1,10 +1,32 @@
 import streamlit as st
-from utils.database import get_clientes_detallados, create_cliente, update_cliente, delete_cliente
+from utils.database import (
+    get_clientes_detallados,
+    create_cliente,
+    update_cliente,
+    delete_cliente,
+    buscar_clientes_similares,
+    fusionar_clientes
+)
 from utils.auth import check_login
-import pandas as pd
+from utils.perfil import perfil_rerun
+from utils.cache import get_catalogos, invalidar_historial, version_datos, TABLAS_CLIENTES
 from datetime import datetime
 
 st.set_page_config(page_title="Clientes", page_icon="🌱", layout="wide")
+CLIENTES_POR_PAGINA = 48
+RESULTADOS_BUSQUEDA = 24
+MIN_CARACTERES_BUSQUEDA = 2
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _clientes_cacheados(user_id: str, version: tuple, pagina: int, por_pagina: int, busqueda):
+    """Una consulta indexada por término y página; los reruns con el mismo texto no vuelven a la DB.
+    version cambia con cada aviso de cambio de ese usuario, así solo se descartan sus entradas."""
+    return get_clientes_detallados(user_id, pagina=pagina, por_pagina=por_pagina, busqueda=busqueda)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _similares_cacheados(user_id: str, version: tuple, nombre: str):
+    """Posibles duplicados de un nombre; se vuelven a buscar solo si cambian los clientes del usuario"""
+    return buscar_clientes_similares(nombre, user_id, umbral=0.3)
 
 def mostrar_formulario_cliente(cliente_id=None, datos_actuales=None):
     """Muestra formulario para crear/editar cliente"""
@@ -26,19 +48,19 @@ def mostrar_formulario_cliente(cliente_id=None, datos_actuales=None):
                 
                 try:
                     if cliente_id:  # Edición
-                        update_cliente(
+                        ok = update_cliente(
                             cliente_id=cliente_id,
                             nombre=nombre.strip(),
                             user_id=st.session_state.user_id
                         )
-                        st.success("Cliente actualizado correctamente")
                     else:  # Nuevo
-                        create_cliente(
+                        ok = create_cliente(
                             nombre=nombre.strip(),
                             user_id=st.session_state.user_id
                         )
-                        st.success("Cliente creado correctamente")
-                    st.rerun()
+                    if ok:
+                        st.success("Cliente guardado correctamente")
+                        st.rerun()
                 except Exception as e:
                     st.error(f"Error al guardar: {str(e)}")
         
@@ -52,21 +74,61 @@ def mostrar_modal_eliminar(cliente_id, cliente_nombre):
         st.warning(f"¿Eliminar cliente: {cliente_nombre}?")
         if st.button("🗑️ Eliminar definitivamente", type="primary"):
             try:
-                delete_cliente(cliente_id)
-                st.success("Cliente eliminado")
-                st.rerun()
+                if delete_cliente(cliente_id, st.session_state.user_id):
+                    st.session_state.pop('eliminar_cliente', None)
+                    st.success("Cliente eliminado")
+                    st.rerun()
             except Exception as e:
                 st.error(f"Error al eliminar: {str(e)}")
         if st.button("↩️ Cancelar"):
             pass
 
+def mostrar_fusion_duplicados(user_id: str):
+    """Permite elegir un cliente y fusionar en él sus posibles duplicados"""
+    with st.expander("🔀 Fusionar clientes duplicados", expanded=False):
+        # El expander se arma en cada rerun aunque esté cerrado: nada se consulta hasta que se pide
+        if not st.session_state.get('fusion_activa'):
+            if st.button("🔍 Buscar duplicados", key="fusion_buscar"):
+                st.session_state['fusion_activa'] = True
+                st.rerun()
+            return
+        # Todos los clientes del usuario (catálogo compartido), no solo los de la página visible
+        opciones = dict(get_catalogos(user_id)['clientes'])
+        if not opciones:
+            st.caption("No hay clientes registrados.")
+            return
+        destino_id = st.selectbox(
+            "Cliente que se conserva:",
+            options=list(opciones),
+            format_func=lambda i: opciones[i],
+            key="fusion_destino"
+        )
+        similares = [(i, n, sim) for i, n, sim in _similares_cacheados(user_id, version_datos(user_id, TABLAS_CLIENTES), opciones[destino_id])
+                     if i != destino_id]
+        if not similares:
+            st.caption("No se encontraron clientes parecidos.")
+            return
+        duplicados = st.multiselect(
+            "Duplicados a fusionar (sus presupuestos pasan al cliente conservado):",
+            options=[i for i, _, _ in similares],
+            format_func=lambda i: next(f"{n} ({sim:.0%})" for j, n, sim in similares if j == i),
+            key="fusion_duplicados"
+        )
+        if st.button("🔀 Fusionar", type="primary", disabled=not duplicados):
+            movidos = fusionar_clientes(destino_id, duplicados, st.session_state.user_id)
+            if movidos is not None:
+                invalidar_historial()
+                st.success(f"✅ {len(duplicados)} clientes fusionados; {movidos} presupuestos reasignados")
+                st.rerun()
+
 def main():
     st.title("👥 Gestión de Clientes")
     
     # Barra de búsqueda y botón nuevo
     col1, col2 = st.columns([4, 1])
     with col1:
-        busqueda = st.text_input("Buscar clientes", placeholder="Escribe para filtrar...")
+        # El texto se envía al presionar Enter o salir del campo (no en cada tecla)
+        busqueda = st.text_input("Buscar clientes", placeholder="Nombre o alias, luego Enter...", key="clientes_busqueda").strip()
     with col2:
         if st.button("➕ Nuevo cliente", width='stretch'):
             st.session_state['nuevo_cliente'] = True
@@ -80,21 +142,33 @@ def main():
                 st.rerun()
         st.divider()
     
-    # Obtener clientes del usuario actual
+    # Obtener una página de clientes (con agregados calculados en la DB)
+    if 0 < len(busqueda) < MIN_CARACTERES_BUSQUEDA:
+        st.caption(f"Escribe al menos {MIN_CARACTERES_BUSQUEDA} caracteres para buscar.")
+        busqueda = ""
+    por_pagina = RESULTADOS_BUSQUEDA if busqueda else CLIENTES_POR_PAGINA
+    if st.session_state.get('clientes_busqueda_previa') != busqueda:
+        st.session_state['clientes_busqueda_previa'] = busqueda
+        st.session_state['clientes_pagina'] = 0
+    pagina = st.session_state.get('clientes_pagina', 0)
     try:
-        clientes = get_clientes_detallados(st.session_state.user_id)
+        clientes, total_clientes = _clientes_cacheados(
+            st.session_state.user_id,
+            version_datos(st.session_state.user_id, TABLAS_CLIENTES),
+            pagina,
+            por_pagina,
+            busqueda or None
+        )
     except Exception as e:
         st.error(f"Error al cargar clientes: {str(e)}")
         st.stop()
     
-    # Filtrar por búsqueda
-    if busqueda:
-        clientes = [c for c in clientes if busqueda.lower() in c['nombre'].lower()]
-    
     if not clientes:
         st.info("No hay clientes registrados")
         return
     
+    mostrar_fusion_duplicados(st.session_state.user_id)
+
     # Mostrar en cuadrícula (4 por fila)
     cols = st.columns(4)
     for i, cliente in enumerate(clientes):
@@ -123,9 +197,14 @@ def main():
                 st.markdown(f"<h3 style='text-align: center;'>{cliente['nombre']}</h3>", unsafe_allow_html=True)
                 
                 # Fecha de registro (si está disponible)
-                if 'fecha_registro' in cliente:
+                if cliente.get('fecha_registro'):
                     fecha = cliente['fecha_registro'].strftime("%d/%m/%Y")
                     st.caption(f"Registrado: {fecha}")
+
+                # Resumen de presupuestos del cliente
+                st.caption(f"📋 {cliente['num_presupuestos']} presupuestos · 💰 ${cliente['total_cotizado']:,.0f}")
+                if cliente.get('ultimo_presupuesto'):
+                    st.caption(f"Último: {cliente['ultimo_presupuesto'].strftime('%d/%m/%Y')}")
                 
                 # Botones de acción
                 col1, col2 = st.columns(2)
@@ -137,6 +216,21 @@ def main():
                     if st.button("🗑️.Eliminar", key=f"del_{cliente['id']}", width='stretch'):
                         st.session_state['eliminar_cliente'] = cliente['id']
     
+    # Paginación
+    num_paginas = max(1, -(-total_clientes // por_pagina))
+    if num_paginas > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("◀ Anterior", disabled=pagina == 0, width='stretch'):
+                st.session_state['clientes_pagina'] = pagina - 1
+                st.rerun()
+        with col_info:
+            st.markdown(f"<p style='text-align: center;'>Página {pagina + 1} de {num_paginas} · {total_clientes} clientes</p>", unsafe_allow_html=True)
+        with col_next:
+            if st.button("Siguiente ▶", disabled=pagina + 1 >= num_paginas, width='stretch'):
+                st.session_state['clientes_pagina'] = pagina + 1
+                st.rerun()
+    
     # Mostrar modal de edición si está activo
     if 'editar_cliente' in st.session_state:
         cliente_id = st.session_state['editar_cliente']
@@ -170,7 +264,8 @@ is_logged_in = check_login()
 
 if __name__ == "__main__":
     if is_logged_in:
-        main()
+        with perfil_rerun("clientes"):
+            main()
     else:
         st.error("🔒 Por favor inicie sesión primero")
         st.page_link("App_principal.py", label="Ir a página de inicio")
\ No newline at end of file
@@ -0,0 +1,112 @@
+import streamlit as st
+import pandas as pd
+from datetime import date
+from utils.auth import check_login
+from utils.perfil import perfil_rerun
+from utils.database import get_analitica_mensual_async, get_analitica_presupuestos_async, ejecutar_en_paralelo
+
+st.set_page_config(page_title="Analítica", page_icon="🌱", layout="wide")
+
+def _nombre(valor, defecto: str) -> str:
+    """Extrae el nombre de un embed de PostgREST ({'nombre': ...})"""
+    return (valor or {}).get('nombre') or defecto
+
+def _tabla_resumen(df: pd.DataFrame, columna: str, titulo: str):
+    """Muestra materiales, mano de obra y total agrupados por una dimensión"""
+    st.markdown(f"#### {titulo}")
+    resumen = (
+        df.groupby(columna, as_index=False)[['materiales', 'mano_obra']].sum()
+        .assign(total=lambda d: d['materiales'] + d['mano_obra'])
+        .sort_values('total', ascending=False)
+    )
+    st.dataframe(
+        resumen,
+        column_config={
+            columna: st.column_config.TextColumn(columna.capitalize()),
+            "materiales": st.column_config.NumberColumn("Materiales", format="$%d"),
+            "mano_obra": st.column_config.NumberColumn("Mano de obra", format="$%d"),
+            "total": st.column_config.NumberColumn("Total", format="$%d"),
+        },
+        hide_index=True,
+        width='stretch'
+    )
+
+def main():
+    st.title("📊 Analítica de Presupuestos")
+
+    # ------------------- VALIDACIÓN DE ACCESO -------------------
+    if 'user_id' not in st.session_state or not st.session_state.user_id:
+        st.error("🔐 Por favor inicie sesión primero")
+        st.page_link("App_principal.py", label="Volver al inicio")
+        st.stop()
+
+    periodo = st.selectbox("Periodo:", options=["Últimos 12 meses", "Este año", "Todo"], index=0)
+    hoy = date.today()
+    if periodo == "Últimos 12 meses":
+        desde = date(hoy.year - 1, hoy.month, 1)
+    elif periodo == "Este año":
+        desde = date(hoy.year, 1, 1)
+    else:
+        desde = None
+
+    # Ambas lecturas van contra tablas pre-agregadas: su tamaño no depende del nº de ítems
+    filas, filas_presupuestos = ejecutar_en_paralelo(
+        get_analitica_mensual_async(st.session_state.user_id, desde),
+        get_analitica_presupuestos_async(st.session_state.user_id, desde),
+    )
+
+    if not filas and not filas_presupuestos:
+        st.info("📭 No hay datos de presupuestos para el periodo seleccionado")
+        return
+
+    df = pd.DataFrame([{
+        'mes': f['mes'][:7],
+        'cliente': _nombre(f.get('cliente'), 'Sin cliente'),
+        'lugar': _nombre(f.get('lugar'), 'Sin lugar'),
+        'categoria': _nombre(f.get('categoria'), 'Sin categoría'),
+        'materiales': float(f.get('materiales') or 0),
+        'mano_obra': float(f.get('mano_obra') or 0),
+    } for f in filas], columns=['mes', 'cliente', 'lugar', 'categoria', 'materiales', 'mano_obra'])
+    df_presupuestos = pd.DataFrame([{
+        'mes': f['mes'][:7],
+        'num_presupuestos': int(f.get('num_presupuestos') or 0),
+        'total': float(f.get('total') or 0),
+    } for f in filas_presupuestos], columns=['mes', 'num_presupuestos', 'total'])
+
+    # ========== MÉTRICAS ==========
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Presupuestos", f"{df_presupuestos['num_presupuestos'].sum():,}")
+    with col2:
+        st.metric("Total cotizado", f"${df_presupuestos['total'].sum():,.0f}")
+    with col3:
+        st.metric("Materiales", f"${df['materiales'].sum():,.0f}")
+    with col4:
+        st.metric("Mano de obra", f"${df['mano_obra'].sum():,.0f}")
+
+    # ========== EVOLUCIÓN MENSUAL ==========
+    st.subheader("📈 Ingresos mensuales", divider="blue")
+    mensual = df.groupby('mes')[['materiales', 'mano_obra']].sum().rename(
+        columns={'materiales': 'Materiales', 'mano_obra': 'Mano de obra'}
+    )
+    st.bar_chart(mensual)
+
+    # ========== DESGLOSES ==========
+    st.subheader("🔎 Desglose", divider="blue")
+    tab_cliente, tab_lugar, tab_categoria = st.tabs(["👤 Por cliente", "📍 Por lugar", "📂 Por categoría"])
+    with tab_cliente:
+        _tabla_resumen(df, 'cliente', "Ingresos por cliente")
+    with tab_lugar:
+        _tabla_resumen(df, 'lugar', "Ingresos por lugar de trabajo")
+    with tab_categoria:
+        _tabla_resumen(df, 'categoria', "Ingresos por categoría")
+
+is_logged_in = check_login()
+
+if __name__ == "__main__":
+    if is_logged_in:
+        with perfil_rerun("analitica"):
+            main()
+    else:
+        st.error("🔒 Por favor inicie sesión primero")
+        st.page_link("App_principal.py", label="Ir a página de inicio")
@@ -0,0 +1,92 @@
+import streamlit as st
+from utils.auth import check_login
+from utils.perfil import perfil_rerun
+from utils.cache import invalidar_historial
+from utils.importer import leer_archivo, validar, importar, COLUMNAS_REQUERIDAS, COLUMNAS_OPCIONALES
+
+st.set_page_config(page_title="Importar", page_icon="🌱", layout="wide")
+
+def _mostrar_reporte(reporte: dict):
+    """Muestra el resultado de una simulación o importación"""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Presupuestos", reporte['presupuestos'])
+    with col2:
+        st.metric("Ítems", reporte['items'])
+    with col3:
+        st.metric("Tiempo", f"{reporte['segundos']:.2f} s")
+    with col4:
+        st.metric("Filas/segundo", f"{reporte['filas_por_segundo']:,.0f}")
+    if reporte.get('repetida'):
+        st.info("ℹ️ Este archivo ya se había importado: no se creó nada nuevo. Se muestra el resultado de esa importación.")
+    verbo = "Se crearían" if reporte['dry_run'] else "Se crearon"
+    st.write(f"{verbo} **{reporte['clientes_nuevos']}** clientes, **{reporte['lugares_nuevos']}** lugares "
+             f"y **{reporte['categorias_nuevas']}** categorías nuevas.")
+    st.caption(" · ".join(f"{fase}: {seg:.2f} s" for fase, seg in reporte['tiempos'].items()))
+
+def main():
+    st.title("📥 Importar Presupuestos")
+
+    # ------------------- VALIDACIÓN DE ACCESO -------------------
+    if 'user_id' not in st.session_state or not st.session_state.user_id:
+        st.error("🔐 Por favor inicie sesión primero")
+        st.page_link("App_principal.py", label="Volver al inicio")
+        st.stop()
+
+    st.info(
+        f"El archivo (CSV o XLSX) debe tener una fila por ítem con las columnas: **{', '.join(COLUMNAS_REQUERIDAS)}**. "
+        f"Opcionales: {', '.join(COLUMNAS_OPCIONALES)}. Las filas con el mismo valor en *presupuesto* forman un presupuesto."
+    )
+
+    archivo = st.file_uploader("Archivo a importar", type=["csv", "xlsx", "xls"])
+    if not archivo:
+        return
+
+    try:
+        df = leer_archivo(archivo, archivo.name)
+    except Exception as e:
+        st.error(f"❌ No se pudo leer el archivo: {e}")
+        return
+
+    validas, errores = validar(df)
+    st.subheader("🔍 Vista previa", divider="blue")
+    st.dataframe(validas.head(50), hide_index=True, width='stretch')
+    st.write(f"**{len(validas)}** filas válidas de **{len(df)}**.")
+    if errores:
+        with st.expander(f"⚠️ {len(errores)} errores de validación", expanded=True):
+            st.write("\n".join(f"- {e}" for e in errores[:200]))
+
+    if validas.empty:
+        return
+
+    col_sim, col_imp = st.columns(2)
+    with col_sim:
+        if st.button("🧪 Simular importación", width='stretch'):
+            with st.spinner("Validando contra la base de datos..."):
+                try:
+                    st.session_state['importar_reporte'] = importar(validas, st.session_state.user_id, dry_run=True)
+                except Exception as e:
+                    st.error(f"❌ Error en la simulación: {e}")
+    with col_imp:
+        if st.button("📥 Importar", type="primary", width='stretch', disabled=bool(errores)):
+            with st.spinner("Importando..."):
+                try:
+                    st.session_state['importar_reporte'] = importar(validas, st.session_state.user_id, dry_run=False)
+                    invalidar_historial()
+                    st.success("✅ Importación completada")
+                except Exception as e:
+                    st.error(f"❌ Error al importar: {e}")
+
+    if 'importar_reporte' in st.session_state:
+        st.subheader("📊 Reporte", divider="blue")
+        _mostrar_reporte(st.session_state['importar_reporte'])
+
+is_logged_in = check_login()
+
+if __name__ == "__main__":
+    if is_logged_in:
+        with perfil_rerun("importar"):
+            main()
+    else:
+        st.error("🔒 Por favor inicie sesión primero")
+        st.page_link("App_principal.py", label="Ir a página de inicio")
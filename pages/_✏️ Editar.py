@@ -1,14 +1,15 @@
+import copy
 import streamlit as st
 import os
-import pandas as pd
 from typing import Dict, Any, List, Optional
 from utils.database import (
     get_presupuesto_detallado,
     save_edited_presupuesto,
-    get_clientes,
-    get_lugares_trabajo,
-    get_categorias,
-    get_presupuestos_usuario
+    get_clientes_async,
+    get_lugares_trabajo_async,
+    get_categorias_async,
+    get_presupuesto_detallado_async,
+    ejecutar_en_paralelo
 )
 from utils.components import (\
     selector_categoria,\
@@ -18,11 +19,14 @@ from utils.components import (\
     safe_numeric_value 
 )
 from utils.pdf import generar_pdf
+from utils.cache import invalidar_historial, invalidar_detalle
 from utils.auth import check_login
+from utils.perfil import perfil_rerun
 
 st.set_page_config(page_title="Editar", page_icon="🌱", layout="wide")
 # Constantes
 EDICION_KEY = 'categorias_edicion'
+ORIGINAL_KEY = 'presupuesto_original'
 HISTORIAL_PAGE = "pages/2_🕒_historial.py"
 
 def calcular_total_edicion(items_data: Dict[str, Any]) -> float:
@@ -35,60 +39,67 @@ def calcular_total_edicion(items_data: Dict[str, Any]) -> float:
         total += safe_numeric_value(data.get('mano_obra', 0.0))
     return total
 
-def cargar_presupuesto_en_sesion(presupuesto_id: int):
+def cargar_presupuesto_en_sesion(presupuesto_id: int, detalle: Optional[Dict[str, Any]] = None):
     """
     Carga los datos de un presupuesto detallado desde la DB al st.session_state[EDICION_KEY].
+    Si el detalle ya se pidió (p. ej. en paralelo con los catálogos) se reutiliza.
     """
-    detalle = get_presupuesto_detallado(presupuesto_id)
+    if detalle is None:
+        detalle = get_presupuesto_detallado(presupuesto_id)
     if not detalle:
         st.error(f"❌ Error al cargar el detalle del presupuesto ID: {presupuesto_id}")
         return False
         
     # Inicializar la estructura de edición
-    st.session_state[EDICION_KEY] = {'general': {'items': [], 'mano_obra': 0.0}}
+    st.session_state[EDICION_KEY] = {}
+    edicion = st.session_state[EDICION_KEY]
+
+    def _categoria(item: Dict[str, Any]) -> Dict[str, Any]:
+        cat_nombre = (item.get('categoria') or {}).get('nombre') or 'Sin Categoría'
+        if cat_nombre not in edicion:
+            edicion[cat_nombre] = {'categoria_id': item.get('categoria_id'), 'items': [], 'mano_obra': 0.0}
+        return edicion[cat_nombre]
     
     # 1. Cargar metadatos (Cliente, Lugar, Descripción)
     st.session_state['presupuesto_cliente_id'] = detalle['cliente']['id']
     st.session_state['presupuesto_lugar_trabajo_id'] = detalle['lugar']['id']
     st.session_state['presupuesto_descripcion'] = detalle['descripcion']
     
-    # 2. Cargar ítems y Mano de Obra, agrupando por categoría
+    # 2. Cargar ítems, agrupando por categoría
     for item in detalle['items']:
-        cat_nombre = item.get('categoria', 'Sin Categoría') or 'Sin Categoría'
-        nombre_item = item.get('nombre', '')
+        categoria = _categoria(item)
         
         # Aseguramos que los valores numéricos son float y manejamos None
         cantidad = safe_numeric_value(item.get('cantidad', 0))
         precio_unitario = safe_numeric_value(item.get('precio_unitario', 0))
         total = safe_numeric_value(item.get('total', 0))
         
-        # Manejo de la Mano de Obra General (asumiendo que tiene un nombre específico)
-        if 'mano de obra general' in nombre_item.lower():
-            # Asignamos el valor al área general
-            st.session_state[EDICION_KEY]['general']['mano_obra'] = total
-            continue
-            
-        # Manejo de Mano de Obra por Categoría (si se registra como ítem simple)
-        if 'mano de obra' in nombre_item.lower() and total > 0:
-            if cat_nombre not in st.session_state[EDICION_KEY]:
-                st.session_state[EDICION_KEY][cat_nombre] = {'items': [], 'mano_obra': 0.0}
-            
-            st.session_state[EDICION_KEY][cat_nombre]['mano_obra'] += total
-            continue
-            
-        # Ítem normal
-        if cat_nombre not in st.session_state[EDICION_KEY]:
-            st.session_state[EDICION_KEY][cat_nombre] = {'items': [], 'mano_obra': 0.0}
-            
-        st.session_state[EDICION_KEY][cat_nombre]['items'].append({
-            'nombre': nombre_item,
+        categoria['items'].append({
+            'id': item.get('id'),
+            'nombre': item.get('nombre_personalizado', ''),
             'unidad': item.get('unidad', 'Unidad'),
             'cantidad': cantidad,
             'precio_unitario': precio_unitario,
             'total': total,
-            'categoria': cat_nombre,
+            'categoria': (item.get('categoria') or {}).get('nombre') or 'Sin Categoría',
             'notas': item.get('notas', '')
         })
+
+    # 3. Mano de obra: un monto por categoría, guardado aparte de los ítems
+    for fila in detalle.get('mano_obra') or []:
+        _categoria(fila)['mano_obra'] += safe_numeric_value(fila.get('monto', 0))
+
+    # 4. Foto de lo cargado: al guardar solo se envía lo que difiera de ella
+    st.session_state[ORIGINAL_KEY] = {
+        'version': detalle.get('version', 1),
+        'cabecera': {
+            'cliente_id': detalle['cliente']['id'],
+            'lugar_trabajo_id': detalle['lugar']['id'],
+            'descripcion': detalle['descripcion'],
+            'total': safe_numeric_value(detalle.get('total', 0)),
+        },
+        'categorias': copy.deepcopy(edicion),
+    }
         
     return True
 
@@ -129,9 +140,19 @@ def editar_presupuesto_page():
         st.stop()
         
     # ------------------- CARGA INICIAL DE DATOS -------------------
+    # Catálogos y (la primera vez) el detalle del presupuesto se piden en paralelo
+    lecturas = [get_clientes_async(user_id), get_lugares_trabajo_async(user_id), get_categorias_async(user_id)]
+    if EDICION_KEY not in st.session_state:
+        lecturas.append(get_presupuesto_detallado_async(presupuesto_id))
+    try:
+        clientes, lugares, categorias_disponibles, *detalle = ejecutar_en_paralelo(*lecturas)
+    except Exception as e:
+        st.error(f"Error cargando clientes/lugares: {e}")
+        st.stop()
+
     # Si no se han cargado los datos de edición, cargarlos por primera vez
     if EDICION_KEY not in st.session_state:
-        if not cargar_presupuesto_en_sesion(presupuesto_id):
+        if not cargar_presupuesto_en_sesion(presupuesto_id, detalle[0]):
             st.error("❌ No se pudieron cargar los datos. Volviendo al historial.")
             del st.session_state['presupuesto_a_editar_id']
             st.page_link(HISTORIAL_PAGE, label="Volver al Historial")
@@ -150,14 +171,6 @@ def editar_presupuesto_page():
     
     # ------------------- SECCIÓN CLIENTE, LUGAR Y DESCRIPCIÓN -------------------
     
-    # Cargar listas de opciones (ya se cargaron las listas en el módulo components.py, pero las recargamos aquí si es necesario)
-    try:
-        clientes = get_clientes()
-        lugares = get_lugares_trabajo()
-    except Exception as e:
-        st.error(f"Error cargando clientes/lugares: {e}")
-        st.stop()
-    
     # Selector de cliente (usando el ID cargado previamente)
     cliente_seleccionado = st.session_state.get('presupuesto_cliente_id')
     lugar_seleccionado = st.session_state.get('presupuesto_lugar_trabajo_id')
@@ -207,7 +220,7 @@ def editar_presupuesto_page():
 
     # ------------------- SECCIÓN ITEMS Y MANO DE OBRA (Usando Componentes) -------------------
     # Los componentes show_items_presupuesto y show_mano_obra operan sobre st.session_state['categorias']
-    show_items_presupuesto()
+    show_items_presupuesto(categorias_disponibles)
     show_mano_obra()
     
     # ------------------- RESUMEN Y BOTÓN DE GUARDAR -------------------
@@ -233,7 +246,7 @@ def editar_presupuesto_page():
                 st.error("⚠️ El total del presupuesto editado debe ser mayor a cero.")
             else:
                 try:
-                    # 1. Guardar en DB (Update principal, Delete items, Insert nuevos items)
+                    # 1. Guardar en DB (solo los ítems insertados, modificados o borrados)
                     presupuesto_guardado_id = save_edited_presupuesto(
                         presupuesto_id=presupuesto_id,
                         user_id=user_id,
@@ -241,10 +254,13 @@ def editar_presupuesto_page():
                         lugar_trabajo_id=lugar_trabajo_id_actualizado,
                         descripcion=descripcion_actualizada,
                         items_data=st.session_state['categorias'], # Usa la data manipulada por los componentes
-                        total_general=total_general_actualizado
+                        total_general=total_general_actualizado,
+                        original=st.session_state.get(ORIGINAL_KEY)
                     )
                     
                     if presupuesto_guardado_id:
+                        invalidar_historial()
+                        invalidar_detalle(presupuesto_id)
                         st.success(f"Presupuesto {presupuesto_guardado_id} guardado correctamente. Generando PDF...")
                         
                         # 2. Generar PDF (usa la data de la sesión)
@@ -287,6 +303,8 @@ def editar_presupuesto_page():
                             del st.session_state['presupuesto_a_editar_id']
                         if EDICION_KEY in st.session_state:
                             del st.session_state[EDICION_KEY]
+                        if ORIGINAL_KEY in st.session_state:
+                            del st.session_state[ORIGINAL_KEY]
                         if 'categorias' in st.session_state:
                              del st.session_state['categorias'] # Limpiar categorías para evitar contaminación
                             
@@ -301,7 +319,8 @@ is_logged_in = check_login()
 
 if __name__ == "__main__":
     if is_logged_in:
-        editar_presupuesto_page()
+        with perfil_rerun("editar"):
+            editar_presupuesto_page()
     else:
         st.error("🔒 Por favor inicie sesión primero")
         st.page_link("App_principal.py", label="Ir a página de inicio")
\ No newline at end of file
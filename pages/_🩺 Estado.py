@@ -0,0 +1,67 @@
+import streamlit as st
+import pandas as pd
+from utils.cambios import get_estado_cambios
+from utils.db import get_http_stats, get_pool_sesiones
+from utils.health import get_health_snapshot
+from utils.resiliencia import get_estado_circuito
+
+st.set_page_config(page_title="Estado", page_icon="🌱", layout="wide")
+
+def estado_page():
+    """Página de operaciones: muestra el estado cacheado del monitor de Supabase."""
+    st.title("🩺 Estado del Servicio")
+    estado = get_health_snapshot()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Estado", "OK" if estado["ok"] else ("Pendiente" if estado["ok"] is None else "Caído"))
+    with col2:
+        st.metric("Latencia p50", f"{estado['latencia_ms']['p50'] or 0:.0f} ms")
+    with col3:
+        st.metric("Latencia p95", f"{estado['latencia_ms']['p95'] or 0:.0f} ms")
+    with col4:
+        st.metric("Fallos", f"{estado['fallos']} / {estado['sondas']}")
+
+    st.subheader("Histograma de latencia", divider="blue")
+    df_hist = pd.DataFrame({"muestras": list(estado["histograma_ms"].values())}, index=list(estado["histograma_ms"].keys()))
+    st.bar_chart(df_hist)
+
+    st.subheader("Sesiones autenticadas", divider="blue")
+    pool = get_pool_sesiones().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Activas", f"{pool['sesiones']} / {pool['max_sesiones']}")
+    with col2:
+        st.metric("Reutilizadas", pool['reutilizados'])
+    with col3:
+        st.metric("Expulsadas", pool['expulsados'])
+    with col4:
+        st.metric("Tokens refrescados", pool['refrescos'])
+
+    st.subheader("Conexiones HTTP", divider="blue")
+    http = get_http_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Abiertas / reutilizadas", f"{http['conexiones_abiertas']} / {http['conexiones_reutilizadas']}")
+    with col2:
+        st.metric("En pool", f"{http['conexiones_en_pool']} / {http['config']['max_conexiones']}")
+    with col3:
+        st.metric("Espera por conexión p95", f"{http['espera_ms']['p95'] or 0:.1f} ms")
+    with col4:
+        st.metric("Timeouts de pool", http['timeouts_pool'])
+
+    circuito = get_estado_circuito()
+    st.caption(f"Circuit breaker: **{circuito['estado']}** · fallos seguidos: {circuito['fallos_seguidos']} · "
+               f"llamadas rechazadas: {circuito['rechazadas']}")
+
+    cambios = get_estado_cambios()
+    st.caption(f"Avisos de cambios ({cambios['fuente']}): **{'activo' if cambios['activo'] else 'detenido'}** · "
+               f"recibidos: {cambios['avisos']} · reconexiones: {cambios['reconexiones']}")
+    if cambios['ultimo_error']:
+        st.caption(f"Último error del canal: {cambios['ultimo_error']}")
+
+    # Salida en bruto para herramientas de monitoreo
+    st.json({**estado, "pool_sesiones": pool, "http": http, "circuito": circuito, "cambios": cambios})
+
+if __name__ == "__main__":
+    estado_page()
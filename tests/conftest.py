@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from supabase_local import SupabaseLocal  # noqa: E402
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+def _vaciar_caches() -> None:
+    """Cada prueba arranca en frío: sin catálogos, páginas ni detalles guardados de otra"""
+    import streamlit as st
+    from utils import cache, database
+    with cache._detalles_lock:
+        cache._detalles.clear()
+        cache._duenos.clear()
+        cache._en_vuelo.clear()
+        cache._versiones.clear()
+    with cache._catalogos_lock:
+        cache._catalogos.clear()
+    with cache._precargas_lock:
+        cache._precargas_historial.clear()
+    database._limite_archivo.update({'hasta': None, 'leido_en': None})
+    st.cache_data.clear()
+
+@pytest.fixture
+def supabase_local(monkeypatch) -> SupabaseLocal:
+    """Stand-in vacío que la app usa como cliente de Supabase (sesiones sin login propio)"""
+    from utils import cambios, db
+    base = SupabaseLocal()
+    monkeypatch.delenv("GRINO_REPLICA", raising=False)
+    monkeypatch.delenv("GRINO_PERFIL", raising=False)
+    monkeypatch.setattr(db, "get_cliente_compartido", lambda: base)
+    # Sin canal externo de avisos: un hilo de sondeo mezclaría sus consultas con las del render
+    escucha = cambios.EscuchaCambios(cambios.FuenteLocal())
+    monkeypatch.setattr(cambios, "get_escucha_cambios", lambda: escucha)
+    _vaciar_caches()
+    yield base
+    _vaciar_caches()
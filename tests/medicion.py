@@ -0,0 +1,129 @@
+"""Conteo de consultas por render de página y detección de N+1.
+
+Una página se ejecuta con AppTest de Streamlit contra el stand-in local (tests/supabase_local.py);
+todo lo que llega a PostgREST mientras dura el render queda en una Medicion:
+
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID)
+    afirmar_presupuesto(medicion, 5)       # falla si hubo más de 5 consultas en primer plano
+    afirmar_sin_n_mas_1(medicion)          # falla si una misma consulta se repitió
+"""
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from streamlit.testing.v1 import AppTest
+from supabase_local import Consulta, SupabaseLocal
+
+# ==================== CONFIGURACIÓN ====================
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT_RENDER_SEG = 30
+# Hilos que no bloquean el render: precargas, avisos de cambios, monitor y sync de la réplica
+HILOS_SEGUNDO_PLANO = ('grino-prefetch', 'grino-cambios', 'grino-health', 'grino-sync')
+# Una misma forma de consulta repetida en un rerun (mismos filtros, otros valores) es un N+1
+UMBRAL_N_MAS_1 = 2
+
+# ==================== MEDICIÓN ====================
+@dataclass
+class Repeticion:
+    """Un grupo de consultas con la misma forma dentro de una medición"""
+    ejemplo: Consulta
+    veces: int
+    identicas: bool  # además de la forma, coinciden los valores: la misma consulta pedida otra vez
+
+    def __str__(self) -> str:
+        tipo = "idénticas" if self.identicas else "misma forma, distintos valores"
+        return f"{self.veces}× ({tipo}) {self.ejemplo}"
+
+class Medicion:
+    """Consultas hechas durante un render (o un bloque de código)"""
+
+    def __init__(self, consultas: List[Consulta]):
+        self.consultas = consultas
+
+    @property
+    def total(self) -> int:
+        return len(self.consultas)
+
+    @property
+    def en_primer_plano(self) -> List[Consulta]:
+        """Las que el usuario espera: las del script y las lecturas en paralelo que éste aguarda"""
+        return [c for c in self.consultas if not c.hilo.startswith(HILOS_SEGUNDO_PLANO)]
+
+    @property
+    def en_segundo_plano(self) -> List[Consulta]:
+        return [c for c in self.consultas if c.hilo.startswith(HILOS_SEGUNDO_PLANO)]
+
+    def por_objetivo(self) -> Dict[str, int]:
+        conteo: Dict[str, int] = defaultdict(int)
+        for consulta in self.consultas:
+            conteo[consulta.objetivo] += 1
+        return dict(conteo)
+
+    def n_mas_1(self, umbral: int = UMBRAL_N_MAS_1) -> List[Repeticion]:
+        """Formas de consulta repetidas al menos `umbral` veces (primer y segundo plano juntos:
+        una precarga fila por fila también es un N+1)"""
+        grupos: Dict[Tuple, List[Consulta]] = defaultdict(list)
+        for consulta in self.consultas:
+            grupos[consulta.forma].append(consulta)
+        return [
+            Repeticion(grupo[0], len(grupo), len({c.clave for c in grupo}) == 1)
+            for grupo in grupos.values() if len(grupo) >= umbral
+        ]
+
+    def resumen(self) -> str:
+        lineas = [f"{self.total} consultas ({len(self.en_primer_plano)} en primer plano):"]
+        lineas += [f"  [{c.hilo}] {c}" for c in self.consultas]
+        return "\n".join(lineas)
+
+@contextmanager
+def medir(base: SupabaseLocal) -> Iterator[Medicion]:
+    """Registra las consultas hechas dentro del bloque"""
+    desde = len(base.consultas)
+    medicion = Medicion([])
+    try:
+        yield medicion
+    finally:
+        esperar_segundo_plano()
+        medicion.consultas = list(base.consultas[desde:])
+
+def esperar_segundo_plano() -> None:
+    """Espera a las precargas lanzadas durante el render: sus consultas son parte de él"""
+    from utils import cache
+    with cache._detalles_lock:
+        en_vuelo = list(cache._en_vuelo.values())
+    for futuro in en_vuelo:
+        futuro.result(timeout=TIMEOUT_RENDER_SEG)
+
+# ==================== RENDER DE PÁGINAS ====================
+def renderizar_pagina(base: SupabaseLocal, ruta: str, user_id: Optional[str],
+                      session_state: Optional[Dict[str, Any]] = None,
+                      app: Optional[AppTest] = None) -> Tuple[AppTest, Medicion]:
+    """Ejecuta un rerun de la página (ruta relativa a la raíz del repo) y mide sus consultas.
+    Pasando `app` se hace otro rerun de la misma sesión (p. ej. tras cambiar un widget)."""
+    if app is None:
+        app = AppTest.from_file(os.path.join(RAIZ, ruta), default_timeout=TIMEOUT_RENDER_SEG)
+        app.session_state["user_id"] = user_id
+        app.session_state["usuario"] = "prueba@grino.cl"
+        for clave, valor in (session_state or {}).items():
+            app.session_state[clave] = valor
+    with medir(base) as medicion:
+        app.run()
+    if app.exception:
+        raise AssertionError(f"La página {ruta} falló: {[e.value for e in app.exception]}")
+    return app, medicion
+
+# ==================== AFIRMACIONES ====================
+def afirmar_presupuesto(medicion: Medicion, max_consultas: int, contexto: str = "") -> None:
+    """Falla si el render hizo más consultas en primer plano que las presupuestadas"""
+    hechas = len(medicion.en_primer_plano)
+    assert hechas <= max_consultas, (
+        f"{contexto or 'Render'}: {hechas} consultas en primer plano > presupuesto de {max_consultas}\n{medicion.resumen()}"
+    )
+
+def afirmar_sin_n_mas_1(medicion: Medicion, umbral: int = UMBRAL_N_MAS_1, contexto: str = "") -> None:
+    """Falla si alguna forma de consulta se repitió `umbral` veces o más"""
+    repetidas = medicion.n_mas_1(umbral)
+    assert not repetidas, (
+        f"{contexto or 'Render'}: posibles N+1\n" + "\n".join(f"  {r}" for r in repetidas) + f"\n{medicion.resumen()}"
+    )
@@ -0,0 +1,326 @@
+"""Stand-in local de Supabase para las pruebas: tablas en memoria detrás de la misma interfaz de
+PostgREST que usa la app (table(...).select(...).eq(...)...execute() y rpc(...).execute()).
+
+Cada execute() queda registrado como una Consulta (qué tabla o RPC, qué operaciones y desde qué
+hilo), así las pruebas pueden contar cuántas llamadas hace una página y detectar patrones N+1.
+Solo implementa lo que usa utils/: embeds por clave foránea (cliente:cliente_id(nombre)),
+hijos con conteo (items_en_presupuesto(count)), filtros simples, orden y rangos. Como Supabase,
+corta cada respuesta en max_filas (db-max-rows) sin avisar y responde 416 (PGRST103) a un rango
+con conteo que empieza después de la última fila.
+"""
+import copy
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from postgrest.exceptions import APIError
+
+# db-max-rows por defecto de Supabase: lo que pase de ahí no llega al cliente
+MAX_FILAS_POSTGREST = 1000
+
+# ==================== RELACIONES ====================
+# columna → tabla referenciada (embeds a uno: cliente:cliente_id(nombre))
+CLAVES_FORANEAS = {
+    'cliente_id': 'clientes',
+    'lugar_trabajo_id': 'lugares_trabajo',
+    'categoria_id': 'categorias',
+}
+# tabla padre → columna con la que la apuntan sus hijas (embeds a muchos: items_en_presupuesto(count))
+CLAVES_HIJAS = {
+    'presupuestos': 'presupuesto_id',
+    'presupuestos_archivo': 'presupuesto_id',
+    'clientes': 'cliente_id',
+}
+
+# ==================== REGISTRO DE CONSULTAS ====================
+@dataclass
+class Consulta:
+    """Una llamada a PostgREST: tabla (o 'rpc:nombre'), operaciones en orden e hilo que la hizo"""
+    objetivo: str
+    operaciones: List[Tuple[str, tuple, dict]]
+    hilo: str = field(default_factory=lambda: threading.current_thread().name)
+
+    @property
+    def forma(self) -> Tuple:
+        """La consulta sin los valores de los filtros: dos consultas con la misma forma piden lo
+        mismo a distintas filas (la firma de un N+1)"""
+        partes = []
+        for nombre, args, kwargs in self.operaciones:
+            if nombre in ('select', 'order'):
+                partes.append((nombre, args, tuple(sorted(kwargs.items()))))
+            elif nombre == 'params':
+                partes.append((nombre, tuple(sorted(args[0] or {}))))
+            else:
+                partes.append((nombre, args[:1]))
+        return (self.objetivo, tuple(partes))
+
+    @property
+    def clave(self) -> str:
+        """La consulta completa, con valores (dos iguales devuelven lo mismo)"""
+        return repr((self.objetivo, self.operaciones))
+
+    def __str__(self) -> str:
+        ops = ".".join(f"{n}({', '.join(map(repr, a))})" for n, a, _ in self.operaciones)
+        return f"{self.objetivo}.{ops}" if ops else self.objetivo
+
+class Respuesta:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+# ==================== CONSULTAS ====================
+def _partir(texto: str) -> List[str]:
+    """Separa por comas de primer nivel (respeta los paréntesis de los embeds)"""
+    partes, nivel, actual = [], 0, ''
+    for c in texto:
+        if c == ',' and nivel == 0:
+            partes.append(actual.strip())
+            actual = ''
+            continue
+        nivel += (c == '(') - (c == ')')
+        actual += c
+    if actual.strip():
+        partes.append(actual.strip())
+    return partes
+
+class ConsultaLocal:
+    """Constructor encadenable con la forma del de postgrest-py; resuelve todo en execute()"""
+
+    def __init__(self, base: "SupabaseLocal", objetivo: str):
+        self._base = base
+        self._objetivo = objetivo
+        self._ops: List[Tuple[str, tuple, dict]] = []
+
+    def _op(self, nombre: str, *args, **kwargs) -> "ConsultaLocal":
+        self._ops.append((nombre, args, kwargs))
+        return self
+
+    def select(self, *args, **kwargs): return self._op('select', *args, **kwargs)
+    def insert(self, *args, **kwargs): return self._op('insert', *args, **kwargs)
+    def upsert(self, *args, **kwargs): return self._op('upsert', *args, **kwargs)
+    def update(self, *args, **kwargs): return self._op('update', *args, **kwargs)
+    def delete(self, *args, **kwargs): return self._op('delete', *args, **kwargs)
+    def eq(self, *args): return self._op('eq', *args)
+    def neq(self, *args): return self._op('neq', *args)
+    def gt(self, *args): return self._op('gt', *args)
+    def gte(self, *args): return self._op('gte', *args)
+    def lt(self, *args): return self._op('lt', *args)
+    def lte(self, *args): return self._op('lte', *args)
+    def in_(self, *args): return self._op('in_', *args)
+    def is_(self, *args): return self._op('is_', *args)
+    def order(self, *args, **kwargs): return self._op('order', *args, **kwargs)
+    def range(self, *args): return self._op('range', *args)
+    def limit(self, *args): return self._op('limit', *args)
+
+    def execute(self) -> Respuesta:
+        self._base._registrar(Consulta(self._objetivo, list(self._ops)))
+        with self._base._lock:
+            if self._objetivo.startswith('rpc:'):
+                return self._base._rpc(self._objetivo[4:], self._ops[0][1][0] or {})
+            return self._base._tabla(self._objetivo, self._ops)
+
+# ==================== STAND-IN ====================
+class SupabaseLocal:
+    """Cliente con la interfaz de Supabase sobre tablas en memoria ({tabla: [filas]})"""
+
+    def __init__(self, tablas: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 max_filas: Optional[int] = MAX_FILAS_POSTGREST):
+        self.tablas: Dict[str, List[Dict[str, Any]]] = tablas or {}
+        self.max_filas = max_filas  # None: sin tope
+        self.consultas: List[Consulta] = []
+        self.rpcs: Dict[str, Callable[["SupabaseLocal", Dict[str, Any]], Any]] = {
+            'clientes_detallados': _rpc_clientes_detallados,
+            'buscar_presupuestos': _rpc_buscar_presupuestos,
+            'resumen_presupuestos': _rpc_resumen_presupuestos,
+        }
+        self._lock = threading.RLock()
+        self._ids: Dict[str, int] = {}
+
+    # --- interfaz de supabase-py ---
+    def table(self, nombre: str) -> ConsultaLocal:
+        return ConsultaLocal(self, nombre)
+
+    def rpc(self, nombre: str, params: Optional[Dict[str, Any]] = None) -> ConsultaLocal:
+        return ConsultaLocal(self, f"rpc:{nombre}")._op('params', params)
+
+    # --- registro ---
+    def _registrar(self, consulta: Consulta) -> None:
+        with self._lock:
+            self.consultas.append(consulta)
+
+    def reiniciar_registro(self) -> None:
+        with self._lock:
+            self.consultas.clear()
+
+    # --- datos ---
+    def insertar(self, tabla: str, fila: Dict[str, Any]) -> Dict[str, Any]:
+        fila = dict(fila)
+        if 'id' not in fila:
+            fila['id'] = self._ids.get(tabla, 0) + 1
+        self._ids[tabla] = max(self._ids.get(tabla, 0), fila['id'])
+        self.tablas.setdefault(tabla, []).append(fila)
+        return fila
+
+    def _rpc(self, nombre: str, params: Dict[str, Any]) -> Respuesta:
+        funcion = self.rpcs.get(nombre)
+        datos = copy.deepcopy(funcion(self, params)) if funcion else None
+        return Respuesta(datos[:self.max_filas] if isinstance(datos, list) and self.max_filas else datos)
+
+    def _tabla(self, tabla: str, ops: List[Tuple[str, tuple, dict]]) -> Respuesta:
+        filas = self.tablas.setdefault(tabla, [])
+        select, conteo, solo_conteo, orden, rango, escritura = '*', None, False, [], None, None
+        filtros = []
+        for nombre, args, kwargs in ops:
+            if nombre == 'select':
+                select = args[0] if args else '*'
+                conteo, solo_conteo = kwargs.get('count'), kwargs.get('head', False)
+            elif nombre in ('insert', 'upsert', 'update', 'delete'):
+                escritura = (nombre, args)
+            elif nombre == 'order':
+                orden.append((args[0], kwargs.get('desc', False)))
+            elif nombre == 'range':
+                rango = (args[0], args[1] + 1)
+            elif nombre == 'limit':
+                rango = (0, args[0])
+            else:
+                filtros.append((nombre, args))
+
+        seleccion = [f for f in filas if all(_cumple(f, op, args) for op, args in filtros)]
+        if escritura:
+            return Respuesta(self._escribir(tabla, escritura, seleccion))
+        for columna, desc in reversed(orden):
+            seleccion.sort(key=lambda f: (f.get(columna) is None, f.get(columna)), reverse=desc)
+        total = len(seleccion)
+        if rango and conteo and rango[0] > 0 and rango[0] >= total:
+            # Con el total conocido, PostgREST rechaza un rango que empieza después de la última fila
+            raise APIError({'code': 'PGRST103', 'message': 'Requested range not satisfiable',
+                            'details': f'An offset of {rango[0]} was requested, but there are only {total} rows.', 'hint': None})
+        if rango:
+            seleccion = seleccion[rango[0]:rango[1]]
+        if self.max_filas:
+            seleccion = seleccion[:self.max_filas]
+        datos = [] if solo_conteo else [self._proyectar(tabla, f, select) for f in seleccion]
+        return Respuesta(datos, total if conteo else None)
+
+    def _escribir(self, tabla: str, escritura: Tuple[str, tuple], seleccion: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        nombre, args = escritura
+        if nombre in ('insert', 'upsert'):
+            nuevas = args[0] if isinstance(args[0], list) else [args[0]]
+            return [self.insertar(tabla, f) for f in nuevas]
+        if nombre == 'update':
+            for fila in seleccion:
+                fila.update(args[0])
+            return [dict(f) for f in seleccion]
+        self.tablas[tabla] = [f for f in self.tablas[tabla] if f not in seleccion]
+        return [dict(f) for f in seleccion]
+
+    def _proyectar(self, tabla: str, fila: Dict[str, Any], select: str) -> Dict[str, Any]:
+        resultado: Dict[str, Any] = {}
+        for campo in _partir(select):
+            if campo == '*':
+                resultado.update(copy.deepcopy(fila))
+                continue
+            if '(' not in campo:
+                resultado[campo] = copy.deepcopy(fila.get(campo))
+                continue
+            cabeza, sub = campo.split('(', 1)
+            sub = sub[:-1]
+            alias, _, destino = cabeza.partition(':') if ':' in cabeza else (cabeza, '', cabeza)
+            if destino in CLAVES_FORANEAS:
+                # Embed a uno por clave foránea
+                referida = next((f for f in self.tablas.get(CLAVES_FORANEAS[destino], []) if f['id'] == fila.get(destino)), None)
+                resultado[alias] = self._proyectar(CLAVES_FORANEAS[destino], referida, sub) if referida else None
+            else:
+                # Embed a muchos: filas de la tabla hija que apuntan a esta
+                columna = CLAVES_HIJAS[tabla]
+                hijas = [f for f in self.tablas.get(destino, []) if f.get(columna) == fila['id']]
+                resultado[alias] = [{'count': len(hijas)}] if sub.strip() == 'count' else [self._proyectar(destino, f, sub) for f in hijas]
+        return resultado
+
+def _cumple(fila: Dict[str, Any], op: str, args: tuple) -> bool:
+    columna, valor = args[0], args[1] if len(args) > 1 else None
+    actual = fila.get(columna)
+    if op == 'eq':
+        return str(actual) == str(valor)
+    if op == 'neq':
+        return str(actual) != str(valor)
+    if op == 'in_':
+        return str(actual) in {str(v) for v in valor}
+    if op == 'is_':
+        return actual is None if valor in (None, 'null') else actual == valor
+    if actual is None:
+        return False
+    actual, valor = _comparable(actual), _comparable(valor)
+    return {'gt': actual > valor, 'gte': actual >= valor, 'lt': actual < valor, 'lte': actual <= valor}[op]
+
+def _comparable(valor: Any) -> Any:
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+# ==================== RPC ====================
+def _rpc_clientes_detallados(base: SupabaseLocal, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    busqueda = (params.get('p_busqueda') or '').lower()
+    clientes = sorted((c for c in base.tablas.get('clientes', [])
+                       if str(c.get('creado_por')) == params['p_user_id'] and busqueda in c['nombre'].lower()),
+                      key=lambda c: c['nombre'])
+    filas = []
+    for c in clientes:
+        suyos = [p for tabla in ('presupuestos', 'presupuestos_archivo')
+                 for p in base.tablas.get(tabla, []) if p.get('cliente_id') == c['id']]
+        filas.append({
+            'id': c['id'], 'nombre': c['nombre'], 'alias': c.get('alias'), 'fecha_registro': c.get('fecha_registro'),
+            'num_presupuestos': len(suyos), 'total_cotizado': sum(p['total'] for p in suyos),
+            'ultimo_presupuesto': max((p['fecha_creacion'] for p in suyos), default=None),
+            'total_clientes': len(clientes),
+        })
+    return filas[params['p_offset']:params['p_offset'] + params['p_limit']]
+
+def _rpc_buscar_presupuestos(base: SupabaseLocal, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    texto = params['p_query'].lower()
+    coincidencias = [p for p in base.tablas.get('presupuestos', [])
+                     if str(p.get('creado_por')) == params['p_user_id'] and texto in (p.get('descripcion') or '').lower()]
+    suma = sum(p['total'] for p in coincidencias)
+    pagina = coincidencias[params['p_offset']:params['p_offset'] + params['p_limit']]
+    return [{
+        'id': p['id'], 'fecha_creacion': p['fecha_creacion'], 'total': p['total'], 'descripcion': p['descripcion'],
+        'cliente': None, 'lugar': None, 'coincidencia': p['descripcion'], 'relevancia': 1.0,
+        'archivado': False, 'total_hits': len(coincidencias), 'suma_hits': suma,
+    } for p in pagina]
+
+def _rpc_resumen_presupuestos(base: SupabaseLocal, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    tablas = ['presupuestos', 'presupuestos_archivo'] if params.get('p_incluir_archivo') else ['presupuestos']
+    filtrados = [p for t in tablas for p in base.tablas.get(t, [])
+                 if str(p.get('creado_por')) == params['p_user_id']
+                 and (params.get('p_cliente_id') is None or p.get('cliente_id') == params['p_cliente_id'])
+                 and (params.get('p_lugar_trabajo_id') is None or p.get('lugar_trabajo_id') == params['p_lugar_trabajo_id'])
+                 and (params.get('p_fecha_inicio') is None or p['fecha_creacion'] >= params['p_fecha_inicio'])]
+    return [{'num_presupuestos': len(filtrados), 'suma': sum(p['total'] for p in filtrados)}]
+
+# ==================== DATOS DE PRUEBA ====================
+def sembrar(base: SupabaseLocal, user_id: str, presupuestos: int, items_por_presupuesto: int = 3,
+            clientes: int = 10, lugares: int = 5, categorias: int = 4) -> SupabaseLocal:
+    """Llena el stand-in con catálogos y presupuestos de un usuario (fechas de más nueva a más antigua)"""
+    hoy = datetime(2026, 1, 1)
+    ids_clientes = [base.insertar('clientes', {'nombre': f'cliente {i}', 'creado_por': user_id,
+                                               'fecha_registro': hoy.isoformat()})['id'] for i in range(clientes)]
+    ids_lugares = [base.insertar('lugares_trabajo', {'nombre': f'lugar {i}', 'creado_por': user_id})['id'] for i in range(lugares)]
+    ids_categorias = [base.insertar('categorias', {'nombre': f'categoria {i}', 'creado_por': user_id})['id'] for i in range(categorias)]
+    for i in range(presupuestos):
+        presupuesto = base.insertar('presupuestos', {
+            'creado_por': user_id,
+            'cliente_id': ids_clientes[i % clientes],
+            'lugar_trabajo_id': ids_lugares[i % lugares],
+            'fecha_creacion': (hoy - timedelta(days=i)).isoformat(),
+            'descripcion': f'presupuesto {i}',
+            'total': 1000 * items_por_presupuesto,
+            'version': 1,
+        })
+        for j in range(items_por_presupuesto):
+            base.insertar('items_en_presupuesto', {
+                'presupuesto_id': presupuesto['id'], 'creado_por': user_id,
+                'categoria_id': ids_categorias[j % categorias], 'nombre_personalizado': f'item {j}',
+                'unidad': 'un', 'cantidad': 1, 'precio_unitario': 1000, 'total': 1000, 'notas': '',
+            })
+        base.insertar('mano_obra_presupuesto', {
+            'presupuesto_id': presupuesto['id'], 'categoria_id': ids_categorias[0], 'monto': 0,
+        })
+    return base
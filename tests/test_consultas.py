@@ -0,0 +1,195 @@
+"""Presupuestos de consultas por render y detección de N+1 (ver tests/medicion.py)"""
+import pytest
+from conftest import USER_ID
+from medicion import afirmar_presupuesto, afirmar_sin_n_mas_1, medir, renderizar_pagina
+from supabase_local import sembrar
+
+PAGINA_HISTORIAL = "pages/2_🕒_historial.py"
+PAGINA_PRESUPUESTOS = "pages/1_📄_presupuestos.py"
+PAGINA_CLIENTES = "pages/3_👥_clientes.py"
+
+# Historial en frío: catálogos (3 lecturas en paralelo, compartidas entre sesiones) + página con conteo + suma
+MAX_CONSULTAS_HISTORIAL = 5
+# Con los catálogos ya en caché (p. ej. tras el precalentamiento del login): página con conteo + suma
+MAX_CONSULTAS_HISTORIAL_CATALOGOS_LISTOS = 3
+# Vistas previas de las primeras filas: cabeceras e ítems, en un solo lote
+MAX_CONSULTAS_PRECARGA = 2
+
+def archivar(base, desde_id: int) -> None:
+    """Mueve al archivo los presupuestos sembrados desde `desde_id` (los más antiguos) y sus ítems"""
+    for presupuesto in [p for p in base.tablas['presupuestos'] if p['id'] >= desde_id]:
+        base.tablas['presupuestos'].remove(presupuesto)
+        base.insertar('presupuestos_archivo', presupuesto)
+        for item in [i for i in base.tablas['items_en_presupuesto'] if i['presupuesto_id'] == presupuesto['id']]:
+            base.tablas['items_en_presupuesto'].remove(item)
+            base.insertar('items_en_presupuesto_archivo', item)
+
+# ==================== HISTORIAL ====================
+@pytest.mark.parametrize("presupuestos", [20, 500])
+def test_historial_no_crece_con_los_presupuestos(supabase_local, presupuestos):
+    sembrar(supabase_local, USER_ID, presupuestos)
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID)
+
+    assert app.metric[0].value == str(presupuestos)
+    assert app.metric[1].value == f"${presupuestos * 3000:,.0f}"
+    afirmar_presupuesto(medicion, MAX_CONSULTAS_HISTORIAL, f"Historial con {presupuestos} presupuestos")
+    assert len(medicion.en_segundo_plano) <= MAX_CONSULTAS_PRECARGA, medicion.resumen()
+    afirmar_sin_n_mas_1(medicion, contexto=f"Historial con {presupuestos} presupuestos")
+
+def test_historial_con_catalogos_en_cache(supabase_local):
+    from utils.cache import get_catalogos
+    sembrar(supabase_local, USER_ID, 500)
+    get_catalogos(USER_ID)
+
+    _, medicion = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID)
+
+    afirmar_presupuesto(medicion, MAX_CONSULTAS_HISTORIAL_CATALOGOS_LISTOS, "Historial con 500 presupuestos")
+
+def test_historial_rerun_no_consulta(supabase_local):
+    sembrar(supabase_local, USER_ID, 50)
+    app, _ = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID)
+
+    _, medicion = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID, app=app)
+
+    assert medicion.total == 0, medicion.resumen()
+
+def test_historial_pagina_siguiente_una_consulta(supabase_local):
+    sembrar(supabase_local, USER_ID, 50)
+    app, _ = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID)
+
+    next(b for b in app.button if b.label == "Siguiente ▶").click()
+    # El clic cambia de página y pide otro rerun: se mide la página nueva
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_HISTORIAL, USER_ID, app=app)
+
+    assert "Página 2 de 3" in [m.value for m in app.markdown if "Página" in m.value][0]
+    afirmar_presupuesto(medicion, 1, "Historial, página 2")
+
+def test_historial_paginas_solo_del_archivo(supabase_local):
+    from utils.database import get_presupuestos_pagina
+    sembrar(supabase_local, USER_ID, 10)
+    archivar(supabase_local, desde_id=3)
+
+    # Página 3 de 4 (por_pagina=3): todas sus filas están en el archivo, más allá de las 2 activas
+    filas, total = get_presupuestos_pagina(USER_ID, {'incluir_archivo': True}, pagina=2, por_pagina=3)
+
+    assert total == 10
+    assert [f['id'] for f in filas] == [7, 8, 9]
+    assert all(f['archivado'] for f in filas)
+
+# ==================== OTRAS PÁGINAS ====================
+def test_presupuestos_carga_catalogos_una_vez(supabase_local):
+    sembrar(supabase_local, USER_ID, 20)
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_PRESUPUESTOS, USER_ID)
+
+    assert medicion.por_objetivo() == {'clientes': 1, 'lugares_trabajo': 1, 'categorias': 1}
+    _, medicion = renderizar_pagina(supabase_local, PAGINA_PRESUPUESTOS, USER_ID, app=app)
+    assert medicion.total == 0, medicion.resumen()
+
+def test_clientes_una_consulta_por_pagina(supabase_local):
+    sembrar(supabase_local, USER_ID, 100, clientes=60)
+    _, medicion = renderizar_pagina(supabase_local, PAGINA_CLIENTES, USER_ID)
+
+    assert medicion.por_objetivo().get('rpc:clientes_detallados') == 1, medicion.resumen()
+    afirmar_sin_n_mas_1(medicion, contexto="Clientes")
+
+def test_clientes_fusion_consulta_solo_al_pedirla(supabase_local):
+    sembrar(supabase_local, USER_ID, 20, clientes=60)
+    supabase_local.rpcs['clientes_similares'] = lambda base, params: []
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_CLIENTES, USER_ID)
+    assert 'rpc:clientes_similares' not in medicion.por_objetivo(), medicion.resumen()
+
+    next(b for b in app.button if b.label == "🔍 Buscar duplicados").click()
+    app, medicion = renderizar_pagina(supabase_local, PAGINA_CLIENTES, USER_ID, app=app)
+    assert medicion.por_objetivo().get('rpc:clientes_similares') == 1, medicion.resumen()
+    # El cliente que se conserva puede ser cualquiera, no solo uno de los 48 de la página
+    assert len(app.selectbox(key="fusion_destino").options) == 60
+
+    _, medicion = renderizar_pagina(supabase_local, PAGINA_CLIENTES, USER_ID, app=app)
+    assert medicion.total == 0, medicion.resumen()
+
+# ==================== DETALLES ====================
+def test_precarga_de_detalles_en_lote(supabase_local):
+    from utils.cache import get_detalle_cacheado, prefetch_detalles
+    sembrar(supabase_local, USER_ID, 30)
+
+    with medir(supabase_local) as medicion:
+        prefetch_detalles(list(range(1, 11)))
+    assert medicion.total == MAX_CONSULTAS_PRECARGA, medicion.resumen()
+
+    with medir(supabase_local) as medicion:
+        detalle = get_detalle_cacheado(1)
+    assert medicion.total == 0 and detalle['id'] == 1
+
+def test_detalles_archivados_en_lote(supabase_local):
+    from utils.database import get_presupuestos_detallados
+    sembrar(supabase_local, USER_ID, 10)
+    # Los dos más antiguos pasan al archivo
+    archivar(supabase_local, desde_id=9)
+
+    with medir(supabase_local) as medicion:
+        detalles = get_presupuestos_detallados([1, 2, 9, 10])
+
+    assert sorted(detalles) == [1, 2, 9, 10]
+    assert [detalles[i]['archivado'] for i in (1, 9)] == [False, True]
+    assert all(len(d['items']) == 3 for d in detalles.values())
+    assert medicion.total == 4, medicion.resumen()
+
+def test_detalles_en_lote_pasan_el_tope_de_filas(supabase_local):
+    from utils.database import get_presupuestos_detallados
+    # 400 presupuestos × 3 ítems: más filas que las que PostgREST devuelve en una respuesta
+    sembrar(supabase_local, USER_ID, 400)
+    assert len(supabase_local.table('items_en_presupuesto').select('id').execute().data) == 1000
+
+    with medir(supabase_local) as medicion:
+        detalles = get_presupuestos_detallados(list(range(1, 401)))
+
+    assert len(detalles) == 400
+    assert all(len(d['items']) == 3 for d in detalles.values())
+    assert medicion.por_objetivo() == {'presupuestos': 1, 'items_en_presupuesto': 2}, medicion.resumen()
+
+def test_versiones_de_presupuesto_archivado(supabase_local):
+    from utils.database import get_versiones_presupuesto
+    sembrar(supabase_local, USER_ID, 3)
+    supabase_local.insertar('presupuesto_versiones_archivo', {
+        'presupuesto_id': 3, 'version': 1, 'creado_en': '2024-01-01T00:00:00',
+        'cabecera': {'descripcion': 'antes'}, 'items': [], 'mano_obra': [],
+    })
+
+    versiones = get_versiones_presupuesto(3)
+
+    assert [v['version'] for v in versiones] == [1]
+    assert versiones[0]['cambios_cabecera'] == ['descripcion']
+
+# ==================== ANALÍTICA ====================
+def test_analitica_pasa_el_tope_de_filas(supabase_local):
+    from utils.database import get_analitica_mensual
+    # 1200 combinaciones de mes × lugar × categoría: más de lo que PostgREST devuelve en una respuesta
+    for i in range(1200):
+        supabase_local.insertar('analitica_mensual', {
+            'creado_por': USER_ID, 'mes': f'{2000 + i // 12}-{i % 12 + 1:02d}-01', 'cliente_id': None,
+            'lugar_trabajo_id': None, 'categoria_id': i % 3, 'materiales': 1, 'mano_obra': 0, 'num_items': 1,
+        })
+
+    with medir(supabase_local) as medicion:
+        filas = get_analitica_mensual(USER_ID)
+
+    assert sum(f['materiales'] for f in filas) == 1200
+    assert medicion.por_objetivo() == {'analitica_mensual': 2}, medicion.resumen()
+
+# ==================== EL DETECTOR ====================
+def test_detecta_n_mas_1(supabase_local):
+    from utils.database import get_clientes, get_presupuesto_detallado
+    sembrar(supabase_local, USER_ID, 5)
+
+    with medir(supabase_local) as medicion:
+        for presupuesto_id in (1, 2, 3):
+            get_presupuesto_detallado(presupuesto_id)
+        get_clientes(USER_ID)
+        get_clientes(USER_ID)
+
+    repetidas = {r.ejemplo.objetivo: r for r in medicion.n_mas_1()}
+    assert repetidas['presupuestos'].veces == 3 and not repetidas['presupuestos'].identicas
+    assert repetidas['items_en_presupuesto'].veces == 3
+    assert repetidas['clientes'].veces == 2 and repetidas['clientes'].identicas
+    with pytest.raises(AssertionError, match="posibles N\\+1"):
+        afirmar_sin_n_mas_1(medicion)
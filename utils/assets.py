@@ -0,0 +1,55 @@
+import hashlib
+import io
+import os
+from functools import lru_cache
+from typing import Union
+
+# ==================== CONFIGURACIÓN ====================
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "thumbnails")
+# Las tarjetas muestran las imágenes a 150 px; se genera al doble para pantallas de alta densidad
+ANCHO_MINIATURA = 300
+CALIDAD_WEBP = 80
+
+# ==================== MINIATURAS ====================
+def _ruta_cache(ruta: str, mtime_ns: int, ancho: int) -> str:
+    clave = hashlib.sha1(f"{os.path.abspath(ruta)}:{mtime_ns}:{ancho}".encode()).hexdigest()[:16]
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    return os.path.join(CACHE_DIR, f"{nombre}-{ancho}-{clave}.webp")
+
+def _generar_miniatura(ruta: str, ancho: int) -> bytes:
+    from PIL import Image, ImageOps
+    with Image.open(ruta) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > ancho:
+            alto = round(img.height * ancho / img.width)
+            img = img.resize((ancho, alto), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="WEBP", quality=CALIDAD_WEBP, method=6)
+        return buffer.getvalue()
+
+@lru_cache(maxsize=32)
+def _miniatura(ruta: str, mtime_ns: int, ancho: int) -> bytes:
+    """Bytes de la miniatura; primero memoria, luego disco, y solo si falta se genera"""
+    destino = _ruta_cache(ruta, mtime_ns, ancho)
+    if os.path.exists(destino):
+        with open(destino, "rb") as f:
+            return f.read()
+    datos = _generar_miniatura(ruta, ancho)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, destino)
+    return datos
+
+def get_thumbnail(ruta: str, ancho: int = ANCHO_MINIATURA) -> Union[bytes, str]:
+    """Miniatura WebP cacheada por mtime del archivo; si no se puede generar, devuelve la ruta original"""
+    try:
+        return _miniatura(ruta, os.stat(ruta).st_mtime_ns, ancho)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        print(f"Error al generar miniatura de {ruta}: {e}")
+        return ruta
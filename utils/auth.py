@@ -1,5 +1,5 @@
 import streamlit as st
-from utils.db import get_supabase_client 
+from utils.db import crear_cliente_sesion, registrar_sesion, cerrar_sesion_cliente
 
 def check_login() -> bool:
     """Verifica si el usuario está logueado."""
@@ -7,11 +7,13 @@ def check_login() -> bool:
 
 def authenticate(email: str, password: str) -> bool:
     """Autentica credenciales usando Supabase Auth (email/password)."""
-    supabase = get_supabase_client()
+    # Cliente propio de esta sesión: el login no altera el estado de auth de otros usuarios
+    supabase = crear_cliente_sesion()
     try:
         response = supabase.auth.sign_in_with_password({"email": email, "password": password})
         
         if response.user:
+            registrar_sesion(supabase, response.session)
             st.session_state.user = response.user
             st.session_state.user_id = response.user.id
             st.session_state.usuario = email
@@ -25,7 +27,7 @@ def authenticate(email: str, password: str) -> bool:
 
 def register_user(email: str, password: str) -> bool:
     """Registra un nuevo usuario en Supabase Auth."""
-    supabase = get_supabase_client()
+    supabase = crear_cliente_sesion()
     try:
         # Limpiar y normalizar el email
         clean_email = email.strip().lower()
@@ -56,9 +58,8 @@ def register_user(email: str, password: str) -> bool:
 
 def sign_out():
     """Cierra la sesión del usuario."""
-    supabase = get_supabase_client()
     try:
-        supabase.auth.sign_out()
+        cerrar_sesion_cliente()
     except Exception as e:
         print(f"Error al cerrar sesión: {e}")
         
@@ -68,7 +69,7 @@ def sign_out():
         if key in st.session_state:
             del st.session_state[key]
             
-    # Limpiar estados de expanders
+    # Limpiar cachés y estados del historial
     for key in list(st.session_state.keys()):
-        if key.startswith('expander_toggle_'):
+        if key.startswith('historial_') or key.startswith('hist_'):
             del st.session_state[key]
\ No newline at end of file
@@ -0,0 +1,317 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import streamlit as st
+from utils import cambios
+from utils.database import (
+    buscar_presupuestos,
+    ejecutar_en_paralelo,
+    get_categorias_async,
+    get_clientes_async,
+    get_lugares_trabajo_async,
+    get_presupuestos_detallados,
+    get_presupuesto_version,
+    get_presupuestos_pagina,
+    get_resumen_presupuestos,
+)
+from utils.db import con_cliente_actual
+
+# ==================== CONFIGURACIÓN ====================
+HISTORIAL_KEY = 'historial_paginas'
+PAGINA_ACTUAL_KEY = 'historial_pagina'
+POR_PAGINA = 20
+
+# Tablas de las que depende cada caché: un aviso de cambio en ellas (de ese usuario) la invalida
+TABLAS_HISTORIAL = ('presupuestos', 'clientes', 'lugares_trabajo')
+TABLAS_CATALOGOS = ('clientes', 'lugares_trabajo', 'categorias')
+TABLAS_CLIENTES = ('clientes', 'presupuestos')
+
+def version_datos(user_id: str, tablas: Tuple[str, ...]) -> Tuple[int, ...]:
+    """Versión de los datos del usuario en esas tablas; se usa como parte de la clave de caché"""
+    cambios.get_escucha_cambios()
+    return cambios.version(tablas, user_id)
+
+# ==================== PÁGINAS DEL HISTORIAL ====================
+def _clave_filtros(user_id: str, filtros: Dict[str, Any]) -> Tuple:
+    return (user_id,) + tuple(sorted((k, str(v)) for k, v in filtros.items()))
+
+def _estado_historial(user_id: str, filtros: Dict[str, Any]) -> Dict[str, Any]:
+    """Devuelve la caché de páginas de la sesión, reiniciándola si cambiaron los filtros"""
+    clave = _clave_filtros(user_id, filtros)
+    version = version_datos(user_id, TABLAS_HISTORIAL)
+    estado = st.session_state.get(HISTORIAL_KEY)
+    if not estado or estado['clave'] != clave:
+        estado = {'clave': clave, 'version': version, 'paginas': {}, 'total_filas': None, 'suma': None}
+        _usar_precarga_historial(estado)
+        st.session_state[HISTORIAL_KEY] = estado
+        st.session_state[PAGINA_ACTUAL_KEY] = 0
+    elif estado['version'] != version:
+        # Otro usuario/pestaña cambió datos: se recargan las páginas sin mover al usuario de página
+        estado.update({'version': version, 'paginas': {}, 'total_filas': None, 'suma': None})
+    return estado
+
+def get_pagina_historial(user_id: str, filtros: Dict[str, Any], pagina: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Página del historial; solo consulta la DB la primera vez que se pide cada página.
+    Si filtros trae 'busqueda', la página sale de la búsqueda por relevancia."""
+    estado = _estado_historial(user_id, filtros)
+    if pagina not in estado['paginas']:
+        if filtros.get('busqueda'):
+            filas, total_filas, suma = buscar_presupuestos(user_id, filtros['busqueda'], pagina, POR_PAGINA, bool(filtros.get('incluir_archivo')))
+            estado['suma'] = suma
+        else:
+            filas, total_filas = get_presupuestos_pagina(user_id, filtros, pagina, POR_PAGINA)
+        estado['paginas'][pagina] = filas
+        estado['total_filas'] = total_filas
+    return estado['paginas'][pagina], estado['total_filas'] or 0
+
+def get_suma_historial(user_id: str, filtros: Dict[str, Any]) -> float:
+    """Suma de los totales filtrados, cacheada junto a las páginas"""
+    estado = _estado_historial(user_id, filtros)
+    if estado['suma'] is None:
+        _, estado['suma'] = get_resumen_presupuestos(user_id, filtros)
+    return estado['suma']
+
+def _usar_precarga_historial(estado: Dict[str, Any]) -> None:
+    """Si el precalentamiento tras el login ya trajo la primera página con estos filtros y con
+    la misma versión de datos, se usa en vez de consultar"""
+    with _precargas_lock:
+        precarga = _precargas_historial.pop(estado['clave'], None)
+    if precarga and precarga['version'] == estado['version'] and time.monotonic() - precarga['creada'] < MAX_EDAD_PRECARGA_SEG:
+        if 'pagina' in precarga:
+            estado['paginas'][0] = precarga['pagina']
+            estado['total_filas'] = precarga['total_filas']
+        estado['suma'] = precarga.get('suma')
+
+def invalidar_historial() -> None:
+    """Descarta las páginas cacheadas (llamar tras crear, editar o eliminar presupuestos)"""
+    st.session_state.pop(HISTORIAL_KEY, None)
+
+# ==================== DETALLE DE PRESUPUESTOS ====================
+MAX_DETALLES = 256
+PREFETCH_FILAS = 5
+
+_detalles: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_duenos: Dict[int, Optional[str]] = {}
+_en_vuelo: Dict[int, Future] = {}
+_detalles_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="grino-prefetch")
+
+def _preparar_detalle(detalle: Dict[str, Any]) -> Dict[str, Any]:
+    """Normaliza los ítems, los agrupa por categoría y convierte números de forma vectorizada.
+    Los montos quedan tal cual (numeric(12,2)): el PDF sale de aquí y redondear perdería centavos."""
+    import pandas as pd  # la primera vista de un detalle paga la importación, no el arranque
+    columnas = ['id', 'nombre', 'unidad', 'cantidad', 'precio_unitario', 'total', 'notas', 'categoria', 'categoria_id']
+    df = pd.DataFrame(detalle.get('items') or [])
+    if df.empty:
+        df = pd.DataFrame(columns=columnas)
+    if 'nombre_personalizado' in df.columns:
+        df['nombre'] = df['nombre_personalizado']
+    if 'categoria' in df.columns:
+        # El embed de PostgREST devuelve {'nombre': ...}; se aplana a texto
+        df['categoria'] = [c.get('nombre') if isinstance(c, dict) else c for c in df['categoria']]
+    for col in columnas:
+        if col not in df.columns:
+            df[col] = None
+    df['categoria'] = df['categoria'].fillna('Sin Categoría').replace('', 'Sin Categoría')
+    df['nombre'] = df['nombre'].fillna('').astype(str)
+    df['notas'] = df['notas'].fillna('')
+    for col in ['cantidad', 'precio_unitario', 'total']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
+
+    # La mano de obra viene aparte, un monto por categoría
+    mano_obra_por_cat: Dict[str, float] = {}
+    for fila in detalle.get('mano_obra') or []:
+        cat = (fila.get('categoria') or {}).get('nombre') or 'Sin Categoría'
+        mano_obra_por_cat[cat] = mano_obra_por_cat.get(cat, 0.0) + float(fila.get('monto') or 0)
+
+    grupos = dict(tuple(df.groupby('categoria', sort=False)))
+    vacio = df.iloc[0:0]
+    categorias = {}
+    total_general = 0.0
+    for cat in list(grupos) + [c for c in mano_obra_por_cat if c not in grupos]:
+        items = grupos.get(cat, vacio)
+        mano_obra = mano_obra_por_cat.get(cat, 0.0)
+        total_categoria = float(items['total'].sum()) + mano_obra
+        total_general += total_categoria
+        categorias[cat] = {
+            'items': items[['id', 'nombre', 'unidad', 'cantidad', 'precio_unitario', 'total', 'notas']].reset_index(drop=True),
+            'mano_obra': mano_obra,
+            'total': total_categoria
+        }
+
+    return {
+        'id': detalle['id'],
+        'creado_por': detalle.get('creado_por'),
+        'version': detalle.get('version', 1),
+        'fecha': detalle.get('fecha'),
+        'descripcion': detalle.get('descripcion') or '',
+        'total': detalle.get('total', 0),
+        'cliente': detalle.get('cliente') or {},
+        'lugar': detalle.get('lugar') or {},
+        'categorias': categorias,
+        'total_general': total_general
+    }
+
+def _cargar_detalles(presupuesto_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Trae y prepara varios detalles con una sola lectura (no una por presupuesto)"""
+    detalles = get_presupuestos_detallados(presupuesto_ids)
+    preparados = {presupuesto_id: _preparar_detalle(d) for presupuesto_id, d in detalles.items()}
+    with _detalles_lock:
+        for presupuesto_id in presupuesto_ids:
+            _en_vuelo.pop(presupuesto_id, None)
+        for presupuesto_id, preparado in preparados.items():
+            _detalles[presupuesto_id] = preparado
+            _duenos[presupuesto_id] = None if preparado['creado_por'] is None else str(preparado['creado_por'])
+        while len(_detalles) > MAX_DETALLES:
+            viejo, _ = _detalles.popitem(last=False)
+            _duenos.pop(viejo, None)
+    return preparados
+
+def get_detalle_cacheado(presupuesto_id: int) -> Optional[Dict[str, Any]]:
+    """Detalle preparado de un presupuesto; reutiliza la caché o una precarga en curso"""
+    with _detalles_lock:
+        if presupuesto_id in _detalles:
+            _detalles.move_to_end(presupuesto_id)
+            return _detalles[presupuesto_id]
+        futuro = _en_vuelo.get(presupuesto_id)
+    if futuro is not None:
+        return futuro.result().get(presupuesto_id)
+    return _cargar_detalles([presupuesto_id]).get(presupuesto_id)
+
+def prefetch_detalles(presupuesto_ids: List[int]) -> None:
+    """Precarga en segundo plano, en un solo lote, los detalles que aún no están en caché"""
+    cambios.get_escucha_cambios()
+    # Los hilos del executor no tienen sesión de Streamlit: se les pasa el cliente de esta
+    cargar = con_cliente_actual(_cargar_detalles)
+    with _detalles_lock:
+        faltan = [i for i in presupuesto_ids[:PREFETCH_FILAS] if i not in _detalles and i not in _en_vuelo]
+        if not faltan:
+            return
+        futuro = _executor.submit(cargar, faltan)
+        for presupuesto_id in faltan:
+            _en_vuelo[presupuesto_id] = futuro
+
+def invalidar_detalle(presupuesto_id: int) -> None:
+    """Descarta el detalle cacheado (llamar tras editar o eliminar el presupuesto)"""
+    with _detalles_lock:
+        _detalles.pop(presupuesto_id, None)
+        _duenos.pop(presupuesto_id, None)
+
+def _invalidar_detalles_por_cambio(cambio: Dict[str, Any]) -> None:
+    """Un presupuesto con ids: solo esos. Sin ids, o si cambió un cliente/lugar/categoría que el
+    detalle muestra por nombre: todos los del usuario (y los de dueño desconocido)"""
+    if cambio['tabla'] == 'presupuestos' and cambio.get('ids'):
+        for presupuesto_id in cambio['ids']:
+            invalidar_detalle(presupuesto_id)
+        return
+    usuario = str(cambio['creado_por'])
+    with _detalles_lock:
+        for presupuesto_id, dueno in list(_duenos.items()):
+            if cambio['tabla'] == '*' or dueno is None or dueno == usuario:
+                _detalles.pop(presupuesto_id, None)
+                _duenos.pop(presupuesto_id, None)
+
+cambios.suscribir(_invalidar_detalles_por_cambio)
+
+# Las versiones anteriores no cambian nunca: se guardan sin invalidación (solo el límite de tamaño)
+MAX_VERSIONES = 64
+_versiones: "OrderedDict[Tuple[int, int], Dict[str, Any]]" = OrderedDict()
+
+def get_detalle_version(presupuesto_id: int, version: int) -> Optional[Dict[str, Any]]:
+    """Detalle preparado de una versión anterior del presupuesto"""
+    clave = (presupuesto_id, version)
+    with _detalles_lock:
+        if clave in _versiones:
+            _versiones.move_to_end(clave)
+            return _versiones[clave]
+    detalle = get_presupuesto_version(presupuesto_id, version)
+    preparado = _preparar_detalle(detalle) if detalle else None
+    if preparado and preparado['version'] == version:
+        with _detalles_lock:
+            _versiones[clave] = preparado
+            while len(_versiones) > MAX_VERSIONES:
+                _versiones.popitem(last=False)
+    return preparado
+
+# ==================== CATÁLOGOS ====================
+MAX_CATALOGOS = 256
+# Red de seguridad: las lecturas devuelven [] si fallan, y eso no debe quedar guardado indefinidamente
+MAX_EDAD_CATALOGOS_SEG = 300
+
+_catalogos: "OrderedDict[str, Tuple[Tuple[int, ...], float, Dict[str, List[Tuple[int, str]]]]]" = OrderedDict()
+_catalogos_lock = threading.Lock()
+
+def get_catalogos(user_id: str) -> Dict[str, List[Tuple[int, str]]]:
+    """Clientes, lugares y categorías del usuario, compartidos entre sesiones hasta que llegue un aviso
+    de cambio; si hay que leerlos, las tres consultas van a la vez"""
+    version = version_datos(user_id, TABLAS_CATALOGOS)
+    with _catalogos_lock:
+        guardado = _catalogos.get(str(user_id))
+        if guardado and guardado[0] == version and time.monotonic() - guardado[1] < MAX_EDAD_CATALOGOS_SEG:
+            _catalogos.move_to_end(str(user_id))
+            return guardado[2]
+    clientes, lugares, categorias = ejecutar_en_paralelo(
+        get_clientes_async(user_id),
+        get_lugares_trabajo_async(user_id),
+        get_categorias_async(user_id),
+    )
+    datos = {'clientes': clientes, 'lugares': lugares, 'categorias': categorias}
+    with _catalogos_lock:
+        _catalogos[str(user_id)] = (version, time.monotonic(), datos)
+        while len(_catalogos) > MAX_CATALOGOS:
+            _catalogos.popitem(last=False)
+    return datos
+
+# ==================== PRECALENTAMIENTO TRAS EL LOGIN ====================
+# Mientras el usuario ve la portada se traen en segundo plano, a la vez, lo que van a pedir
+# presupuestos e historial: catálogos (clientes, lugares, categorías), la primera página del
+# historial sin filtros con su suma, y el renderizador de PDF listo.
+MAX_PRECARGAS = 64
+MAX_EDAD_PRECARGA_SEG = 300
+
+_precargas_historial: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+_precargas_lock = threading.Lock()
+
+def _guardar_precarga(clave: Tuple, version: Tuple[int, ...], datos: Dict[str, Any]) -> None:
+    with _precargas_lock:
+        precarga = _precargas_historial.get(clave)
+        if not precarga or precarga['version'] != version:
+            precarga = _precargas_historial[clave] = {'version': version, 'creada': time.monotonic()}
+        precarga.update(datos)
+        while len(_precargas_historial) > MAX_PRECARGAS:
+            _precargas_historial.popitem(last=False)
+
+def _precargar_pagina(user_id: str, clave: Tuple, version: Tuple[int, ...]) -> None:
+    filas, total_filas = get_presupuestos_pagina(user_id, {}, 0, POR_PAGINA)
+    # Las lecturas devuelven vacío si fallan: una página vacía no se guarda, se consultará al entrar
+    if filas:
+        _guardar_precarga(clave, version, {'pagina': filas, 'total_filas': total_filas})
+
+def _precargar_suma(user_id: str, clave: Tuple, version: Tuple[int, ...]) -> None:
+    _, suma = get_resumen_presupuestos(user_id, {})
+    if suma:
+        _guardar_precarga(clave, version, {'suma': suma})
+
+def _precargar_renderizadores() -> None:
+    from utils.pdf import precalentar_pdf
+    import pandas  # noqa: F401  (detalles y tablas del historial)
+    precalentar_pdf()
+
+def precalentar_sesion(user_id: str) -> List[Future]:
+    """Lanza el precalentamiento en los hilos de precarga y vuelve enseguida.
+    Con la réplica offline activa solo se preparan los renderizadores: las lecturas ya son locales."""
+    from utils.replica import replica_activa
+    tareas = [_executor.submit(_precargar_renderizadores)]
+    if replica_activa():
+        return tareas
+    clave = _clave_filtros(user_id, {})
+    version = version_datos(user_id, TABLAS_HISTORIAL)
+    # Los hilos del executor no tienen sesión de Streamlit: se les pasa el cliente de esta
+    tareas += [
+        _executor.submit(con_cliente_actual(get_catalogos), user_id),
+        _executor.submit(con_cliente_actual(_precargar_pagina), user_id, clave, version),
+        _executor.submit(con_cliente_actual(_precargar_suma), user_id, clave, version),
+    ]
+    return tareas
@@ -0,0 +1,219 @@
+import json
+import os
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import streamlit as st
+from utils.db import get_cliente_compartido
+
+# ==================== CONFIGURACIÓN ====================
+# Cada aviso dice qué tabla cambió y de qué usuario (creado_por); si son pocas filas, también sus ids.
+# Lo emite un trigger en la DB (ver "NOTIFICACIÓN DE CAMBIOS" en db_schema.sql) por pg_notify y
+# además lo deja en registro_cambios, para quien no pueda abrir una conexión directa a Postgres.
+CANAL = 'grino_cambios'
+FUENTES = ('listen', 'sondeo', 'local')
+INTERVALO_SONDEO_SEG = 2.0
+ESPERA_RECONEXION_SEG = 5.0
+LOTE_SONDEO = 500
+
+# ==================== VERSIONES Y SUSCRIPTORES ====================
+# Versión por (tabla, usuario): las cachés guardan la versión con la que se llenaron y,
+# si cambió, descartan solo lo de ese usuario
+_versiones: Dict[Tuple[str, str], int] = {}
+_epoca = 0  # sube si el canal se cortó: pudo perderse cualquier aviso
+_suscriptores: List[Callable[[Dict[str, Any]], None]] = []
+_lock = threading.Lock()
+
+def version(tablas: Iterable[str], creado_por: str) -> Tuple[int, ...]:
+    """Versión actual de los datos de un usuario en esas tablas (cambia con cada aviso)"""
+    with _lock:
+        return (_epoca,) + tuple(_versiones.get((tabla, str(creado_por)), 0) for tabla in tablas)
+
+def suscribir(funcion: Callable[[Dict[str, Any]], None]) -> None:
+    """Registra una función que recibe cada aviso {'tabla', 'creado_por', 'ids'}"""
+    with _lock:
+        if funcion not in _suscriptores:
+            _suscriptores.append(funcion)
+
+def publicar(cambio: Dict[str, Any]) -> None:
+    """Sube la versión de (tabla, usuario) y reparte el aviso a los suscriptores.
+    tabla '*' significa "cualquier cosa pudo cambiar" (tras una reconexión)."""
+    global _epoca
+    clave = (cambio['tabla'], str(cambio['creado_por']))
+    with _lock:
+        if cambio['tabla'] == '*':
+            _epoca += 1
+        else:
+            _versiones[clave] = _versiones.get(clave, 0) + 1
+        suscriptores = list(_suscriptores)
+    for funcion in suscriptores:
+        try:
+            funcion(cambio)
+        except Exception as e:
+            print(f"Error al invalidar caché por cambio en {clave}: {e}")
+
+def publicar_local(tabla: str, creado_por: str, ids: Optional[Iterable[int]] = None) -> None:
+    """Aviso inmediato dentro del proceso tras una escritura propia (no espera al canal de la DB)"""
+    publicar({'tabla': tabla, 'creado_por': str(creado_por), 'ids': list(ids) if ids else None})
+
+# ==================== FUENTES DE AVISOS ====================
+class FuenteListen:
+    """LISTEN/NOTIFY con conexión directa a Postgres (necesita psycopg2 y [cambios] db_url)"""
+    nombre = 'listen'
+
+    def __init__(self, db_url: str):
+        self.db_url = db_url
+        self._conexion = None
+
+    def _conectar(self):
+        import psycopg2
+        conexion = psycopg2.connect(self.db_url)
+        conexion.set_session(autocommit=True)
+        with conexion.cursor() as cursor:
+            cursor.execute(f"LISTEN {CANAL}")
+        self._conexion = conexion
+
+    def esperar(self, timeout: float) -> List[Dict[str, Any]]:
+        if self._conexion is None:
+            self._conectar()
+        if select.select([self._conexion], [], [], timeout) == ([], [], []):
+            return []
+        self._conexion.poll()
+        avisos = [json.loads(n.payload) for n in self._conexion.notifies]
+        self._conexion.notifies.clear()
+        return avisos
+
+    def cerrar(self) -> None:
+        if self._conexion is not None:
+            try:
+                self._conexion.close()
+            finally:
+                self._conexion = None
+
+class FuenteSondeo:
+    """Lee registro_cambios por PostgREST cada pocos segundos. Sirve con cualquier cliente con la
+    interfaz de Supabase, incluido un stand-in local en pruebas."""
+    nombre = 'sondeo'
+
+    def __init__(self, cliente, intervalo: float = INTERVALO_SONDEO_SEG):
+        self.cliente = cliente
+        self.intervalo = intervalo
+        self._ultimo_id: Optional[int] = None
+
+    def esperar(self, timeout: float) -> List[Dict[str, Any]]:
+        from utils.resiliencia import ejecutar
+        if self._ultimo_id is None:
+            # Solo interesan los cambios desde que arrancó el proceso
+            ultimo = ejecutar(self.cliente.table("registro_cambios").select("id").order("id", desc=True).limit(1))
+            self._ultimo_id = ultimo.data[0]['id'] if ultimo.data else 0
+            return []
+        time.sleep(min(timeout, self.intervalo))
+        filas = ejecutar(self.cliente.table("registro_cambios").select("id, tabla, creado_por, ids").gt(
+            "id", self._ultimo_id
+        ).order("id").limit(LOTE_SONDEO)).data or []
+        if filas:
+            self._ultimo_id = filas[-1]['id']
+        return [{'tabla': f['tabla'], 'creado_por': f['creado_por'], 'ids': f.get('ids')} for f in filas]
+
+    def cerrar(self) -> None:
+        # Se conserva el cursor: tras el corte se leen los cambios pendientes sin perder ninguno
+        pass
+
+class FuenteLocal:
+    """Sin canal externo: solo cuentan los avisos de este proceso (publicar_local)"""
+    nombre = 'local'
+
+    def esperar(self, timeout: float) -> List[Dict[str, Any]]:
+        time.sleep(timeout)
+        return []
+
+    def cerrar(self) -> None:
+        pass
+
+# ==================== ESCUCHA EN SEGUNDO PLANO ====================
+class EscuchaCambios:
+    """Hilo que lee avisos de una fuente y los publica; si la fuente falla, reconecta"""
+
+    def __init__(self, fuente):
+        self.fuente = fuente
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._estado: Dict[str, Any] = {
+            "fuente": fuente.nombre,
+            "avisos": 0,
+            "ultimo_aviso": None,
+            "ultimo_error": None,
+            "reconexiones": 0,
+        }
+
+    def start(self) -> "EscuchaCambios":
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._loop, name="grino-cambios", daemon=True)
+                self._hilo.start()
+        return self
+
+    def stop(self) -> None:
+        self._detener.set()
+
+    def _loop(self) -> None:
+        cortado = False
+        while not self._detener.is_set():
+            try:
+                avisos = self.fuente.esperar(1.0)
+            except Exception as e:
+                with self._lock:
+                    self._estado["ultimo_error"] = str(e)
+                    self._estado["reconexiones"] += 1
+                self.fuente.cerrar()
+                cortado = True
+                self._detener.wait(ESPERA_RECONEXION_SEG)
+                continue
+            if cortado and self.fuente.nombre == 'listen':
+                # NOTIFY no se guarda: lo emitido durante el corte se perdió
+                publicar({'tabla': '*', 'creado_por': '*', 'ids': None})
+            cortado = False
+            for aviso in avisos:
+                publicar(aviso)
+            if avisos:
+                with self._lock:
+                    self._estado["avisos"] += len(avisos)
+                    self._estado["ultimo_aviso"] = time.time()
+                    self._estado["ultimo_error"] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._estado, activo=self._hilo is not None and self._hilo.is_alive())
+
+def _crear_fuente(secrets) -> Any:
+    try:
+        config = dict(secrets.get("cambios", {}))
+    except Exception:
+        config = {}
+    db_url = config.get("db_url") or os.environ.get("GRINO_DB_URL")
+    fuente = config.get("fuente") or ('listen' if db_url else 'sondeo')
+    if fuente not in FUENTES:
+        raise ValueError(f"[cambios] fuente debe ser una de {FUENTES}, no '{fuente}'")
+    if fuente == 'listen':
+        try:
+            import psycopg2  # noqa: F401
+        except ImportError:
+            print("psycopg2 no está instalado; los avisos de cambios se leerán por sondeo")
+            fuente = 'sondeo'
+    if fuente == 'listen':
+        return FuenteListen(db_url)
+    if fuente == 'sondeo':
+        return FuenteSondeo(get_cliente_compartido(), float(config.get("intervalo_seg", INTERVALO_SONDEO_SEG)))
+    return FuenteLocal()
+
+@st.cache_resource
+def get_escucha_cambios() -> EscuchaCambios:
+    """Una escucha por proceso; arranca el hilo la primera vez que se pide"""
+    return EscuchaCambios(_crear_fuente(st.secrets)).start()
+
+def get_estado_cambios() -> Dict[str, Any]:
+    """Estado del canal de avisos para la página de operaciones"""
+    return get_escucha_cambios().snapshot()
@@ -1,14 +1,16 @@
 import streamlit as st
-import pandas as pd
 from typing import Any, Dict, List, Tuple, Optional
 from utils.database import (
     create_categoria, 
     get_categorias, 
-    get_clientes, 
     create_cliente, 
-    get_lugares_trabajo, 
-    create_lugar_trabajo
+    create_lugar_trabajo,
+    get_clientes_async,
+    get_lugares_trabajo_async,
+    ejecutar_en_paralelo
 )
+from utils.cache import get_catalogos
+from utils.perfil import perfilado
 
 # ==================== UTILIDADES ====================
 def safe_numeric_value(value: Any) -> float:
@@ -27,9 +29,17 @@ def clean_integer_input(value: str) -> int:
     cleaned = ''.join(filter(str.isdigit, str(value)))
     return int(cleaned) if cleaned else 0
 
+# ==================== CARGA INICIAL ====================
+@perfilado("ui.cargar_catalogos")
+def cargar_catalogos(user_id: str) -> Dict[str, List[Tuple[int, str]]]:
+    """Clientes, lugares y categorías pedidos a la vez (una sola espera en lugar de tres).
+    Se comparten entre sesiones hasta que llegue un aviso de cambio de ese usuario."""
+    return get_catalogos(user_id)
+
 # ==================== SECCIÓN CLIENTE - LUGAR DE TRABAJO ====================
-def show_cliente_lugar_selector() -> Tuple[Optional[int], str, Optional[int], str, str]:
-    """Selector simplificado de cliente y lugar de trabajo"""
+@perfilado("ui.show_cliente_lugar_selector", datos=False)
+def show_cliente_lugar_selector(catalogos: Optional[Dict[str, List[Tuple[int, str]]]] = None) -> Tuple[Optional[int], str, Optional[int], str, str]:
+    """Selector simplificado de cliente y lugar de trabajo (acepta los catálogos ya cargados)"""
     if 'user_id' not in st.session_state:
         st.error("❌ No has iniciado sesión")
         st.stop()
@@ -37,8 +47,10 @@ def show_cliente_lugar_selector() -> Tuple[Optional[int], str, Optional[int], st
     user_id = st.session_state.user_id
 
     try:
-        clientes = get_clientes(user_id)
-        lugares = get_lugares_trabajo(user_id)
+        if catalogos is not None:
+            clientes, lugares = catalogos['clientes'], catalogos['lugares']
+        else:
+            clientes, lugares = ejecutar_en_paralelo(get_clientes_async(user_id), get_lugares_trabajo_async(user_id))
     except Exception as e:
         st.error(f"❌ Error cargando datos: {e}")
         st.stop()
@@ -131,14 +143,15 @@ def _selector_entidad(datos: List[Tuple[int, str]], label: str, key: str, btn_nu
     return entidad_id
 
 # ==================== SECCIÓN ITEMS Y CATEGORÍAS ====================
-def selector_categoria(mostrar_label: bool = True, requerido: bool = True, key_suffix: str = "") -> Tuple[Optional[int], Optional[str]]:
+def selector_categoria(mostrar_label: bool = True, requerido: bool = True, key_suffix: str = "", categorias: Optional[List[Tuple[int, str]]] = None) -> Tuple[Optional[int], Optional[str]]:
     """Selector simplificado de categorías"""
     if 'user_id' not in st.session_state:
         st.error("❌ No autenticado")
         st.stop()
 
     try:
-        categorias = get_categorias(st.session_state.user_id)
+        if categorias is None:
+            categorias = get_categorias(st.session_state.user_id)
     except Exception as e:
         st.error(f"❌ Error cargando categorías: {e}")
         if requerido:
@@ -166,7 +179,8 @@ def selector_categoria(mostrar_label: bool = True, requerido: bool = True, key_s
 
     return categoria_id, categoria_nombre
 
-def show_items_presupuesto() -> Dict[str, Any]:
+@perfilado("ui.show_items_presupuesto", datos=False)
+def show_items_presupuesto(categorias: Optional[List[Tuple[int, str]]] = None) -> Dict[str, Any]:
     """Función principal para manejar items del presupuesto"""
     if 'categorias' not in st.session_state:
         st.session_state['categorias'] = {}
@@ -180,7 +194,8 @@ def show_items_presupuesto() -> Dict[str, Any]:
             categoria_id, categoria_nombre = selector_categoria(
                 mostrar_label=False,
                 requerido=True,
-                key_suffix="principal"
+                key_suffix="principal",
+                categorias=categorias
             )
             
             # 🔥 CORRECCIÓN: Actualizar el categoria_id en la sesión para la categoría actual
@@ -304,6 +319,7 @@ def show_items_presupuesto() -> Dict[str, Any]:
                 with col7:
                     if st.button("💾", key=f"guardar_{cat_nombre}_{index}", help="Guardar cambios", use_container_width=True):
                         st.session_state['categorias'][cat_nombre]['items'][index] = {
+                            'id': item.get('id'),  # en edición identifica la fila de la DB
                             'nombre': nuevo_nombre,
                             'unidad': nueva_unidad,
                             'cantidad': nueva_cantidad,
@@ -323,6 +339,7 @@ def show_items_presupuesto() -> Dict[str, Any]:
     
     return st.session_state['categorias']
 
+@perfilado("ui.show_mano_obra", datos=False)
 def show_mano_obra(items_data: Dict[str, Any]) -> None:
     """Mano de obra simplificada"""
     with st.expander("🔧 Agregar Mano de Obra", expanded=False):
@@ -352,6 +369,7 @@ def show_mano_obra(items_data: Dict[str, Any]) -> None:
                     st.success(f"✅ Mano de obra eliminada de **{categoria_seleccionada}**")
                     st.rerun()
 
+@perfilado("ui.show_resumen", datos=False)
 def show_resumen(items_data: Dict[str, Any]) -> float:
     """Resumen simplificado del presupuesto"""
     st.subheader("📊 Resumen del Presupuesto", divider="green")
@@ -373,6 +391,7 @@ def show_resumen(items_data: Dict[str, Any]) -> float:
             st.markdown(f"#### 🔹 {cat}")
             
             if items:
+                import pandas as pd  # solo al mostrar el resumen: no se paga al importar la página
                 df_items = pd.DataFrame(items)
                 column_config = {
                     "nombre": st.column_config.TextColumn("Descripción", width="medium"),
@@ -1,91 +1,260 @@
-from typing import List, Tuple, Optional, Dict, Any
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+from datetime import date, datetime
+from typing import Awaitable, Callable, List, Tuple, Optional, Dict, Any
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from postgrest.exceptions import APIError
 from supabase import Client
 
 # Importar conexión
 try:
-    from utils.db import get_supabase_client
-except ImportError:
-    st.error("Error: Falta el archivo 'utils/db.py' con la función get_supabase_client.")
+    from utils.cambios import publicar_local
+    from utils.db import con_cliente_actual, get_supabase_client
+    from utils.perfil import instrumentar
+    from utils.resiliencia import ejecutar, ejecutar_paginado, llamar
+except ImportError as e:
+    st.error(f"Error: no se pudieron importar los módulos de utils/ que usa la capa de datos: {e}")
     st.stop()
 
+# ==================== RÉPLICA LOCAL ====================
+def _replicable(funcion: Callable) -> Callable:
+    """Si la réplica offline está activa, la llamada se sirve desde SQLite con la misma firma"""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        from utils import replica
+        if replica.replica_activa():
+            user_id = st.session_state.get('user_id')
+            if user_id:
+                # Primera vez en primer plano; luego solo dispara el sync periódico en segundo plano
+                replica.asegurar_replica(user_id)
+            return getattr(replica, funcion.__name__)(*args, **kwargs)
+        return funcion(*args, **kwargs)
+    return envoltura
+
 # ==================== FUNCIONES SIMPLIFICADAS ====================
 
+@_replicable
 def get_clientes(user_id: str) -> List[Tuple[int, str]]:
     """Obtiene todos los clientes (id, nombre)"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("clientes").select("id, nombre").eq("creado_por", user_id).order("nombre").execute()
+        response = ejecutar(supabase.table("clientes").select("id, nombre").eq("creado_por", user_id).order("nombre"))
         return [(d['id'], d['nombre']) for d in response.data]
     except Exception as e:
         st.error(f"❌ Error al obtener clientes: {e}")
         return []
 
+def normalizar_nombre(nombre: str) -> str:
+    """Misma normalización que la columna clientes.nombre_normalizado"""
+    return ' '.join(nombre.split()).lower()
+
+def buscar_clientes_similares(nombre: str, user_id: str, umbral: float = 0.5) -> List[Tuple[int, str, float]]:
+    """Clientes con nombre parecido (posibles duplicados) como (id, nombre, similitud)"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.rpc("clientes_similares", {
+            "p_user_id": str(user_id),
+            "p_nombre": nombre,
+            "p_umbral": umbral
+        }), 'busqueda')
+        return [(d['id'], d['nombre'], d['similitud']) for d in response.data or []]
+    except Exception as e:
+        st.error(f"❌ Error al buscar clientes similares: {e}")
+        return []
+
+@_replicable
 def create_cliente(nombre: str, user_id: str) -> Optional[int]:
-    """Crea un nuevo cliente"""
+    """Crea un nuevo cliente; si ya existe uno con el mismo nombre normalizado, devuelve ese"""
     supabase = get_supabase_client()
     try:
+        existente = ejecutar(supabase.table("clientes").select("id, nombre").eq("creado_por", user_id).eq(
+            "nombre_normalizado", normalizar_nombre(nombre)
+        ).limit(1))
+        if existente.data:
+            st.info(f"ℹ️ El cliente '{existente.data[0]['nombre']}' ya existe; se usará el registro existente.")
+            return existente.data[0]['id']
+
+        similares = buscar_clientes_similares(nombre, user_id)
+        if similares:
+            st.warning(f"⚠️ Clientes parecidos ya registrados: {', '.join(n for _, n, _ in similares)}")
+
         # Crear alias único simple
         import uuid
         alias = f"{nombre.lower().replace(' ', '-')}-{str(uuid.uuid4())[:8]}"
         
-        response = supabase.table("clientes").insert({
-            "nombre": nombre,
+        response = ejecutar(supabase.table("clientes").insert({
+            "nombre": nombre.strip(),
             "alias": alias,
             "creado_por": user_id
-        }).execute()
+        }), 'escritura')
         
         if response.data:
+            publicar_local("clientes", user_id, [response.data[0]['id']])
             return response.data[0]['id']
         return None
     except Exception as e:
         st.error(f"❌ Error al crear cliente: {e}")
         return None
 
+def create_clientes_bulk(nombres: List[str], user_id: str) -> Dict[str, int]:
+    """Crea en un solo request los clientes que no existen y devuelve nombre -> id para todos.
+    La deduplicación usa el índice único (creado_por, nombre_normalizado)."""
+    import uuid
+    supabase = get_supabase_client()
+    por_normalizado = {normalizar_nombre(n): n.strip() for n in nombres if n and n.strip()}
+    if not por_normalizado:
+        return {}
+    filas = [{
+        "nombre": nombre,
+        "alias": f"{nombre.lower().replace(' ', '-')}-{str(uuid.uuid4())[:8]}",
+        "creado_por": user_id
+    } for nombre in por_normalizado.values()]
+    ejecutar(supabase.table("clientes").upsert(filas, on_conflict="creado_por,nombre_normalizado", ignore_duplicates=True), 'escritura')
+    response = ejecutar(supabase.table("clientes").select("id, nombre_normalizado").eq("creado_por", user_id).in_(
+        "nombre_normalizado", list(por_normalizado)
+    ))
+    ids = {d['nombre_normalizado']: d['id'] for d in response.data or []}
+    publicar_local("clientes", user_id)
+    return {n: ids.get(normalizar_nombre(n)) for n in nombres if n and n.strip()}
+
+def fusionar_clientes(destino_id: int, duplicados_ids: List[int], user_id: str) -> Optional[int]:
+    """Mueve los presupuestos de los duplicados al cliente destino y borra los duplicados (una transacción).
+    Devuelve cuántos presupuestos se reasignaron"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.rpc("fusionar_clientes", {
+            "p_user_id": str(user_id),
+            "p_destino": destino_id,
+            "p_duplicados": duplicados_ids
+        }), 'escritura')
+        publicar_local("clientes", user_id)
+        publicar_local("presupuestos", user_id)
+        return response.data
+    except Exception as e:
+        st.error(f"❌ Error al fusionar clientes: {e}")
+        return None
+
+def _a_datetime(valor: Any) -> Optional[datetime]:
+    """Convierte un timestamp ISO de PostgREST a datetime"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(str(valor))
+    except ValueError:
+        return None
+
+def get_clientes_detallados(user_id: str, pagina: int = 0, por_pagina: int = 48, busqueda: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Obtiene una página de clientes con sus agregados (nº de presupuestos, total cotizado, último presupuesto).
+    Devuelve (clientes, total de clientes que cumplen la búsqueda)"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.rpc("clientes_detallados", {
+            "p_user_id": str(user_id),
+            "p_limit": por_pagina,
+            "p_offset": pagina * por_pagina,
+            "p_busqueda": busqueda or None
+        }))
+
+        clientes = []
+        for d in response.data or []:
+            clientes.append({
+                "id": d['id'],
+                "nombre": d['nombre'],
+                "alias": d.get('alias'),
+                "fecha_registro": _a_datetime(d.get('fecha_registro')),
+                "num_presupuestos": d.get('num_presupuestos', 0),
+                "total_cotizado": float(d.get('total_cotizado') or 0),
+                "ultimo_presupuesto": _a_datetime(d.get('ultimo_presupuesto'))
+            })
+        total = response.data[0].get('total_clientes', 0) if response.data else 0
+        return clientes, total
+    except Exception as e:
+        st.error(f"❌ Error al obtener clientes: {e}")
+        return [], 0
+
+@_replicable
+def update_cliente(cliente_id: int, nombre: str, user_id: str) -> bool:
+    """Actualiza el nombre de un cliente"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.table("clientes").update({"nombre": nombre}).eq("id", cliente_id).eq("creado_por", user_id), 'escritura',
+                            clave_idempotencia=f"renombrar-cliente-{cliente_id}")
+        if response.data:
+            publicar_local("clientes", user_id, [cliente_id])
+        return bool(response.data)
+    except Exception as e:
+        st.error(f"❌ Error al actualizar cliente: {e}")
+        return False
+
+@_replicable
+def delete_cliente(cliente_id: int, user_id: str) -> bool:
+    """Elimina un cliente (la DB lo impide si tiene presupuestos asociados)"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.table("clientes").delete().eq("id", cliente_id).eq("creado_por", user_id), 'escritura',
+                            clave_idempotencia=f"eliminar-cliente-{cliente_id}")
+        if response.data:
+            publicar_local("clientes", user_id, [cliente_id])
+        return bool(response.data)
+    except Exception as e:
+        st.error(f"❌ Error al eliminar cliente (¿tiene presupuestos asociados?): {e}")
+        return False
+
+@_replicable
 def get_lugares_trabajo(user_id: str) -> List[Tuple[int, str]]:
     """Obtiene todos los lugares de trabajo (id, nombre)"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("lugares_trabajo").select("id, nombre").eq("creado_por", user_id).order("nombre").execute()
+        response = ejecutar(supabase.table("lugares_trabajo").select("id, nombre").eq("creado_por", user_id).order("nombre"))
         return [(d['id'], d['nombre']) for d in response.data]
     except Exception as e:
         st.error(f"❌ Error al obtener lugares de trabajo: {e}")
         return []
 
+@_replicable
 def create_lugar_trabajo(nombre: str, user_id: str) -> Optional[int]:
     """Crea un nuevo lugar de trabajo"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("lugares_trabajo").insert({
+        response = ejecutar(supabase.table("lugares_trabajo").insert({
             "nombre": nombre,
             "creado_por": user_id
-        }).execute()
+        }), 'escritura')
         if response.data:
+            publicar_local("lugares_trabajo", user_id, [response.data[0]['id']])
             return response.data[0]['id']
         return None
     except Exception as e:
         st.error(f"❌ Error al crear lugar de trabajo: {e}")
         return None
 
+@_replicable
 def get_categorias(user_id: str) -> List[Tuple[int, str]]:
     """Obtiene todas las categorías existentes (id, nombre)"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("categorias").select("id, nombre").eq("creado_por", user_id).order("nombre").execute()
+        response = ejecutar(supabase.table("categorias").select("id, nombre").eq("creado_por", user_id).order("nombre"))
         return [(d['id'], d['nombre']) for d in response.data]
     except Exception as e:
         st.error(f"❌ Error al obtener categorias: {e}")
         return []
 
+@_replicable
 def create_categoria(nombre: str, user_id: str) -> Optional[int]:
     """Crea una nueva categoría"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("categorias").insert({
+        response = ejecutar(supabase.table("categorias").insert({
             "nombre": nombre,
             "creado_por": user_id
-        }).execute()
+        }), 'escritura')
         if response.data:
+            publicar_local("categorias", user_id, [response.data[0]['id']])
             return response.data[0]['id']
         return None
     except Exception as e:
@@ -94,19 +263,71 @@ def create_categoria(nombre: str, user_id: str) -> Optional[int]:
 
 # ==================== FUNCIÓN PRINCIPAL PARA GUARDAR PRESUPUESTO ====================
 
-def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str, items_data: Dict[str, Any], total: float) -> Optional[int]:
-    """Guarda el presupuesto completo en la base de datos - VERSIÓN MEJORADA"""
+def construir_filas_items(presupuesto_id: int, items_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Filas de items_en_presupuesto a partir de la estructura de categorías de la sesión
+    (las categorías sin ID se omiten; la mano de obra va aparte, ver construir_filas_mano_obra)"""
+    filas = []
+    for categoria_nombre, data in items_data.items():
+        categoria_id = data.get('categoria_id')
+        if not categoria_id:
+            continue
+
+        for item in data.get('items', []):
+            filas.append({
+                "presupuesto_id": presupuesto_id,
+                "categoria_id": categoria_id,
+                "nombre_personalizado": item.get('nombre', ''),
+                "unidad": item.get('unidad', 'Unidad'),
+                "cantidad": item.get('cantidad', 0),
+                "precio_unitario": item.get('precio_unitario', 0),
+                "total": item.get('total', 0),
+                "notas": item.get('notas', '')
+            })
+    return filas
+
+def construir_filas_mano_obra(presupuesto_id: int, items_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Filas de mano_obra_presupuesto: un monto por categoría (solo las que tienen mano de obra)"""
+    return [{
+        "presupuesto_id": presupuesto_id,
+        "categoria_id": data['categoria_id'],
+        "monto": data.get('mano_obra', 0),
+    } for data in items_data.values() if data.get('categoria_id') and data.get('mano_obra', 0) > 0]
+
+def _insertar_items_reintentable(supabase: Client, presupuesto_id: int, items: List[Dict[str, Any]], reemplazar: bool = False):
+    """Insert de ítems que se puede repetir: si un intento anterior llegó a escribir y falló
+    después, el siguiente primero borra lo escrito (el insert en lote es atómico).
+    Con reemplazar=True también se borra en el primer intento (reenvío con la misma clave)."""
+    intentos = {'n': 0}
+
+    def insertar():
+        if reemplazar or intentos['n'] > 0:
+            supabase.table("items_en_presupuesto").delete().eq("presupuesto_id", presupuesto_id).execute()
+        intentos['n'] += 1
+        return supabase.table("items_en_presupuesto").insert(items).execute()
+    return insertar
+
+@_replicable
+def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str, items_data: Dict[str, Any], total: float, clave_idempotencia: Optional[str] = None) -> Optional[int]:
+    """Guarda el presupuesto completo en la base de datos - VERSIÓN MEJORADA.
+    Con clave_idempotencia (una por envío del formulario) los fallos transitorios se reintentan
+    sin riesgo de duplicar: el presupuesto se hace upsert sobre la clave."""
     supabase = get_supabase_client()
     
     try:
         # 1. Crear el presupuesto principal
-        presupuesto_response = supabase.table("presupuestos").insert({
+        fila = {
             "creado_por": user_id,
             "cliente_id": cliente_id,
             "lugar_trabajo_id": lugar_trabajo_id,
             "descripcion": descripcion,
             "total": total
-        }).execute()
+        }
+        if clave_idempotencia:
+            fila["clave_idempotencia"] = clave_idempotencia
+            consulta = supabase.table("presupuestos").upsert(fila, on_conflict="clave_idempotencia")
+        else:
+            consulta = supabase.table("presupuestos").insert(fila)
+        presupuesto_response = ejecutar(consulta, 'escritura', clave_idempotencia)
 
         if not presupuesto_response.data:
             st.error("❌ No se pudo crear el presupuesto principal")
@@ -116,47 +337,14 @@ def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: i
         st.success(f"✅ Presupuesto principal creado con ID: {presupuesto_id}")
 
         # 2. Preparar todos los items para insertar
-        items_to_insert = []
-        
-        for categoria_nombre, data in items_data.items():
-            # 🔥 MEJOR DEPURACIÓN
-            categoria_id = data.get('categoria_id')
-            st.write(f"🔍 Procesando categoría: {categoria_nombre}, ID: {categoria_id}")
-            
-            if not categoria_id:
-                st.warning(f"⚠️ Saltando categoría '{categoria_nombre}' - sin ID")
-                continue
-
-            # Insertar mano de obra como item especial
-            mano_obra = data.get('mano_obra', 0)
-            if mano_obra > 0:
-                items_to_insert.append({
-                    "presupuesto_id": presupuesto_id,
-                    "categoria_id": categoria_id,
-                    "nombre_personalizado": f"Mano de Obra - {categoria_nombre}",
-                    "unidad": "Servicio",
-                    "cantidad": 1,
-                    "precio_unitario": mano_obra,
-                    "total": mano_obra,
-                    "notas": f"Mano de obra para {categoria_nombre}"
-                })
-
-            # Insertar items normales
-            for item in data.get('items', []):
-                items_to_insert.append({
-                    "presupuesto_id": presupuesto_id,
-                    "categoria_id": categoria_id,
-                    "nombre_personalizado": item.get('nombre', ''),
-                    "unidad": item.get('unidad', 'Unidad'),
-                    "cantidad": item.get('cantidad', 0),
-                    "precio_unitario": item.get('precio_unitario', 0),
-                    "total": item.get('total', 0),
-                    "notas": item.get('notas', '')
-                })
+        items_to_insert = construir_filas_items(presupuesto_id, items_data)
 
         # 3. Insertar todos los items en lote
         if items_to_insert:
-            items_response = supabase.table("items_en_presupuesto").insert(items_to_insert).execute()
+            items_response = llamar(
+                _insertar_items_reintentable(supabase, presupuesto_id, items_to_insert, reemplazar=bool(clave_idempotencia)),
+                'escritura', clave_idempotencia
+            )
             st.success(f"✅ {len(items_to_insert)} items guardados para el presupuesto {presupuesto_id}")
             
             # 🔥 VERIFICACIÓN EXTRA
@@ -166,6 +354,13 @@ def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: i
         else:
             st.warning("⚠️ No hay items para guardar")
 
+        # 4. Mano de obra por categoría (upsert sobre la clave primaria: repetirlo no duplica)
+        mano_obra = construir_filas_mano_obra(presupuesto_id, items_data)
+        if mano_obra:
+            ejecutar(supabase.table("mano_obra_presupuesto").upsert(mano_obra, on_conflict="presupuesto_id,categoria_id"),
+                     'escritura', f"mano-obra-{presupuesto_id}")
+
+        publicar_local("presupuestos", user_id, [presupuesto_id])
         return presupuesto_id
 
     except Exception as e:
@@ -173,77 +368,527 @@ def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: i
         st.exception(e)  # 🔥 MOSTRAR TRAZA COMPLETA
         return None
 
+# ==================== EDICIÓN DE PRESUPUESTOS ====================
+CAMPOS_CABECERA = ('cliente_id', 'lugar_trabajo_id', 'descripcion', 'total')
+
+def _fila_editada(categoria_id: int, item: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnas editables de un ítem de la sesión, como las espera editar_presupuesto"""
+    return {
+        "id": item.get('id'),
+        "categoria_id": categoria_id,
+        "nombre_personalizado": item.get('nombre', ''),
+        "unidad": item.get('unidad', 'Unidad'),
+        "cantidad": int(item.get('cantidad', 0) or 0),
+        "precio_unitario": item.get('precio_unitario', 0),
+        "notas": item.get('notas', '') or '',
+    }
+
+def _filas_editadas(items_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [_fila_editada(data['categoria_id'], item)
+            for data in items_data.values() if data.get('categoria_id')
+            for item in data.get('items', [])]
+
+def _montos_mano_obra(items_data: Dict[str, Any]) -> Dict[int, float]:
+    return {data['categoria_id']: float(data.get('mano_obra', 0) or 0)
+            for data in items_data.values() if data.get('categoria_id')}
+
+def diferencias_presupuesto(original: Dict[str, Any], cabecera: Dict[str, Any], items_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compara la edición con la foto tomada al cargar (ver cargar_presupuesto_en_sesion en Editar).
+
+    original = {'version', 'cabecera', 'categorias'}. Devuelve los parámetros de editar_presupuesto
+    con solo lo que cambió: ítems sin id se insertan, los que difieren se actualizan y los ids
+    que ya no están se borran."""
+    antes_cabecera = original.get('cabecera', {})
+    cambios_cabecera = {k: cabecera[k] for k in CAMPOS_CABECERA if k in cabecera and cabecera[k] != antes_cabecera.get(k)}
+
+    antes_items = {f['id']: f for f in _filas_editadas(original.get('categorias', {})) if f['id'] is not None}
+    items, vistos = [], set()
+    for fila in _filas_editadas(items_data):
+        if fila['id'] is None:
+            items.append({k: v for k, v in fila.items() if k != 'id'})
+        elif fila['id'] in antes_items:
+            vistos.add(fila['id'])
+            if fila != antes_items[fila['id']]:
+                items.append(fila)
+    borrados = sorted(set(antes_items) - vistos)
+
+    antes_mano_obra = _montos_mano_obra(original.get('categorias', {}))
+    ahora_mano_obra = _montos_mano_obra(items_data)
+    mano_obra = [{"categoria_id": c, "monto": ahora_mano_obra.get(c, 0.0)}
+                 for c in sorted(set(antes_mano_obra) | set(ahora_mano_obra))
+                 if ahora_mano_obra.get(c, 0.0) != antes_mano_obra.get(c, 0.0)]
+
+    return {
+        "p_cabecera": cambios_cabecera,
+        "p_items": items,
+        "p_items_borrados": borrados,
+        "p_mano_obra": mano_obra,
+    }
+
+@_replicable
+def save_edited_presupuesto(presupuesto_id: int, user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str,
+                            items_data: Dict[str, Any], total_general: float, original: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """Guarda una edición enviando solo las diferencias con la foto original, en una sola llamada.
+    La función editar_presupuesto de la DB aplica inserts, updates y borrados en una transacción
+    y rechaza la edición (PT409) si otra sesión guardó antes sobre la misma versión."""
+    return _guardar_edicion(presupuesto_id, user_id, cliente_id, lugar_trabajo_id, descripcion, items_data, total_general, original)
+
+def _guardar_edicion(presupuesto_id: int, user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str,
+                     items_data: Dict[str, Any], total_general: float, original: Optional[Dict[str, Any]]) -> Optional[int]:
+    """Cuerpo de save_edited_presupuesto; la réplica lo usa para guardar en línea"""
+    if not original:
+        st.error("❌ Falta la versión cargada del presupuesto; vuelva a abrirlo desde el historial")
+        return None
+    cabecera = {
+        "cliente_id": cliente_id,
+        "lugar_trabajo_id": lugar_trabajo_id,
+        "descripcion": descripcion,
+        "total": total_general,
+    }
+    cambios = diferencias_presupuesto(original, cabecera, items_data)
+    if not any(cambios.values()):
+        return presupuesto_id
+
+    supabase = get_supabase_client()
+    version_base = original.get('version', 1)
+    # La clave sale del contenido: si la edición ya se aplicó y se perdió la respuesta, el reintento
+    # (automático o un segundo clic en Guardar) la reconoce en vez de chocar con la versión nueva
+    contenido = json.dumps([presupuesto_id, version_base, cambios], sort_keys=True, default=str)
+    clave = f"editar-{presupuesto_id}-{version_base}-{hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:16]}"
+    try:
+        ejecutar(supabase.rpc("editar_presupuesto", {
+            "p_user_id": str(user_id),
+            "p_presupuesto_id": presupuesto_id,
+            "p_version_base": version_base,
+            **cambios,
+            "p_clave": clave,
+        }), 'escritura', clave)
+        publicar_local("presupuestos", user_id, [presupuesto_id])
+        return presupuesto_id
+    except APIError as e:
+        if str(e.code) == 'PT409':
+            st.error("❌ Otra sesión guardó cambios en este presupuesto. Vuelva a abrirlo desde el historial para editar la versión actual.")
+        else:
+            st.error(f"❌ Error al guardar la edición del presupuesto {presupuesto_id}: {e}")
+        return None
+    except Exception as e:
+        st.error(f"❌ Error al guardar la edición del presupuesto {presupuesto_id}: {e}")
+        return None
+
+# ==================== ARCHIVO DE PRESUPUESTOS ====================
+# Los presupuestos antiguos se mueven a tablas *_archivo (ver "ARCHIVO DE PRESUPUESTOS ANTIGUOS"
+# en db_schema.sql). Las tablas activas se consultan siempre; el archivo solo si el filtro de
+# fecha llega hasta él o si se pide con filtros['incluir_archivo'].
+TABLAS_ACTIVAS = ("presupuestos", "items_en_presupuesto", "mano_obra_presupuesto")
+TABLAS_ARCHIVO = ("presupuestos_archivo", "items_en_presupuesto_archivo", "mano_obra_presupuesto_archivo")
+VIGENCIA_LIMITE_ARCHIVO_SEG = 600.0
+
+_limite_archivo: Dict[str, Any] = {'hasta': None, 'leido_en': None}
+
+def get_limite_archivo() -> Optional[datetime]:
+    """Fecha del presupuesto archivado más reciente (None si no hay archivo); se relee cada 10 minutos"""
+    ahora = time.monotonic()
+    if _limite_archivo['leido_en'] is None or ahora - _limite_archivo['leido_en'] > VIGENCIA_LIMITE_ARCHIVO_SEG:
+        try:
+            filas = ejecutar(get_supabase_client().table("archivo_estado").select("hasta")).data or []
+            _limite_archivo['hasta'] = _a_datetime(filas[0]['hasta']) if filas else None
+        except Exception as e:
+            print(f"Error al leer el estado del archivo: {e}")
+        _limite_archivo['leido_en'] = ahora
+    return _limite_archivo['hasta']
+
+def incluye_archivo(filtros: Optional[Dict[str, Any]]) -> bool:
+    """True si los filtros piden presupuestos que pueden estar archivados"""
+    filtros = filtros or {}
+    if filtros.get('incluir_archivo'):
+        return True
+    inicio = filtros.get('fecha_inicio')
+    if not inicio:
+        return False
+    hasta = get_limite_archivo()
+    return hasta is not None and inicio <= hasta
+
+def _tablas_presupuestos(filtros: Optional[Dict[str, Any]]) -> List[Tuple[str, str, str]]:
+    """Tablas a consultar, de la más reciente a la más antigua"""
+    return [TABLAS_ACTIVAS, TABLAS_ARCHIVO] if incluye_archivo(filtros) else [TABLAS_ACTIVAS]
+
 # ==================== FUNCIONES PARA CONSULTAS ====================
 
+@_replicable
 def get_presupuesto_detallado(presupuesto_id: int) -> Optional[Dict[str, Any]]:
-    """Obtiene todos los detalles de un presupuesto"""
+    """Obtiene todos los detalles de un presupuesto (si no está en las tablas activas, lo busca en el archivo)"""
+    return get_presupuestos_detallados([presupuesto_id]).get(presupuesto_id)
+
+@_replicable
+def get_presupuestos_detallados(presupuesto_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Detalle de varios presupuestos con dos consultas en total (cabeceras e ítems), no dos por
+    presupuesto. Los que no están en las tablas activas se buscan en el archivo. Ambas lecturas
+    van por páginas: un lote grande puede pasar del máximo de filas que devuelve PostgREST."""
     supabase = get_supabase_client()
+    detalles: Dict[int, Dict[str, Any]] = {}
     try:
-        # Obtener datos básicos del presupuesto
-        presupuesto_response = supabase.table("presupuestos").select(
-            "*, cliente:cliente_id(*), lugar:lugar_trabajo_id(*)"
-        ).eq("id", presupuesto_id).execute()
+        pendientes = list(dict.fromkeys(presupuesto_ids))
+        for tabla, tabla_items, tabla_mano_obra in (TABLAS_ACTIVAS, TABLAS_ARCHIVO):
+            if not pendientes:
+                break
+            # Obtener datos básicos de los presupuestos
+            presupuestos = ejecutar_paginado(lambda: supabase.table(tabla).select(
+                "*, cliente:cliente_id(*), lugar:lugar_trabajo_id(*), "
+                f"mano_obra:{tabla_mano_obra}(categoria_id, monto, categoria:categoria_id(nombre))"
+            ).in_("id", pendientes).order("id"))
+            if not presupuestos:
+                continue
 
-        if not presupuesto_response.data:
-            return None
+            # Obtener los items de todos ellos de una vez
+            items_por_presupuesto: Dict[int, List[Dict[str, Any]]] = {p['id']: [] for p in presupuestos}
+            for item in ejecutar_paginado(lambda: supabase.table(tabla_items).select(
+                "*, categoria:categoria_id(nombre)"
+            ).in_("presupuesto_id", list(items_por_presupuesto)).order("id")):
+                items_por_presupuesto[item['presupuesto_id']].append(item)
+
+            for presupuesto in presupuestos:
+                detalles[presupuesto['id']] = {
+                    "id": presupuesto['id'],
+                    "creado_por": presupuesto.get('creado_por'),
+                    "version": presupuesto.get('version', 1),
+                    "fecha": presupuesto.get('fecha_creacion'),
+                    "total": presupuesto.get('total', 0),
+                    "descripcion": presupuesto.get('descripcion', ''),
+                    "cliente": presupuesto.get('cliente', {}),
+                    "lugar": presupuesto.get('lugar', {}),
+                    "items": items_por_presupuesto[presupuesto['id']],
+                    "mano_obra": presupuesto.get('mano_obra') or [],
+                    "archivado": tabla == TABLAS_ARCHIVO[0]
+                }
+            pendientes = [i for i in pendientes if i not in detalles]
+        return detalles
+
+    except Exception as e:
+        st.error(f"❌ Error al obtener presupuestos {presupuesto_ids}: {e}")
+        return detalles
+
+# ==================== VERSIONES DE PRESUPUESTOS ====================
+# Al archivar un presupuesto sus versiones pasan a presupuesto_versiones_archivo
+TABLAS_VERSIONES = ("presupuesto_versiones", "presupuesto_versiones_archivo")
+
+def _leer_versiones(presupuesto_id: int, columnas: str, desde_version: int = 1) -> List[Dict[str, Any]]:
+    """Versiones guardadas desde `desde_version` (la más reciente primero); el archivo solo se
+    consulta si las tablas activas no tienen ninguna"""
+    supabase = get_supabase_client()
+    for tabla in TABLAS_VERSIONES:
+        filas = ejecutar(supabase.table(tabla).select(columnas).eq(
+            "presupuesto_id", presupuesto_id
+        ).gte("version", desde_version).order("version", desc=True)).data or []
+        if filas:
+            return filas
+    return []
+
+def get_versiones_presupuesto(presupuesto_id: int) -> List[Dict[str, Any]]:
+    """Versiones anteriores de un presupuesto (la más reciente primero) con un resumen de lo que cambió"""
+    try:
+        versiones = _leer_versiones(presupuesto_id, "version, creado_en, cabecera, items, mano_obra")
+        return [{
+            "version": d['version'],
+            "fecha": _a_datetime(d['creado_en']),
+            "cambios_cabecera": sorted(d['cabecera']),
+            "cambios_items": len(d['items']),
+            "cambios_mano_obra": len(d['mano_obra']),
+        } for d in versiones]
+    except Exception as e:
+        st.error(f"❌ Error al obtener versiones del presupuesto {presupuesto_id}: {e}")
+        return []
+
+def get_presupuesto_version(presupuesto_id: int, version: int) -> Optional[Dict[str, Any]]:
+    """Reconstruye una versión anterior con la misma forma que get_presupuesto_detallado.
+    Parte del estado actual y deshace los deltas desde la versión vigente hasta la pedida."""
+    actual = get_presupuesto_detallado(presupuesto_id)
+    if not actual or version >= actual.get('version', 1):
+        return actual
+    supabase = get_supabase_client()
+    try:
+        deltas = _leer_versiones(presupuesto_id, "version, cabecera, items, mano_obra", version)
 
-        presupuesto = presupuesto_response.data[0]
+        cabecera = {}
+        items = {i['id']: i for i in actual['items']}
+        mano_obra = {m['categoria_id']: m for m in actual['mano_obra']}
+        for delta in deltas:
+            cabecera.update(delta['cabecera'])
+            for cambio in delta['items']:
+                if cambio['antes'] is None:
+                    items.pop(cambio['id'], None)
+                else:
+                    antes = cambio['antes']
+                    items[cambio['id']] = {**antes, "total": (antes['cantidad'] or 0) * float(antes['precio_unitario'] or 0)}
+            for cambio in delta['mano_obra']:
+                if cambio['antes'] is None:
+                    mano_obra.pop(cambio['categoria_id'], None)
+                else:
+                    mano_obra[cambio['categoria_id']] = {"categoria_id": cambio['categoria_id'], "monto": cambio['antes']}
 
-        # Obtener items del presupuesto
-        items_response = supabase.table("items_en_presupuesto").select(
-            "*, categoria:categoria_id(nombre)"
-        ).eq("presupuesto_id", presupuesto_id).execute()
+        # Las filas restauradas traen ids: los nombres se piden en una consulta por tabla
+        sin_nombre = {f['categoria_id'] for f in list(items.values()) + list(mano_obra.values())
+                      if 'categoria' not in f and f.get('categoria_id')}
+        categorias = {}
+        if sin_nombre:
+            filas = ejecutar(supabase.table("categorias").select("id, nombre").in_("id", sorted(sin_nombre))).data or []
+            categorias = {f['id']: f['nombre'] for f in filas}
+        for fila in list(items.values()) + list(mano_obra.values()):
+            fila.setdefault("categoria", {"nombre": categorias.get(fila.get('categoria_id'))})
+
+        cliente, lugar = actual['cliente'], actual['lugar']
+        if 'cliente_id' in cabecera and cabecera['cliente_id'] != (cliente or {}).get('id'):
+            cliente = (ejecutar(supabase.table("clientes").select("*").eq("id", cabecera['cliente_id'])).data or [{}])[0]
+        if 'lugar_trabajo_id' in cabecera and cabecera['lugar_trabajo_id'] != (lugar or {}).get('id'):
+            lugar = (ejecutar(supabase.table("lugares_trabajo").select("*").eq("id", cabecera['lugar_trabajo_id'])).data or [{}])[0]
 
         return {
-            "id": presupuesto['id'],
-            "fecha": presupuesto.get('fecha_creacion'),
-            "total": presupuesto.get('total', 0),
-            "descripcion": presupuesto.get('descripcion', ''),
-            "cliente": presupuesto.get('cliente', {}),
-            "lugar": presupuesto.get('lugar', {}),
-            "items": items_response.data if items_response.data else []
+            **actual,
+            "version": version,
+            "total": cabecera.get('total', actual['total']),
+            "descripcion": cabecera.get('descripcion', actual['descripcion']),
+            "cliente": cliente,
+            "lugar": lugar,
+            "items": sorted(items.values(), key=lambda i: i['id']),
+            "mano_obra": list(mano_obra.values()),
         }
-
     except Exception as e:
-        st.error(f"❌ Error al obtener presupuesto {presupuesto_id}: {e}")
+        st.error(f"❌ Error al reconstruir la versión {version} del presupuesto {presupuesto_id}: {e}")
         return None
 
-def get_presupuestos_usuario(user_id: str) -> List[Dict[str, Any]]:
+def _aplicar_filtros_presupuestos(query, filtros: Optional[Dict[str, Any]]):
+    """Aplica los filtros del historial (cliente, lugar, fecha) a una consulta de presupuestos"""
+    filtros = filtros or {}
+    if filtros.get('cliente_id'):
+        query = query.eq("cliente_id", filtros['cliente_id'])
+    if filtros.get('lugar_trabajo_id'):
+        query = query.eq("lugar_trabajo_id", filtros['lugar_trabajo_id'])
+    if filtros.get('fecha_inicio'):
+        query = query.gte("fecha_creacion", filtros['fecha_inicio'].isoformat())
+    return query
+
+@_replicable
+def get_presupuestos_usuario(user_id: str, filtros: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """Obtiene todos los presupuestos del usuario"""
     supabase = get_supabase_client()
     try:
-        response = supabase.table("presupuestos").select(
-            "id, fecha_creacion, total, descripcion, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre)"
-        ).eq("creado_por", user_id).order("fecha_creacion", desc=True).execute()
+        filas = []
+        for tabla, _, _ in _tablas_presupuestos(filtros):
+            query = supabase.table(tabla).select(
+                "id, fecha_creacion, total, descripcion, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre)"
+            ).eq("creado_por", user_id)
+            response = ejecutar(_aplicar_filtros_presupuestos(query, filtros).order("fecha_creacion", desc=True))
+            filas += [dict(d, archivado=True) if tabla == TABLAS_ARCHIVO[0] else d for d in response.data or []]
 
-        return response.data if response.data else []
+        return filas
 
     except Exception as e:
         st.error(f"❌ Error al obtener presupuestos: {e}")
         return []
 
+@_replicable
+def get_presupuestos_pagina(user_id: str, filtros: Optional[Dict[str, Any]] = None, pagina: int = 0, por_pagina: int = 20) -> Tuple[List[Dict[str, Any]], int]:
+    """Obtiene una página de presupuestos (con nº de ítems) y el total de filas que cumplen los filtros"""
+    supabase = get_supabase_client()
+    try:
+        inicio = pagina * por_pagina
+        filas, total_filas = [], 0
+        tablas = _tablas_presupuestos(filtros)
+
+        def consulta(tabla: str, columnas: str, **opciones):
+            query = supabase.table(tabla).select(columnas, **opciones).eq("creado_por", user_id)
+            return _aplicar_filtros_presupuestos(query, filtros)
+
+        # Con el archivo se cuenta antes cada tabla: PostgREST responde 416 a un rango que empieza
+        # después de su última fila, y una página que cae entera en el archivo lo pediría a las activas
+        conteos = [ejecutar(consulta(tabla, "id", count="exact", head=True)).count or 0
+                   for tabla, _, _ in tablas] if len(tablas) > 1 else [None]
+        # El archivo solo tiene presupuestos más antiguos: la página sigue en él donde terminan las activas
+        for (tabla, tabla_items, _), conteo_tabla in zip(tablas, conteos):
+            desde = max(inicio - total_filas, 0)
+            faltan = por_pagina - len(filas)
+            columnas = f"id, fecha_creacion, total, descripcion, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre), items:{tabla_items}(count)"
+            if conteo_tabla is None:
+                query = consulta(tabla, columnas, count="exact")
+            else:
+                total_filas += conteo_tabla
+                if not faltan or desde >= conteo_tabla:
+                    continue
+                query = consulta(tabla, columnas)
+            response = ejecutar(query.order("fecha_creacion", desc=True).range(desde, desde + faltan - 1))
+
+            for fila in response.data or []:
+                conteo = fila.pop('items', None) or [{}]
+                fila['num_items'] = conteo[0].get('count', 0)
+                if tabla == TABLAS_ARCHIVO[0]:
+                    fila['archivado'] = True
+                filas.append(fila)
+            if conteo_tabla is None:
+                total_filas += response.count or 0
+        return filas, total_filas
+
+    except Exception as e:
+        st.error(f"❌ Error al obtener presupuestos: {e}")
+        return [], 0
+
+@_replicable
+def get_resumen_presupuestos(user_id: str, filtros: Optional[Dict[str, Any]] = None) -> Tuple[int, float]:
+    """Nº de presupuestos filtrados y suma de sus totales, calculados en la DB (RPC resumen_presupuestos)"""
+    filtros = filtros or {}
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.rpc("resumen_presupuestos", {
+            "p_user_id": str(user_id),
+            "p_cliente_id": filtros.get('cliente_id') or None,
+            "p_lugar_trabajo_id": filtros.get('lugar_trabajo_id') or None,
+            "p_fecha_inicio": filtros['fecha_inicio'].isoformat() if filtros.get('fecha_inicio') else None,
+            "p_incluir_archivo": incluye_archivo(filtros)
+        }))
+        fila = (response.data or [{}])[0]
+        return int(fila.get('num_presupuestos') or 0), float(fila.get('suma') or 0)
+    except Exception as e:
+        st.error(f"❌ Error al obtener totales: {e}")
+        return 0, 0.0
+
+def buscar_presupuestos(user_id: str, texto: str, pagina: int = 0, por_pagina: int = 20, incluir_archivo: bool = False) -> Tuple[List[Dict[str, Any]], int, float]:
+    """Búsqueda por relevancia en descripción, ítems, cliente y lugar (RPC buscar_presupuestos).
+    Con incluir_archivo también busca en los presupuestos archivados.
+    Devuelve (filas de la página, nº total de coincidencias, suma de sus totales)"""
+    supabase = get_supabase_client()
+    try:
+        response = ejecutar(supabase.rpc("buscar_presupuestos", {
+            "p_user_id": str(user_id),
+            "p_query": texto,
+            "p_limit": por_pagina,
+            "p_offset": pagina * por_pagina,
+            "p_incluir_archivo": incluir_archivo
+        }), 'busqueda')
+
+        filas = []
+        for d in response.data or []:
+            filas.append({
+                "id": d['id'],
+                "fecha_creacion": d.get('fecha_creacion'),
+                "total": d.get('total', 0),
+                "descripcion": d.get('descripcion', ''),
+                "cliente": {"nombre": d.get('cliente')},
+                "lugar": {"nombre": d.get('lugar')},
+                "coincidencia": d.get('coincidencia', ''),
+                "relevancia": d.get('relevancia', 0),
+                "archivado": bool(d.get('archivado'))
+            })
+        if not response.data:
+            return filas, 0, 0.0
+        return filas, response.data[0].get('total_hits', 0), float(response.data[0].get('suma_hits') or 0)
+
+    except Exception as e:
+        st.error(f"❌ Error al buscar presupuestos: {e}")
+        return [], 0, 0.0
+
+# ==================== ANALÍTICA ====================
+
+def get_analitica_mensual(user_id: str, desde: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Lee el rollup mensual por cliente, lugar y categoría (materiales vs. mano de obra).
+    Con varios años hay más filas que las que PostgREST devuelve de una vez: se lee por páginas."""
+    supabase = get_supabase_client()
+    try:
+        def construir():
+            query = supabase.table("analitica_mensual").select(
+                "mes, materiales, mano_obra, num_items, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre), categoria:categoria_id(nombre)"
+            ).eq("creado_por", user_id)
+            if desde:
+                query = query.gte("mes", desde.isoformat())
+            return query.order("mes").order("cliente_id").order("lugar_trabajo_id").order("categoria_id")
+
+        return ejecutar_paginado(construir)
+    except Exception as e:
+        st.error(f"❌ Error al obtener analítica: {e}")
+        return []
+
+def get_analitica_presupuestos(user_id: str, desde: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Lee el rollup mensual de presupuestos (cantidad y monto cotizado por cliente y lugar)"""
+    supabase = get_supabase_client()
+    try:
+        def construir():
+            query = supabase.table("analitica_mensual_presupuestos").select(
+                "mes, num_presupuestos, total, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre)"
+            ).eq("creado_por", user_id)
+            if desde:
+                query = query.gte("mes", desde.isoformat())
+            return query.order("mes").order("cliente_id").order("lugar_trabajo_id")
+
+        return ejecutar_paginado(construir)
+    except Exception as e:
+        st.error(f"❌ Error al obtener analítica de presupuestos: {e}")
+        return []
+
+@_replicable
 def delete_presupuesto(presupuesto_id: int, user_id: str) -> bool:
     """Elimina un presupuesto y sus items"""
     supabase = get_supabase_client()
     try:
         # Eliminar items primero
-        supabase.table("items_en_presupuesto").delete().eq("presupuesto_id", presupuesto_id).execute()
+        # Borrar por id es idempotente: se puede reintentar sin riesgo
+        clave = f"eliminar-presupuesto-{presupuesto_id}"
+        ejecutar(supabase.table("items_en_presupuesto").delete().eq("presupuesto_id", presupuesto_id), 'escritura', clave)
         
         # Eliminar presupuesto
-        response = supabase.table("presupuestos").delete().eq("id", presupuesto_id).eq("creado_por", user_id).execute()
+        response = ejecutar(supabase.table("presupuestos").delete().eq("id", presupuesto_id).eq("creado_por", user_id), 'escritura', clave)
+        if response.data:
+            publicar_local("presupuestos", user_id, [presupuesto_id])
         return len(response.data) > 0
     except Exception as e:
         st.error(f"❌ Error al eliminar presupuesto: {e}")
         return False
-    """Crea una nueva categoría. user_id es UUID."""
-    supabase = get_supabase_client()
-    try:
-        response = supabase.table("categorias").insert({
-            "nombre": nombre,
-            "creado_por": user_id  # UUID
-        }).execute() 
-        
-        return response.data[0]['id'] if response.data else None
-    except Exception as e:
-        print(f"Error al crear categoria: {e}")
-        return None
\ No newline at end of file
+
+# ==================== PERFILADO ====================
+# Con el perfilador activo (utils/perfil.py) cada función pública de acceso a datos queda como span
+# con duración, filas y bytes. Va antes de las versiones async para que también se midan.
+instrumentar(globals(), 'db', excluir=(
+    'normalizar_nombre', 'construir_filas_items', 'construir_filas_mano_obra',
+    'diferencias_presupuesto', 'incluye_archivo',
+))
+
+# ==================== LECTURAS CONCURRENTES ====================
+
+def _version_async(funcion: Callable) -> Callable[..., Awaitable[Any]]:
+    """Versión awaitable de una lectura: corre en su propio hilo con el cliente y el contexto
+    de la sesión actual, así los st.error de la función siguen apareciendo en la página."""
+    @functools.wraps(funcion)
+    async def envoltura(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        llamada = con_cliente_actual(funcion)
+
+        def en_hilo():
+            try:
+                resultado = llamada(*args, **kwargs)
+            except BaseException as e:
+                loop.call_soon_threadsafe(futuro.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(futuro.set_result, resultado)
+
+        hilo = threading.Thread(target=en_hilo, name=f"grino-{funcion.__name__}", daemon=True)
+        add_script_run_ctx(hilo)
+        hilo.start()
+        return await futuro
+    envoltura.__name__ = f"{funcion.__name__}_async"
+    envoltura.__qualname__ = envoltura.__name__
+    return envoltura
+
+get_clientes_async = _version_async(get_clientes)
+get_clientes_detallados_async = _version_async(get_clientes_detallados)
+get_lugares_trabajo_async = _version_async(get_lugares_trabajo)
+get_categorias_async = _version_async(get_categorias)
+get_presupuesto_detallado_async = _version_async(get_presupuesto_detallado)
+get_presupuestos_pagina_async = _version_async(get_presupuestos_pagina)
+get_resumen_presupuestos_async = _version_async(get_resumen_presupuestos)
+buscar_presupuestos_async = _version_async(buscar_presupuestos)
+get_analitica_mensual_async = _version_async(get_analitica_mensual)
+get_analitica_presupuestos_async = _version_async(get_analitica_presupuestos)
+
+def ejecutar_en_paralelo(*lecturas: Awaitable[Any]) -> List[Any]:
+    """Espera varias lecturas independientes a la vez y devuelve sus resultados en orden.
+    La página paga la latencia de la más lenta en lugar de la suma de todas."""
+    async def _todas():
+        return await asyncio.gather(*lecturas)
+    return asyncio.run(_todas())
@@ -1,9 +1,39 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+import httpx
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 # Usamos supabase-py
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
-def initialize_supabase_client(secrets: dict) -> Client:
-    """Inicializa y configura el cliente Supabase usando las secrets de Streamlit."""
+# ==================== CONFIGURACIÓN ====================
+# Límite de clientes autenticados vivos en el proceso (uno por sesión de navegador)
+MAX_SESIONES = 200
+# Una sesión sin uso durante este tiempo se descarta del pool (sus tokens siguen en session_state)
+INACTIVIDAD_MAX_SEG = 2 * 60 * 60
+# Se refresca el token si vence dentro de este margen
+MARGEN_REFRESCO_SEG = 120
+SESION_KEY = 'supabase_sesion'
+
+# Transporte HTTP compartido por todos los clientes; se puede ajustar en secrets.toml
+# bajo [supabase.http] con las mismas claves en minúscula
+HTTP_DEFAULTS = {
+    'max_conexiones': 20,
+    'max_keepalive': 10,
+    'keepalive_seg': 30.0,
+    'http2': True,
+    'timeout_conexion': 5.0,
+    'timeout_lectura': 30.0,
+    'timeout_pool': 10.0,
+}
+MUESTRAS_ESPERA = 500
+
+def _leer_credenciales(secrets) -> tuple:
     try:
         # 🚨 Asegúrate de que las rutas 'supabase' y 'url'/'key' coincidan con tu secrets.toml
         SUPABASE_URL = secrets["supabase"]["url"]
@@ -17,25 +47,284 @@ def initialize_supabase_client(secrets: dict) -> Client:
     if not SUPABASE_URL or not SUPABASE_KEY:
         st.error("Error de configuración: Las URL o KEY de Supabase están vacías.") 
         st.stop()
+    return SUPABASE_URL, SUPABASE_KEY
+
+# ==================== TRANSPORTE HTTP ====================
+# Timeout puntual para las llamadas hechas dentro de timeout_llamada()
+_timeout_actual: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('timeout_llamada', default=None)
+
+@contextmanager
+def timeout_llamada(segundos: float):
+    """Limita el tiempo de las requests hechas dentro del bloque (conexión, lectura y espera del pool)"""
+    token = _timeout_actual.set(segundos)
+    try:
+        yield
+    finally:
+        _timeout_actual.reset(token)
+
+class _TransporteInstrumentado(httpx.HTTPTransport):
+    """Transporte con keep-alive que cuenta conexiones abiertas/reutilizadas y la espera por el pool.
+
+    Usa la extensión 'trace' de httpcore: el primer evento de una request llega cuando ya tiene
+    conexión asignada, así que el tiempo hasta ese evento es la espera en cola del pool. Si entre
+    los eventos aparece connect_tcp, la conexión es nueva; si no, se reutilizó una del keep-alive."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._esperas: Deque[float] = deque(maxlen=MUESTRAS_ESPERA)
+        self._stats = {
+            'solicitudes': 0, 'conexiones_abiertas': 0, 'conexiones_reutilizadas': 0,
+            'espera_total_ms': 0.0, 'errores': 0, 'timeouts_pool': 0,
+        }
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        inicio = time.perf_counter()
+        marca = {'primer_evento': None, 'nueva': False}
+
+        def trace(evento: str, info: Dict[str, Any]) -> None:
+            if marca['primer_evento'] is None:
+                marca['primer_evento'] = time.perf_counter()
+            if evento == 'connection.connect_tcp.complete':
+                marca['nueva'] = True
 
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+        request.extensions = {**request.extensions, 'trace': trace}
+        segundos = _timeout_actual.get()
+        if segundos is not None:
+            request.extensions['timeout'] = {'connect': segundos, 'read': segundos, 'write': segundos, 'pool': segundos}
+        error = pool_timeout = False
+        try:
+            return super().handle_request(request)
+        except httpx.PoolTimeout:
+            error = pool_timeout = True
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._registrar(inicio, marca, error, pool_timeout)
 
-# 🔑 Definimos la función de acceso con caché para usarla globalmente.
+    def _registrar(self, inicio: float, marca: Dict[str, Any], error: bool, pool_timeout: bool) -> None:
+        espera_ms = ((marca['primer_evento'] or time.perf_counter()) - inicio) * 1000
+        with self._lock:
+            self._stats['solicitudes'] += 1
+            self._stats['espera_total_ms'] += espera_ms
+            self._esperas.append(espera_ms)
+            if marca['primer_evento'] is not None:
+                self._stats['conexiones_abiertas' if marca['nueva'] else 'conexiones_reutilizadas'] += 1
+            self._stats['errores'] += int(error)
+            self._stats['timeouts_pool'] += int(pool_timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            esperas = sorted(self._esperas)
+            stats = dict(self._stats)
+        n = len(esperas)
+        stats['espera_ms'] = {
+            'p50': esperas[n // 2] if n else None,
+            'p95': esperas[min(n - 1, int(n * 0.95))] if n else None,
+            'max': esperas[-1] if n else None,
+        }
+        stats['conexiones_en_pool'] = len(self._pool.connections)
+        return stats
+
+def _config_http(secrets) -> Dict[str, Any]:
+    try:
+        propia = dict(secrets["supabase"].get("http", {}))
+    except Exception:
+        propia = {}
+    return {**HTTP_DEFAULTS, **{k: v for k, v in propia.items() if k in HTTP_DEFAULTS}}
+
+@st.cache_resource
+def _get_transporte() -> _TransporteInstrumentado:
+    config = _config_http(st.secrets)
+    return _TransporteInstrumentado(
+        http2=bool(config['http2']),
+        limits=httpx.Limits(
+            max_connections=int(config['max_conexiones']),
+            max_keepalive_connections=int(config['max_keepalive']),
+            keepalive_expiry=float(config['keepalive_seg']),
+        ),
+    )
+
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """Cliente HTTP único por proceso: todos los clientes Supabase comparten su pool de conexiones."""
+    config = _config_http(st.secrets)
+    timeout = httpx.Timeout(
+        config['timeout_lectura'], connect=config['timeout_conexion'], pool=config['timeout_pool']
+    )
+    return httpx.Client(transport=_get_transporte(), timeout=timeout, follow_redirects=True)
+
+def get_http_stats() -> Dict[str, Any]:
+    """Contadores del transporte: sirven para distinguir latencia de red de falta de conexiones"""
+    return {**_get_transporte().stats(), 'config': _config_http(st.secrets)}
+
+def initialize_supabase_client(secrets: dict) -> Client:
+    """Inicializa y configura el cliente Supabase usando las secrets de Streamlit."""
+    SUPABASE_URL, SUPABASE_KEY = _leer_credenciales(secrets)
+    # Sin hilo de refresco automático: el pool refresca el token al usarlo (ver _PoolSesiones).
+    # Las cabeceras de auth van por request; el pool de conexiones HTTP es compartido.
+    return create_client(SUPABASE_URL, SUPABASE_KEY, ClientOptions(
+        auto_refresh_token=False,
+        httpx_client=get_http_client(),
+    ))
+
+# 🔑 Cliente anónimo compartido: nunca inicia sesión, así que es seguro entre sesiones e hilos
 @st.cache_resource 
-def get_supabase_client() -> Client:
-    """Devuelve la instancia del cliente Supabase, cacheada globalmente."""
+def get_cliente_compartido() -> Client:
+    """Cliente sin usuario, para tareas de fondo (monitor de salud) y visitantes sin login."""
     return initialize_supabase_client(st.secrets)
 
-# 🧪 Función de Verificación de Conexión (usando una tabla de prueba)
+# ==================== POOL DE CLIENTES POR SESIÓN ====================
+class _PoolSesiones:
+    """LRU de clientes autenticados, uno por sesión de navegador.
+
+    Cada cliente guarda su propio estado de auth, así que los usuarios concurrentes no se
+    pisan y sus requests no se serializan en un único cliente. Los tokens viven también en
+    st.session_state: si un cliente fue expulsado, se reconstruye con set_session()."""
+
+    def __init__(self, max_sesiones: int = MAX_SESIONES, inactividad_max: float = INACTIVIDAD_MAX_SEG):
+        self.max_sesiones = max_sesiones
+        self.inactividad_max = inactividad_max
+        self._clientes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'creados': 0, 'reutilizados': 0, 'expulsados': 0, 'refrescos': 0}
+
+    def registrar(self, clave: str, cliente: Client) -> None:
+        with self._lock:
+            self._clientes[clave] = {'cliente': cliente, 'ultimo_uso': time.monotonic()}
+            self._clientes.move_to_end(clave)
+            self._stats['creados'] += 1
+            self._expulsar()
+
+    def obtener(self, clave: str, tokens: Dict[str, Any]) -> Client:
+        """Cliente de la sesión; lo reconstruye desde los tokens si no está en el pool"""
+        with self._lock:
+            entrada = self._clientes.get(clave)
+            if entrada is not None:
+                entrada['ultimo_uso'] = time.monotonic()
+                self._clientes.move_to_end(clave)
+                self._stats['reutilizados'] += 1
+        if entrada is None:
+            cliente = initialize_supabase_client(st.secrets)
+            respuesta = cliente.auth.set_session(tokens['access_token'], tokens['refresh_token'])
+            _guardar_tokens(tokens, respuesta.session)
+            self.registrar(clave, cliente)
+            return cliente
+
+        cliente = entrada['cliente']
+        if (tokens.get('expires_at') or 0) <= time.time() + MARGEN_REFRESCO_SEG:
+            respuesta = cliente.auth.refresh_session(tokens['refresh_token'])
+            _guardar_tokens(tokens, respuesta.session)
+            with self._lock:
+                self._stats['refrescos'] += 1
+        return cliente
+
+    def liberar(self, clave: str) -> Optional[Client]:
+        with self._lock:
+            entrada = self._clientes.pop(clave, None)
+        return entrada['cliente'] if entrada else None
+
+    def _expulsar(self) -> None:
+        # Llamar con el lock tomado: primero las sesiones inactivas, luego por tamaño (LRU)
+        limite = time.monotonic() - self.inactividad_max
+        for clave in [c for c, e in self._clientes.items() if e['ultimo_uso'] < limite]:
+            del self._clientes[clave]
+            self._stats['expulsados'] += 1
+        while len(self._clientes) > self.max_sesiones:
+            self._clientes.popitem(last=False)
+            self._stats['expulsados'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'sesiones': len(self._clientes), 'max_sesiones': self.max_sesiones, **self._stats}
+
+@st.cache_resource
+def get_pool_sesiones() -> _PoolSesiones:
+    """Pool único por proceso"""
+    return _PoolSesiones()
+
+def _guardar_tokens(tokens: Dict[str, Any], session) -> None:
+    if session is None:
+        return
+    tokens.update({
+        'access_token': session.access_token,
+        'refresh_token': session.refresh_token,
+        'expires_at': session.expires_at,
+    })
+
+def _clave_sesion() -> str:
+    estado = st.session_state.setdefault(SESION_KEY, {})
+    if 'clave' not in estado:
+        estado['clave'] = uuid.uuid4().hex
+    return estado['clave']
+
+# ==================== API DE SESIÓN ====================
+def crear_cliente_sesion() -> Client:
+    """Cliente nuevo y aislado para iniciar sesión o registrarse sin tocar el compartido."""
+    return initialize_supabase_client(st.secrets)
+
+def registrar_sesion(cliente: Client, session) -> None:
+    """Asocia un cliente ya autenticado a la sesión de navegador actual"""
+    clave = _clave_sesion()
+    _guardar_tokens(st.session_state[SESION_KEY], session)
+    get_pool_sesiones().registrar(clave, cliente)
+
+def cerrar_sesion_cliente() -> None:
+    """Cierra solo la sesión actual (scope local) y saca su cliente del pool"""
+    estado = st.session_state.pop(SESION_KEY, None)
+    if not estado or 'clave' not in estado:
+        return
+    cliente = get_pool_sesiones().liberar(estado['clave'])
+    if cliente is not None:
+        cliente.auth.sign_out({"scope": "local"})
+
+# Permite fijar el cliente en hilos sin contexto de Streamlit (precargas, descargas diferidas)
+_cliente_actual: contextvars.ContextVar[Optional[Client]] = contextvars.ContextVar('cliente_supabase', default=None)
+
+def con_cliente_actual(funcion: Callable) -> Callable:
+    """Envuelve una función para que, al ejecutarse en otro hilo, use el cliente de esta sesión"""
+    cliente = get_supabase_client()
+
+    def envoltura(*args, **kwargs):
+        token = _cliente_actual.set(cliente)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            _cliente_actual.reset(token)
+    return envoltura
+
+# 🔑 Punto de acceso único que usa el resto de la app
+def get_supabase_client() -> Client:
+    """Devuelve el cliente de la sesión actual (autenticado si hay login, compartido si no)."""
+    cliente = _cliente_actual.get()
+    if cliente is not None:
+        return cliente
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return get_cliente_compartido()
+    tokens = st.session_state.get(SESION_KEY) or {}
+    if not tokens.get('refresh_token'):
+        return get_cliente_compartido()
+    try:
+        return get_pool_sesiones().obtener(tokens['clave'], tokens)
+    except Exception as e:
+        # Refresh token revocado o vencido: se fuerza un nuevo login en vez de operar como anónimo
+        print(f"Error al restaurar la sesión de Supabase: {e}")
+        get_pool_sesiones().liberar(tokens['clave'])
+        st.session_state.pop(SESION_KEY, None)
+        st.session_state.user_id = None
+        st.warning("⚠️ Su sesión expiró. Por favor inicie sesión nuevamente.")
+        return get_cliente_compartido()
+
+# 🧪 Función de Verificación de Conexión (sincrónica; el monitor en utils/health.py la evita en cada rerun)
 def test_supabase_connection(supabase_client: Client) -> bool:
     """
     Intenta realizar una operación de lectura simple para verificar la conexión.
-    REEMPLAZA 'tu_tabla_de_prueba' con una tabla real.
+    Usa 'categorias', una tabla real y pequeña del esquema.
     """
     try:
-        # Usa una tabla que sepas que existe, por ejemplo, 'profiles' o 'users' (si es tu tabla personalizada)
-        # O la tabla que usaste para la prueba anterior.
-        response = supabase_client.from_('tu_tabla_de_prueba').select('*').limit(0).execute() 
+        response = supabase_client.table('categorias').select('id').limit(1).execute() 
         
         if response and response.data is not None:
             return True
@@ -420,3 +420,1274 @@ ALTER TABLE ONLY public.presupuestos
 
 
 
+-- =============================================
+-- BÚSQUEDA DE TEXTO COMPLETO Y DIFUSA
+-- =============================================
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE public.presupuestos
+    ADD COLUMN busqueda tsvector GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(descripcion, ''))) STORED;
+ALTER TABLE public.items_en_presupuesto
+    ADD COLUMN busqueda tsvector GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(nombre_personalizado, ''))) STORED;
+
+CREATE INDEX idx_presupuestos_busqueda ON public.presupuestos USING gin (busqueda);
+CREATE INDEX idx_items_en_presupuesto_busqueda ON public.items_en_presupuesto USING gin (busqueda);
+CREATE INDEX idx_presupuestos_descripcion_trgm ON public.presupuestos USING gin (descripcion gin_trgm_ops);
+CREATE INDEX idx_items_en_presupuesto_nombre_trgm ON public.items_en_presupuesto USING gin (nombre_personalizado gin_trgm_ops);
+CREATE INDEX idx_clientes_nombre_trgm ON public.clientes USING gin (nombre gin_trgm_ops);
+CREATE INDEX idx_lugares_trabajo_nombre_trgm ON public.lugares_trabajo USING gin (nombre gin_trgm_ops);
+CREATE INDEX idx_presupuestos_creado_por_fecha ON public.presupuestos USING btree (creado_por, fecha_creacion DESC);
+
+-- Devuelve presupuestos ordenados por relevancia; cada fila trae el total de coincidencias
+-- y la suma de sus totales para que la UI pagine y muestre métricas con una sola consulta.
+-- El usuario llega como texto desde la app: se convierte el parámetro (no la columna) para que
+-- el filtro use los índices que empiezan por creado_por. Igual en todas las RPC de este archivo.
+CREATE OR REPLACE FUNCTION public.buscar_presupuestos(p_user_id text, p_query text, p_limit integer DEFAULT 20, p_offset integer DEFAULT 0)
+RETURNS TABLE (
+    id integer,
+    fecha_creacion timestamp without time zone,
+    total numeric,
+    descripcion text,
+    cliente text,
+    lugar text,
+    coincidencia text,
+    relevancia real,
+    total_hits bigint,
+    suma_hits numeric
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (
+        SELECT websearch_to_tsquery('spanish', p_query) AS tsq, '%' || p_query || '%' AS patron
+    ),
+    propios AS (
+        SELECT p.* FROM public.presupuestos p WHERE p.creado_por = p_user_id::integer
+    ),
+    hits AS (
+        SELECT p.id, ts_rank(p.busqueda, q.tsq) + word_similarity(p_query, p.descripcion) AS score, p.descripcion AS coincidencia
+        FROM propios p, q
+        WHERE p.busqueda @@ q.tsq OR p.descripcion ILIKE q.patron OR p_query <% p.descripcion
+        UNION ALL
+        SELECT i.presupuesto_id, ts_rank(i.busqueda, q.tsq) + word_similarity(p_query, i.nombre_personalizado), i.nombre_personalizado
+        FROM public.items_en_presupuesto i JOIN propios p ON p.id = i.presupuesto_id, q
+        WHERE i.busqueda @@ q.tsq OR i.nombre_personalizado ILIKE q.patron OR p_query <% i.nombre_personalizado
+        UNION ALL
+        SELECT p.id, word_similarity(p_query, c.nombre), c.nombre
+        FROM propios p JOIN public.clientes c ON c.id = p.cliente_id, q
+        WHERE c.nombre ILIKE q.patron OR p_query <% c.nombre
+        UNION ALL
+        SELECT p.id, word_similarity(p_query, l.nombre), l.nombre
+        FROM propios p JOIN public.lugares_trabajo l ON l.id = p.lugar_trabajo_id, q
+        WHERE l.nombre ILIKE q.patron OR p_query <% l.nombre
+    ),
+    mejores AS (
+        SELECT DISTINCT ON (h.id) h.id, h.score, h.coincidencia FROM hits h ORDER BY h.id, h.score DESC
+    )
+    SELECT p.id, p.fecha_creacion, p.total, p.descripcion, c.nombre, l.nombre, m.coincidencia, m.score::real,
+           count(*) OVER (), sum(p.total) OVER ()
+    FROM mejores m
+    JOIN public.presupuestos p ON p.id = m.id
+    LEFT JOIN public.clientes c ON c.id = p.cliente_id
+    LEFT JOIN public.lugares_trabajo l ON l.id = p.lugar_trabajo_id
+    ORDER BY m.score DESC, p.fecha_creacion DESC
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+-- =============================================
+-- ANALÍTICA PRE-AGREGADA (REFRESCO INCREMENTAL)
+-- =============================================
+-- Aporte de cada presupuesto por categoría: se recalcula solo el presupuesto que cambió
+CREATE TABLE public.analitica_presupuesto (
+    presupuesto_id integer NOT NULL,
+    categoria_id integer,
+    creado_por integer,
+    mes date NOT NULL,
+    cliente_id integer,
+    lugar_trabajo_id integer,
+    materiales numeric(14,2) DEFAULT 0 NOT NULL,
+    mano_obra numeric(14,2) DEFAULT 0 NOT NULL,
+    num_items integer DEFAULT 0 NOT NULL,
+    CONSTRAINT analitica_presupuesto_key UNIQUE NULLS NOT DISTINCT (presupuesto_id, categoria_id)
+);
+
+-- Rollup mensual por cliente, lugar y categoría (lo que lee el dashboard)
+CREATE TABLE public.analitica_mensual (
+    creado_por integer,
+    mes date NOT NULL,
+    cliente_id integer REFERENCES public.clientes(id) ON DELETE CASCADE,
+    lugar_trabajo_id integer REFERENCES public.lugares_trabajo(id) ON DELETE CASCADE,
+    categoria_id integer REFERENCES public.categorias(id) ON DELETE CASCADE,
+    materiales numeric(14,2) DEFAULT 0 NOT NULL,
+    mano_obra numeric(14,2) DEFAULT 0 NOT NULL,
+    num_items integer DEFAULT 0 NOT NULL,
+    CONSTRAINT analitica_mensual_key UNIQUE NULLS NOT DISTINCT (creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id)
+);
+
+-- Rollup mensual de presupuestos (cantidad y monto cotizado)
+CREATE TABLE public.analitica_mensual_presupuestos (
+    creado_por integer,
+    mes date NOT NULL,
+    cliente_id integer REFERENCES public.clientes(id) ON DELETE CASCADE,
+    lugar_trabajo_id integer REFERENCES public.lugares_trabajo(id) ON DELETE CASCADE,
+    num_presupuestos integer DEFAULT 0 NOT NULL,
+    total numeric(14,2) DEFAULT 0 NOT NULL,
+    CONSTRAINT analitica_mensual_presupuestos_key UNIQUE NULLS NOT DISTINCT (creado_por, mes, cliente_id, lugar_trabajo_id)
+);
+
+CREATE INDEX idx_analitica_mensual_usuario_mes ON public.analitica_mensual USING btree (creado_por, mes);
+CREATE INDEX idx_analitica_mensual_presupuestos_usuario_mes ON public.analitica_mensual_presupuestos USING btree (creado_por, mes);
+
+ALTER TABLE public.analitica_presupuesto ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.analitica_mensual ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.analitica_mensual_presupuestos ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_analitica_presupuesto" ON public.analitica_presupuesto FOR ALL USING (true);
+CREATE POLICY "permitir_todo_analitica_mensual" ON public.analitica_mensual FOR ALL USING (true);
+CREATE POLICY "permitir_todo_analitica_mensual_presupuestos" ON public.analitica_mensual_presupuestos FOR ALL USING (true);
+
+-- Resta el aporte anterior del presupuesto, lo recalcula desde sus ítems y suma el nuevo.
+-- El costo depende solo de los ítems de ese presupuesto.
+CREATE OR REPLACE FUNCTION public.refrescar_analitica_presupuesto(p_presupuesto_id integer)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE public.analitica_mensual m
+    SET materiales = m.materiales - a.materiales,
+        mano_obra = m.mano_obra - a.mano_obra,
+        num_items = m.num_items - a.num_items
+    FROM public.analitica_presupuesto a
+    WHERE a.presupuesto_id = p_presupuesto_id
+      AND m.creado_por IS NOT DISTINCT FROM a.creado_por
+      AND m.mes = a.mes
+      AND m.cliente_id IS NOT DISTINCT FROM a.cliente_id
+      AND m.lugar_trabajo_id IS NOT DISTINCT FROM a.lugar_trabajo_id
+      AND m.categoria_id IS NOT DISTINCT FROM a.categoria_id;
+
+    DELETE FROM public.analitica_presupuesto WHERE presupuesto_id = p_presupuesto_id;
+
+    INSERT INTO public.analitica_presupuesto (presupuesto_id, categoria_id, creado_por, mes, cliente_id, lugar_trabajo_id, materiales, mano_obra, num_items)
+    SELECT p.id, i.categoria_id, p.creado_por, date_trunc('month', p.fecha_creacion)::date, p.cliente_id, p.lugar_trabajo_id,
+           coalesce(sum(i.total) FILTER (WHERE i.nombre_personalizado NOT ILIKE 'mano de obra%'), 0),
+           coalesce(sum(i.total) FILTER (WHERE i.nombre_personalizado ILIKE 'mano de obra%'), 0),
+           count(*) FILTER (WHERE i.nombre_personalizado NOT ILIKE 'mano de obra%')
+    FROM public.presupuestos p
+    JOIN public.items_en_presupuesto i ON i.presupuesto_id = p.id
+    WHERE p.id = p_presupuesto_id
+    GROUP BY p.id, i.categoria_id;
+
+    INSERT INTO public.analitica_mensual AS m (creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id, materiales, mano_obra, num_items)
+    SELECT creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id, materiales, mano_obra, num_items
+    FROM public.analitica_presupuesto
+    WHERE presupuesto_id = p_presupuesto_id
+    ON CONFLICT ON CONSTRAINT analitica_mensual_key DO UPDATE
+    SET materiales = m.materiales + EXCLUDED.materiales,
+        mano_obra = m.mano_obra + EXCLUDED.mano_obra,
+        num_items = m.num_items + EXCLUDED.num_items;
+
+    DELETE FROM public.analitica_mensual WHERE num_items <= 0 AND materiales = 0 AND mano_obra = 0;
+END;
+$$;
+
+-- Ítems: un refresco por presupuesto afectado y por sentencia (un lote de 300 ítems = 1 refresco)
+CREATE OR REPLACE FUNCTION public.trg_analitica_items()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_id integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        FOR v_id IN SELECT DISTINCT presupuesto_id FROM nuevos WHERE presupuesto_id IS NOT NULL LOOP
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR v_id IN SELECT DISTINCT presupuesto_id FROM viejos WHERE presupuesto_id IS NOT NULL LOOP
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    ELSE
+        FOR v_id IN SELECT presupuesto_id FROM nuevos UNION SELECT presupuesto_id FROM viejos LOOP
+            CONTINUE WHEN v_id IS NULL;
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER analitica_items_insert AFTER INSERT ON public.items_en_presupuesto
+    REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+CREATE TRIGGER analitica_items_update AFTER UPDATE ON public.items_en_presupuesto
+    REFERENCING NEW TABLE AS nuevos OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+CREATE TRIGGER analitica_items_delete AFTER DELETE ON public.items_en_presupuesto
+    REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+
+-- Presupuestos: delta O(1) sobre el rollup de presupuestos; si cambian cliente/lugar/fecha
+-- se mueve también el aporte de sus ítems
+CREATE OR REPLACE FUNCTION public.trg_analitica_presupuestos()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.analitica_mensual_presupuestos m
+        SET num_presupuestos = m.num_presupuestos - 1,
+            total = m.total - OLD.total
+        WHERE m.creado_por IS NOT DISTINCT FROM OLD.creado_por
+          AND m.mes = date_trunc('month', OLD.fecha_creacion)::date
+          AND m.cliente_id IS NOT DISTINCT FROM OLD.cliente_id
+          AND m.lugar_trabajo_id IS NOT DISTINCT FROM OLD.lugar_trabajo_id;
+        DELETE FROM public.analitica_mensual_presupuestos WHERE num_presupuestos <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.analitica_mensual_presupuestos AS m (creado_por, mes, cliente_id, lugar_trabajo_id, num_presupuestos, total)
+        VALUES (NEW.creado_por, date_trunc('month', NEW.fecha_creacion)::date, NEW.cliente_id, NEW.lugar_trabajo_id, 1, NEW.total)
+        ON CONFLICT ON CONSTRAINT analitica_mensual_presupuestos_key DO UPDATE
+        SET num_presupuestos = m.num_presupuestos + 1,
+            total = m.total + EXCLUDED.total;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND (NEW.cliente_id, NEW.lugar_trabajo_id, NEW.fecha_creacion, NEW.creado_por)
+            IS DISTINCT FROM (OLD.cliente_id, OLD.lugar_trabajo_id, OLD.fecha_creacion, OLD.creado_por) THEN
+        PERFORM public.refrescar_analitica_presupuesto(NEW.id);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM public.refrescar_analitica_presupuesto(OLD.id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER analitica_presupuestos AFTER INSERT OR UPDATE OR DELETE ON public.presupuestos
+    FOR EACH ROW EXECUTE FUNCTION public.trg_analitica_presupuestos();
+
+-- Carga inicial de los datos existentes
+SELECT public.refrescar_analitica_presupuesto(id) FROM public.presupuestos;
+INSERT INTO public.analitica_mensual_presupuestos (creado_por, mes, cliente_id, lugar_trabajo_id, num_presupuestos, total)
+SELECT creado_por, date_trunc('month', fecha_creacion)::date, cliente_id, lugar_trabajo_id, count(*), sum(total)
+FROM public.presupuestos
+GROUP BY 1, 2, 3, 4;
+
+-- =============================================
+-- CLIENTES CON AGREGADOS (PAGINADO)
+-- =============================================
+CREATE INDEX idx_clientes_creado_por_nombre ON public.clientes USING btree (creado_por, nombre);
+
+-- Una sola consulta agrupada: cada cliente con nº de presupuestos, total cotizado y fecha del último.
+-- Con p_busqueda filtra por nombre o alias (ILIKE + similitud de trigramas, ambos por índice GIN)
+-- y ordena por parecido; los comodines % y _ del texto se escapan.
+CREATE INDEX idx_clientes_alias_trgm ON public.clientes USING gin (alias gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION public.clientes_detallados(p_user_id text, p_limit integer DEFAULT 48, p_offset integer DEFAULT 0, p_busqueda text DEFAULT NULL)
+RETURNS TABLE (
+    id integer,
+    nombre character varying,
+    alias character varying,
+    fecha_registro timestamp without time zone,
+    num_presupuestos bigint,
+    total_cotizado numeric,
+    ultimo_presupuesto timestamp without time zone,
+    total_clientes bigint
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (
+        SELECT '%' || replace(replace(replace(p_busqueda, '\', '\\'), '%', '\%'), '_', '\_') || '%' AS patron
+    )
+    SELECT c.id, c.nombre, c.alias, c.fecha_registro,
+           count(p.id), coalesce(sum(p.total), 0), max(p.fecha_creacion),
+           count(*) OVER ()
+    FROM public.clientes c
+    CROSS JOIN q
+    LEFT JOIN public.presupuestos p ON p.cliente_id = c.id
+    WHERE c.creado_por = p_user_id::integer
+      AND (p_busqueda IS NULL
+           OR c.nombre ILIKE q.patron
+           OR c.alias ILIKE q.patron
+           OR p_busqueda <% c.nombre)
+    GROUP BY c.id
+    ORDER BY CASE WHEN p_busqueda IS NULL THEN 0 ELSE word_similarity(p_busqueda, c.nombre) END DESC, c.nombre
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+-- =============================================
+-- CLIENTES: NOMBRE NORMALIZADO Y FUSIÓN DE DUPLICADOS
+-- =============================================
+-- Minúsculas, sin espacios al borde y con espacios internos colapsados ("Matias " = "matias")
+ALTER TABLE public.clientes
+    ADD COLUMN nombre_normalizado text GENERATED ALWAYS AS (lower(regexp_replace(btrim(nombre), '\s+', ' ', 'g'))) STORED;
+
+CREATE UNIQUE INDEX idx_clientes_usuario_nombre_normalizado ON public.clientes USING btree (creado_por, nombre_normalizado);
+CREATE INDEX idx_clientes_nombre_normalizado_trgm ON public.clientes USING gin (nombre_normalizado gin_trgm_ops);
+
+-- Candidatos a duplicado de un nombre (similitud de trigramas sobre el nombre normalizado)
+CREATE OR REPLACE FUNCTION public.clientes_similares(p_user_id text, p_nombre text, p_umbral real DEFAULT 0.5, p_limit integer DEFAULT 5)
+RETURNS TABLE (id integer, nombre character varying, similitud real)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (SELECT lower(regexp_replace(btrim(p_nombre), '\s+', ' ', 'g')) AS n)
+    SELECT c.id, c.nombre, similarity(c.nombre_normalizado, q.n)
+    FROM public.clientes c, q
+    WHERE c.creado_por = p_user_id::integer
+      AND c.nombre_normalizado % q.n
+      AND similarity(c.nombre_normalizado, q.n) >= p_umbral
+    ORDER BY similarity(c.nombre_normalizado, q.n) DESC, c.nombre
+    LIMIT p_limit;
+$$;
+
+-- Reasigna los presupuestos de los duplicados al cliente que sobrevive y borra los duplicados,
+-- todo en la misma transacción. Devuelve cuántos presupuestos se movieron.
+CREATE OR REPLACE FUNCTION public.fusionar_clientes(p_user_id text, p_destino integer, p_duplicados integer[])
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_movidos integer;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.clientes WHERE id = p_destino AND creado_por = p_user_id::integer) THEN
+        RAISE EXCEPTION 'Cliente destino % no encontrado', p_destino;
+    END IF;
+
+    UPDATE public.presupuestos
+    SET cliente_id = p_destino
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+    GET DIAGNOSTICS v_movidos = ROW_COUNT;
+
+    DELETE FROM public.clientes
+    WHERE id = ANY (p_duplicados)
+      AND id <> p_destino
+      AND creado_por = p_user_id::integer;
+
+    RETURN v_movidos;
+END;
+$$;
+
+-- =============================================
+-- IDEMPOTENCIA DE ESCRITURAS
+-- =============================================
+-- Clave opcional que genera la app por cada presupuesto en curso. Permite reintentar el guardado
+-- tras un fallo de red (upsert sobre la clave) sin crear un presupuesto duplicado.
+ALTER TABLE public.presupuestos ADD COLUMN clave_idempotencia text;
+ALTER TABLE public.presupuestos ADD CONSTRAINT presupuestos_clave_idempotencia_key UNIQUE (clave_idempotencia);
+
+-- =============================================
+-- MARCAS DE CAMBIO PARA LA RÉPLICA LOCAL
+-- =============================================
+-- La réplica offline (utils/replica.py) trae solo las filas con actualizado_en posterior a su
+-- última sincronización, y la usa para detectar conflictos (update/delete condicionados a la versión leída).
+ALTER TABLE public.clientes ADD COLUMN actualizado_en timestamptz NOT NULL DEFAULT now();
+ALTER TABLE public.lugares_trabajo ADD COLUMN actualizado_en timestamptz NOT NULL DEFAULT now();
+ALTER TABLE public.categorias ADD COLUMN actualizado_en timestamptz NOT NULL DEFAULT now();
+ALTER TABLE public.presupuestos ADD COLUMN actualizado_en timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX idx_clientes_creado_por_actualizado ON public.clientes USING btree (creado_por, actualizado_en);
+CREATE INDEX idx_lugares_creado_por_actualizado ON public.lugares_trabajo USING btree (creado_por, actualizado_en);
+CREATE INDEX idx_categorias_creado_por_actualizado ON public.categorias USING btree (creado_por, actualizado_en);
+CREATE INDEX idx_presupuestos_creado_por_actualizado ON public.presupuestos USING btree (creado_por, actualizado_en);
+
+CREATE OR REPLACE FUNCTION public.tocar_actualizado_en()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.actualizado_en := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER trg_clientes_actualizado BEFORE UPDATE ON public.clientes
+    FOR EACH ROW EXECUTE FUNCTION public.tocar_actualizado_en();
+CREATE TRIGGER trg_lugares_actualizado BEFORE UPDATE ON public.lugares_trabajo
+    FOR EACH ROW EXECUTE FUNCTION public.tocar_actualizado_en();
+CREATE TRIGGER trg_categorias_actualizado BEFORE UPDATE ON public.categorias
+    FOR EACH ROW EXECUTE FUNCTION public.tocar_actualizado_en();
+CREATE TRIGGER trg_presupuestos_actualizado BEFORE UPDATE ON public.presupuestos
+    FOR EACH ROW EXECUTE FUNCTION public.tocar_actualizado_en();
+
+-- Un cambio en los ítems cuenta como cambio del presupuesto (una sola actualización por sentencia)
+CREATE OR REPLACE FUNCTION public.tocar_presupuestos_de_items()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE public.presupuestos p SET actualizado_en = clock_timestamp()
+        WHERE p.id IN (SELECT DISTINCT presupuesto_id FROM filas_viejas);
+    ELSE
+        UPDATE public.presupuestos p SET actualizado_en = clock_timestamp()
+        WHERE p.id IN (SELECT DISTINCT presupuesto_id FROM filas_nuevas);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_items_tocan_presupuesto_ins AFTER INSERT ON public.items_en_presupuesto
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+CREATE TRIGGER trg_items_tocan_presupuesto_upd AFTER UPDATE ON public.items_en_presupuesto
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+CREATE TRIGGER trg_items_tocan_presupuesto_del AFTER DELETE ON public.items_en_presupuesto
+    REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+
+-- Lápidas: un borrado no deja fila con actualizado_en, así que se anota aparte. La réplica lee las
+-- lápidas posteriores a su última sincronización en vez de comparar listas de ids (que PostgREST
+-- puede cortar). Se conservan RETENCION_LAPIDAS_DIAS (utils/replica.py); una réplica más vieja
+-- se recarga entera.
+CREATE TABLE public.filas_borradas (
+    id bigserial PRIMARY KEY,
+    tabla text NOT NULL,
+    fila_id integer NOT NULL,
+    creado_por integer,
+    borrado_en timestamptz NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX idx_filas_borradas_usuario_borrado ON public.filas_borradas USING btree (creado_por, borrado_en);
+
+ALTER TABLE public.filas_borradas ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_filas_borradas" ON public.filas_borradas FOR ALL USING (true);
+
+CREATE OR REPLACE FUNCTION public.trg_anotar_borrados()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.filas_borradas (tabla, fila_id, creado_por)
+    SELECT TG_TABLE_NAME, id, creado_por FROM viejas;
+    -- Limpieza ocasional, como en registro_cambios
+    IF random() < 0.01 THEN
+        DELETE FROM public.filas_borradas WHERE borrado_en < now() - interval '90 days';
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_tabla text;
+BEGIN
+    FOREACH v_tabla IN ARRAY ARRAY['clientes', 'lugares_trabajo', 'categorias', 'presupuestos'] LOOP
+        EXECUTE format('CREATE TRIGGER anotar_borrados AFTER DELETE ON public.%I
+            REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION public.trg_anotar_borrados()', v_tabla);
+    END LOOP;
+END;
+$$;
+
+-- =============================================
+-- NOTIFICACIÓN DE CAMBIOS (INVALIDACIÓN DE CACHÉS)
+-- =============================================
+-- Cada sentencia que toca clientes, lugares, categorías o presupuestos avisa qué tabla cambió y de
+-- qué usuario, con los ids si son pocos: por pg_notify (canal grino_cambios, para LISTEN) y en
+-- registro_cambios (para quien lee por PostgREST). Los ítems no necesitan aviso propio: sus cambios
+-- ya actualizan presupuestos.actualizado_en, que dispara el aviso del presupuesto.
+CREATE TABLE public.registro_cambios (
+    id bigserial PRIMARY KEY,
+    tabla text NOT NULL,
+    creado_por text,
+    ids integer[],
+    creado_en timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_registro_cambios_creado_en ON public.registro_cambios USING btree (creado_en);
+
+ALTER TABLE public.registro_cambios ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_registro_cambios" ON public.registro_cambios FOR ALL USING (true);
+
+CREATE OR REPLACE FUNCTION public.emitir_cambio(p_tabla text, p_creado_por text, p_ids integer[])
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    -- El payload de NOTIFY tiene un límite de 8000 bytes: sin ids significa "todo lo del usuario"
+    v_ids integer[] := CASE WHEN cardinality(p_ids) <= 100 THEN p_ids END;
+BEGIN
+    INSERT INTO public.registro_cambios (tabla, creado_por, ids) VALUES (p_tabla, p_creado_por, v_ids);
+    PERFORM pg_notify('grino_cambios', json_build_object('tabla', p_tabla, 'creado_por', p_creado_por, 'ids', v_ids)::text);
+    -- Limpieza ocasional: los lectores solo necesitan los cambios recientes
+    IF random() < 0.01 THEN
+        DELETE FROM public.registro_cambios WHERE creado_en < now() - interval '1 day';
+    END IF;
+END;
+$$;
+
+-- Un aviso por usuario afectado y por sentencia (un insert de 500 filas = 1 aviso)
+CREATE OR REPLACE FUNCTION public.trg_avisar_cambios()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.emitir_cambio(TG_TABLE_NAME, creado_por::text, array_agg(id)) FROM nuevas GROUP BY creado_por;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM public.emitir_cambio(TG_TABLE_NAME, creado_por::text, array_agg(id)) FROM viejas GROUP BY creado_por;
+    ELSE
+        PERFORM public.emitir_cambio(TG_TABLE_NAME, creado_por::text, array_agg(id))
+        FROM (SELECT creado_por, id FROM nuevas UNION SELECT creado_por, id FROM viejas) f
+        GROUP BY creado_por;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_tabla text;
+BEGIN
+    FOREACH v_tabla IN ARRAY ARRAY['clientes', 'lugares_trabajo', 'categorias', 'presupuestos'] LOOP
+        EXECUTE format('CREATE TRIGGER avisar_cambios_insert AFTER INSERT ON public.%I
+            REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION public.trg_avisar_cambios()', v_tabla);
+        EXECUTE format('CREATE TRIGGER avisar_cambios_update AFTER UPDATE ON public.%I
+            REFERENCING NEW TABLE AS nuevas OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION public.trg_avisar_cambios()', v_tabla);
+        EXECUTE format('CREATE TRIGGER avisar_cambios_delete AFTER DELETE ON public.%I
+            REFERENCING OLD TABLE AS viejas FOR EACH STATEMENT EXECUTE FUNCTION public.trg_avisar_cambios()', v_tabla);
+    END LOOP;
+END;
+$$;
+
+-- =============================================
+-- MANO DE OBRA POR CATEGORÍA
+-- =============================================
+-- Antes se guardaba como un ítem falso "Mano de Obra - {categoria}" y se reconocía por el nombre.
+-- Ahora es un monto por (presupuesto, categoría), sumable directamente en SQL.
+CREATE TABLE public.mano_obra_presupuesto (
+    presupuesto_id integer NOT NULL REFERENCES public.presupuestos(id) ON DELETE CASCADE,
+    categoria_id integer NOT NULL REFERENCES public.categorias(id),
+    monto numeric(12,2) NOT NULL CHECK (monto >= 0),
+    PRIMARY KEY (presupuesto_id, categoria_id)
+);
+
+CREATE INDEX idx_mano_obra_categoria ON public.mano_obra_presupuesto USING btree (categoria_id);
+
+ALTER TABLE public.mano_obra_presupuesto ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_mano_obra_presupuesto" ON public.mano_obra_presupuesto FOR ALL USING (true);
+
+-- Analítica: materiales salen de los ítems y la mano de obra de su tabla (sin comparar nombres)
+CREATE OR REPLACE FUNCTION public.refrescar_analitica_presupuesto(p_presupuesto_id integer)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE public.analitica_mensual m
+    SET materiales = m.materiales - a.materiales,
+        mano_obra = m.mano_obra - a.mano_obra,
+        num_items = m.num_items - a.num_items
+    FROM public.analitica_presupuesto a
+    WHERE a.presupuesto_id = p_presupuesto_id
+      AND m.creado_por IS NOT DISTINCT FROM a.creado_por
+      AND m.mes = a.mes
+      AND m.cliente_id IS NOT DISTINCT FROM a.cliente_id
+      AND m.lugar_trabajo_id IS NOT DISTINCT FROM a.lugar_trabajo_id
+      AND m.categoria_id IS NOT DISTINCT FROM a.categoria_id;
+
+    DELETE FROM public.analitica_presupuesto WHERE presupuesto_id = p_presupuesto_id;
+
+    INSERT INTO public.analitica_presupuesto (presupuesto_id, categoria_id, creado_por, mes, cliente_id, lugar_trabajo_id, materiales, mano_obra, num_items)
+    SELECT p.id, x.categoria_id, p.creado_por, date_trunc('month', p.fecha_creacion)::date, p.cliente_id, p.lugar_trabajo_id,
+           sum(x.materiales), sum(x.mano_obra), sum(x.num_items)
+    FROM public.presupuestos p
+    JOIN (
+        SELECT presupuesto_id, categoria_id, total AS materiales, 0 AS mano_obra, 1 AS num_items
+        FROM public.items_en_presupuesto WHERE presupuesto_id = p_presupuesto_id
+        UNION ALL
+        SELECT presupuesto_id, categoria_id, 0, monto, 0
+        FROM public.mano_obra_presupuesto WHERE presupuesto_id = p_presupuesto_id
+    ) x ON x.presupuesto_id = p.id
+    WHERE p.id = p_presupuesto_id
+    GROUP BY p.id, x.categoria_id;
+
+    INSERT INTO public.analitica_mensual AS m (creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id, materiales, mano_obra, num_items)
+    SELECT creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id, materiales, mano_obra, num_items
+    FROM public.analitica_presupuesto
+    WHERE presupuesto_id = p_presupuesto_id
+    ON CONFLICT ON CONSTRAINT analitica_mensual_key DO UPDATE
+    SET materiales = m.materiales + EXCLUDED.materiales,
+        mano_obra = m.mano_obra + EXCLUDED.mano_obra,
+        num_items = m.num_items + EXCLUDED.num_items;
+
+    DELETE FROM public.analitica_mensual WHERE num_items <= 0 AND materiales = 0 AND mano_obra = 0;
+END;
+$$;
+
+-- Cambios en la mano de obra: mismo refresco de analítica y misma marca de cambio que los ítems
+CREATE TRIGGER analitica_mano_obra_insert AFTER INSERT ON public.mano_obra_presupuesto
+    REFERENCING NEW TABLE AS nuevos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+CREATE TRIGGER analitica_mano_obra_update AFTER UPDATE ON public.mano_obra_presupuesto
+    REFERENCING NEW TABLE AS nuevos OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+CREATE TRIGGER analitica_mano_obra_delete AFTER DELETE ON public.mano_obra_presupuesto
+    REFERENCING OLD TABLE AS viejos FOR EACH STATEMENT EXECUTE FUNCTION public.trg_analitica_items();
+
+CREATE TRIGGER trg_mano_obra_toca_presupuesto_ins AFTER INSERT ON public.mano_obra_presupuesto
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+CREATE TRIGGER trg_mano_obra_toca_presupuesto_upd AFTER UPDATE ON public.mano_obra_presupuesto
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+CREATE TRIGGER trg_mano_obra_toca_presupuesto_del AFTER DELETE ON public.mano_obra_presupuesto
+    REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION public.tocar_presupuestos_de_items();
+
+-- Migración: los ítems "Mano de Obra..." existentes pasan a la tabla nueva (los triggers recalculan la analítica)
+INSERT INTO public.mano_obra_presupuesto (presupuesto_id, categoria_id, monto)
+SELECT presupuesto_id, categoria_id, sum(total)
+FROM public.items_en_presupuesto
+WHERE nombre_personalizado ILIKE 'mano de obra%' AND presupuesto_id IS NOT NULL AND categoria_id IS NOT NULL
+GROUP BY presupuesto_id, categoria_id;
+
+DELETE FROM public.items_en_presupuesto
+WHERE nombre_personalizado ILIKE 'mano de obra%' AND presupuesto_id IS NOT NULL AND categoria_id IS NOT NULL;
+
+-- =============================================
+-- VERSIONES DE PRESUPUESTOS (DELTAS)
+-- =============================================
+-- Un presupuesto es una sola fila con su estado actual y su número de versión. Cada edición guarda
+-- en presupuesto_versiones solo lo que cambió, como delta inverso: la fila (id, v) dice cómo eran en
+-- la versión v la cabecera, los ítems y la mano de obra que la edición v → v+1 tocó ('antes' null =
+-- no existía). El historial crece con el volumen de cambios, no con la cantidad de ediciones, y los
+-- listados muestran siempre la versión vigente porque no hay copias.
+ALTER TABLE public.presupuestos ADD COLUMN version integer NOT NULL DEFAULT 1;
+
+CREATE TABLE public.presupuesto_versiones (
+    presupuesto_id integer NOT NULL REFERENCES public.presupuestos(id) ON DELETE CASCADE,
+    version integer NOT NULL,
+    creado_en timestamptz NOT NULL DEFAULT now(),
+    cabecera jsonb NOT NULL DEFAULT '{}'::jsonb,
+    items jsonb NOT NULL DEFAULT '[]'::jsonb,
+    mano_obra jsonb NOT NULL DEFAULT '[]'::jsonb,
+    clave text,
+    PRIMARY KEY (presupuesto_id, version)
+);
+
+-- Clave de la edición que creó la versión siguiente: un reintento de la misma edición la reconoce
+CREATE UNIQUE INDEX idx_presupuesto_versiones_clave ON public.presupuesto_versiones USING btree (presupuesto_id, clave);
+
+ALTER TABLE public.presupuesto_versiones ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_presupuesto_versiones" ON public.presupuesto_versiones FOR ALL USING (true);
+
+-- Aplica una edición en una transacción y registra su delta inverso. Devuelve la nueva versión.
+-- p_items: filas con id (actualizar) o sin id (insertar); p_mano_obra: {categoria_id, monto}, monto 0 = quitar.
+-- Si otro guardó antes (versión distinta de p_version_base) falla con 409 y no toca nada.
+-- Con p_clave, repetir una edición ya aplicada (p. ej. se perdió la respuesta) devuelve la versión
+-- que creó en vez de chocar con su propio cambio.
+CREATE OR REPLACE FUNCTION public.editar_presupuesto(
+    p_user_id text,
+    p_presupuesto_id integer,
+    p_version_base integer,
+    p_cabecera jsonb DEFAULT '{}'::jsonb,
+    p_items jsonb DEFAULT '[]'::jsonb,
+    p_items_borrados integer[] DEFAULT '{}',
+    p_mano_obra jsonb DEFAULT '[]'::jsonb,
+    p_clave text DEFAULT NULL
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_actual public.presupuestos%ROWTYPE;
+    v_cabecera jsonb;
+    v_items jsonb;
+    v_nuevos jsonb;
+    v_mano_obra jsonb;
+    v_version integer;
+BEGIN
+    SELECT * INTO v_actual FROM public.presupuestos
+    WHERE id = p_presupuesto_id AND creado_por = p_user_id::integer
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Presupuesto % no encontrado', p_presupuesto_id;
+    END IF;
+    IF p_clave IS NOT NULL THEN
+        SELECT version + 1 INTO v_version FROM public.presupuesto_versiones
+        WHERE presupuesto_id = p_presupuesto_id AND clave = p_clave;
+        IF FOUND THEN
+            RETURN v_version;
+        END IF;
+    END IF;
+    IF v_actual.version <> p_version_base THEN
+        RAISE EXCEPTION 'El presupuesto % fue modificado por otra sesión (versión %, se editó la %)',
+            p_presupuesto_id, v_actual.version, p_version_base USING ERRCODE = 'PT409';
+    END IF;
+    IF p_cabecera = '{}'::jsonb AND p_items = '[]'::jsonb AND cardinality(p_items_borrados) = 0 AND p_mano_obra = '[]'::jsonb THEN
+        RETURN v_actual.version;
+    END IF;
+
+    -- Delta inverso: valores actuales de lo que se va a tocar
+    SELECT coalesce(jsonb_object_agg(k, to_jsonb(v_actual) -> k), '{}'::jsonb) INTO v_cabecera
+    FROM jsonb_object_keys(p_cabecera) k
+    WHERE k IN ('cliente_id', 'lugar_trabajo_id', 'descripcion', 'total')
+      AND to_jsonb(v_actual) -> k IS DISTINCT FROM p_cabecera -> k;
+
+    SELECT coalesce(jsonb_agg(jsonb_build_object('id', i.id, 'antes', jsonb_build_object(
+               'id', i.id, 'categoria_id', i.categoria_id, 'nombre_personalizado', i.nombre_personalizado, 'unidad', i.unidad,
+               'cantidad', i.cantidad, 'precio_unitario', i.precio_unitario, 'notas', i.notas))), '[]'::jsonb) INTO v_items
+    FROM public.items_en_presupuesto i
+    WHERE i.presupuesto_id = p_presupuesto_id
+      AND (i.id = ANY (p_items_borrados)
+           OR i.id IN (SELECT (e ->> 'id')::integer FROM jsonb_array_elements(p_items) e WHERE e ->> 'id' IS NOT NULL));
+
+    SELECT coalesce(jsonb_agg(jsonb_build_object('categoria_id', r.categoria_id, 'antes', m.monto)), '[]'::jsonb) INTO v_mano_obra
+    FROM jsonb_to_recordset(p_mano_obra) AS r(categoria_id integer, monto numeric)
+    LEFT JOIN public.mano_obra_presupuesto m ON m.presupuesto_id = p_presupuesto_id AND m.categoria_id = r.categoria_id;
+
+    -- Cambios
+    DELETE FROM public.items_en_presupuesto
+    WHERE presupuesto_id = p_presupuesto_id AND id = ANY (p_items_borrados);
+
+    UPDATE public.items_en_presupuesto i
+    SET categoria_id = r.categoria_id,
+        nombre_personalizado = r.nombre_personalizado,
+        unidad = r.unidad,
+        cantidad = r.cantidad,
+        precio_unitario = r.precio_unitario,
+        notas = r.notas
+    FROM jsonb_to_recordset(p_items) AS r(id integer, categoria_id integer, nombre_personalizado text, unidad text,
+                                         cantidad integer, precio_unitario numeric, notas text)
+    WHERE r.id IS NOT NULL AND i.id = r.id AND i.presupuesto_id = p_presupuesto_id;
+
+    WITH insertados AS (
+        INSERT INTO public.items_en_presupuesto (presupuesto_id, categoria_id, nombre_personalizado, unidad, cantidad, precio_unitario, notas)
+        SELECT p_presupuesto_id, r.categoria_id, r.nombre_personalizado, r.unidad, r.cantidad, r.precio_unitario, r.notas
+        FROM jsonb_to_recordset(p_items) AS r(id integer, categoria_id integer, nombre_personalizado text, unidad text,
+                                             cantidad integer, precio_unitario numeric, notas text)
+        WHERE r.id IS NULL
+        RETURNING id
+    )
+    SELECT coalesce(jsonb_agg(jsonb_build_object('id', id, 'antes', NULL)), '[]'::jsonb) INTO v_nuevos FROM insertados;
+
+    DELETE FROM public.mano_obra_presupuesto m
+    USING jsonb_to_recordset(p_mano_obra) AS r(categoria_id integer, monto numeric)
+    WHERE m.presupuesto_id = p_presupuesto_id AND m.categoria_id = r.categoria_id AND coalesce(r.monto, 0) <= 0;
+
+    INSERT INTO public.mano_obra_presupuesto (presupuesto_id, categoria_id, monto)
+    SELECT p_presupuesto_id, r.categoria_id, r.monto
+    FROM jsonb_to_recordset(p_mano_obra) AS r(categoria_id integer, monto numeric)
+    WHERE r.monto > 0
+    ON CONFLICT (presupuesto_id, categoria_id) DO UPDATE SET monto = EXCLUDED.monto;
+
+    UPDATE public.presupuestos
+    SET cliente_id = coalesce((p_cabecera ->> 'cliente_id')::integer, cliente_id),
+        lugar_trabajo_id = coalesce((p_cabecera ->> 'lugar_trabajo_id')::integer, lugar_trabajo_id),
+        descripcion = CASE WHEN p_cabecera ? 'descripcion' THEN p_cabecera ->> 'descripcion' ELSE descripcion END,
+        total = coalesce((p_cabecera ->> 'total')::numeric, total),
+        version = version + 1
+    WHERE id = p_presupuesto_id;
+
+    INSERT INTO public.presupuesto_versiones (presupuesto_id, version, cabecera, items, mano_obra, clave)
+    VALUES (p_presupuesto_id, v_actual.version, v_cabecera, v_items || v_nuevos, v_mano_obra, p_clave);
+
+    RETURN v_actual.version + 1;
+END;
+$$;
+
+-- =============================================
+-- ARCHIVO DE PRESUPUESTOS ANTIGUOS
+-- =============================================
+-- Los presupuestos de más de N meses pasan, con sus ítems, mano de obra y versiones, a tablas
+-- *_archivo con las mismas columnas. Las tablas activas (y sus índices) quedan con los datos
+-- recientes; los listados leen el archivo solo si el filtro de fecha llega hasta él.
+-- Se copian con SELECT *: si se agrega una columna a una tabla activa, agregarla también aquí.
+CREATE TABLE public.presupuestos_archivo (LIKE public.presupuestos INCLUDING DEFAULTS);
+ALTER TABLE public.presupuestos_archivo ALTER COLUMN id DROP DEFAULT;
+ALTER TABLE public.presupuestos_archivo ADD PRIMARY KEY (id);
+ALTER TABLE public.presupuestos_archivo
+    ADD CONSTRAINT presupuestos_archivo_cliente_id_fkey FOREIGN KEY (cliente_id) REFERENCES public.clientes(id) ON DELETE RESTRICT,
+    ADD CONSTRAINT presupuestos_archivo_lugar_trabajo_id_fkey FOREIGN KEY (lugar_trabajo_id) REFERENCES public.lugares_trabajo(id) ON DELETE RESTRICT;
+
+CREATE TABLE public.items_en_presupuesto_archivo (LIKE public.items_en_presupuesto);
+ALTER TABLE public.items_en_presupuesto_archivo ADD PRIMARY KEY (id);
+ALTER TABLE public.items_en_presupuesto_archivo
+    ADD CONSTRAINT items_en_presupuesto_archivo_presupuesto_id_fkey FOREIGN KEY (presupuesto_id) REFERENCES public.presupuestos_archivo(id) ON DELETE CASCADE,
+    ADD CONSTRAINT items_en_presupuesto_archivo_categoria_id_fkey FOREIGN KEY (categoria_id) REFERENCES public.categorias(id) ON DELETE RESTRICT;
+
+CREATE TABLE public.mano_obra_presupuesto_archivo (LIKE public.mano_obra_presupuesto INCLUDING CONSTRAINTS);
+ALTER TABLE public.mano_obra_presupuesto_archivo ADD PRIMARY KEY (presupuesto_id, categoria_id);
+ALTER TABLE public.mano_obra_presupuesto_archivo
+    ADD CONSTRAINT mano_obra_presupuesto_archivo_presupuesto_id_fkey FOREIGN KEY (presupuesto_id) REFERENCES public.presupuestos_archivo(id) ON DELETE CASCADE,
+    ADD CONSTRAINT mano_obra_presupuesto_archivo_categoria_id_fkey FOREIGN KEY (categoria_id) REFERENCES public.categorias(id);
+
+CREATE TABLE public.presupuesto_versiones_archivo (LIKE public.presupuesto_versiones INCLUDING DEFAULTS);
+ALTER TABLE public.presupuesto_versiones_archivo ADD PRIMARY KEY (presupuesto_id, version);
+ALTER TABLE public.presupuesto_versiones_archivo
+    ADD CONSTRAINT presupuesto_versiones_archivo_presupuesto_id_fkey FOREIGN KEY (presupuesto_id) REFERENCES public.presupuestos_archivo(id) ON DELETE CASCADE;
+
+CREATE INDEX idx_presupuestos_archivo_creado_por_fecha ON public.presupuestos_archivo USING btree (creado_por, fecha_creacion DESC);
+CREATE INDEX idx_presupuestos_archivo_busqueda ON public.presupuestos_archivo USING gin (busqueda);
+CREATE INDEX idx_items_en_presupuesto_archivo_presupuesto ON public.items_en_presupuesto_archivo USING btree (presupuesto_id);
+CREATE INDEX idx_items_en_presupuesto_archivo_busqueda ON public.items_en_presupuesto_archivo USING gin (busqueda);
+
+-- Fecha del presupuesto archivado más reciente: un filtro que empiece después no necesita el archivo
+CREATE TABLE public.archivo_estado (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    hasta timestamp without time zone NOT NULL,
+    actualizado_en timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.presupuestos_archivo ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.items_en_presupuesto_archivo ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.mano_obra_presupuesto_archivo ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.presupuesto_versiones_archivo ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.archivo_estado ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_presupuestos_archivo" ON public.presupuestos_archivo FOR ALL USING (true);
+CREATE POLICY "permitir_todo_items_en_presupuesto_archivo" ON public.items_en_presupuesto_archivo FOR ALL USING (true);
+CREATE POLICY "permitir_todo_mano_obra_presupuesto_archivo" ON public.mano_obra_presupuesto_archivo FOR ALL USING (true);
+CREATE POLICY "permitir_todo_presupuesto_versiones_archivo" ON public.presupuesto_versiones_archivo FOR ALL USING (true);
+CREATE POLICY "permitir_todo_archivo_estado" ON public.archivo_estado FOR ALL USING (true);
+
+-- Archivar no es borrar: la analítica conserva el aporte de los presupuestos que se mueven
+CREATE OR REPLACE FUNCTION public.trg_analitica_items()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_id integer;
+BEGIN
+    IF current_setting('grino.archivando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        FOR v_id IN SELECT DISTINCT presupuesto_id FROM nuevos WHERE presupuesto_id IS NOT NULL LOOP
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR v_id IN SELECT DISTINCT presupuesto_id FROM viejos WHERE presupuesto_id IS NOT NULL LOOP
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    ELSE
+        FOR v_id IN SELECT presupuesto_id FROM nuevos UNION SELECT presupuesto_id FROM viejos LOOP
+            CONTINUE WHEN v_id IS NULL;
+            PERFORM public.refrescar_analitica_presupuesto(v_id);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.trg_analitica_presupuestos()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF current_setting('grino.archivando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.analitica_mensual_presupuestos m
+        SET num_presupuestos = m.num_presupuestos - 1,
+            total = m.total - OLD.total
+        WHERE m.creado_por IS NOT DISTINCT FROM OLD.creado_por
+          AND m.mes = date_trunc('month', OLD.fecha_creacion)::date
+          AND m.cliente_id IS NOT DISTINCT FROM OLD.cliente_id
+          AND m.lugar_trabajo_id IS NOT DISTINCT FROM OLD.lugar_trabajo_id;
+        DELETE FROM public.analitica_mensual_presupuestos WHERE num_presupuestos <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.analitica_mensual_presupuestos AS m (creado_por, mes, cliente_id, lugar_trabajo_id, num_presupuestos, total)
+        VALUES (NEW.creado_por, date_trunc('month', NEW.fecha_creacion)::date, NEW.cliente_id, NEW.lugar_trabajo_id, 1, NEW.total)
+        ON CONFLICT ON CONSTRAINT analitica_mensual_presupuestos_key DO UPDATE
+        SET num_presupuestos = m.num_presupuestos + 1,
+            total = m.total + EXCLUDED.total;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND (NEW.cliente_id, NEW.lugar_trabajo_id, NEW.fecha_creacion, NEW.creado_por)
+            IS DISTINCT FROM (OLD.cliente_id, OLD.lugar_trabajo_id, OLD.fecha_creacion, OLD.creado_por) THEN
+        PERFORM public.refrescar_analitica_presupuesto(NEW.id);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM public.refrescar_analitica_presupuesto(OLD.id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Mueve hasta p_lote presupuestos creados antes de hace p_meses meses (mes completo). Devuelve cuántos
+-- movió; si devuelve p_lote, quedan más. Pensada para correr periódicamente, p. ej. con pg_cron:
+--   SELECT cron.schedule('archivar-presupuestos', '0 4 * * *', 'SELECT public.archivar_presupuestos(24)');
+CREATE OR REPLACE FUNCTION public.archivar_presupuestos(p_meses integer DEFAULT 24, p_lote integer DEFAULT 5000)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_corte timestamp := date_trunc('month', now()::timestamp - make_interval(months => p_meses));
+    v_ids integer[];
+    v_hasta timestamp;
+BEGIN
+    SELECT array_agg(id), max(fecha_creacion) INTO v_ids, v_hasta FROM (
+        SELECT id, fecha_creacion FROM public.presupuestos
+        WHERE fecha_creacion < v_corte
+        ORDER BY fecha_creacion
+        LIMIT p_lote
+        FOR UPDATE
+    ) viejos;
+    IF v_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO public.presupuestos_archivo SELECT * FROM public.presupuestos WHERE id = ANY (v_ids);
+    INSERT INTO public.items_en_presupuesto_archivo SELECT * FROM public.items_en_presupuesto WHERE presupuesto_id = ANY (v_ids);
+    INSERT INTO public.mano_obra_presupuesto_archivo SELECT * FROM public.mano_obra_presupuesto WHERE presupuesto_id = ANY (v_ids);
+    INSERT INTO public.presupuesto_versiones_archivo SELECT * FROM public.presupuesto_versiones WHERE presupuesto_id = ANY (v_ids);
+
+    -- El borrado en cascada no toca la analítica; sí avisa del cambio para que las cachés se refresquen
+    PERFORM set_config('grino.archivando', 'on', true);
+    DELETE FROM public.presupuestos WHERE id = ANY (v_ids);
+    PERFORM set_config('grino.archivando', 'off', true);
+
+    INSERT INTO public.archivo_estado AS e (id, hasta) VALUES (true, v_hasta)
+    ON CONFLICT (id) DO UPDATE SET hasta = greatest(e.hasta, EXCLUDED.hasta), actualizado_en = now();
+
+    RETURN cardinality(v_ids);
+END;
+$$;
+
+-- La fusión de clientes también reasigna los presupuestos archivados
+CREATE OR REPLACE FUNCTION public.fusionar_clientes(p_user_id text, p_destino integer, p_duplicados integer[])
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_movidos integer;
+    v_archivados integer;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.clientes WHERE id = p_destino AND creado_por = p_user_id::integer) THEN
+        RAISE EXCEPTION 'Cliente destino % no encontrado', p_destino;
+    END IF;
+
+    UPDATE public.presupuestos
+    SET cliente_id = p_destino
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+    GET DIAGNOSTICS v_movidos = ROW_COUNT;
+
+    UPDATE public.presupuestos_archivo
+    SET cliente_id = p_destino
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+    GET DIAGNOSTICS v_archivados = ROW_COUNT;
+
+    -- El archivo no tiene triggers de analítica: tras mover los activos, lo que queda de los duplicados
+    -- en los rollups es de presupuestos archivados. Se suma al destino antes de que el DELETE de los
+    -- clientes lo borre en cascada.
+    UPDATE public.analitica_presupuesto
+    SET cliente_id = p_destino
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+
+    INSERT INTO public.analitica_mensual AS m (creado_por, mes, cliente_id, lugar_trabajo_id, categoria_id, materiales, mano_obra, num_items)
+    SELECT creado_por, mes, p_destino, lugar_trabajo_id, categoria_id, sum(materiales), sum(mano_obra), sum(num_items)
+    FROM public.analitica_mensual
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer
+    GROUP BY creado_por, mes, lugar_trabajo_id, categoria_id
+    ON CONFLICT ON CONSTRAINT analitica_mensual_key DO UPDATE
+    SET materiales = m.materiales + EXCLUDED.materiales,
+        mano_obra = m.mano_obra + EXCLUDED.mano_obra,
+        num_items = m.num_items + EXCLUDED.num_items;
+    DELETE FROM public.analitica_mensual
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+
+    INSERT INTO public.analitica_mensual_presupuestos AS m (creado_por, mes, cliente_id, lugar_trabajo_id, num_presupuestos, total)
+    SELECT creado_por, mes, p_destino, lugar_trabajo_id, sum(num_presupuestos), sum(total)
+    FROM public.analitica_mensual_presupuestos
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer
+    GROUP BY creado_por, mes, lugar_trabajo_id
+    ON CONFLICT ON CONSTRAINT analitica_mensual_presupuestos_key DO UPDATE
+    SET num_presupuestos = m.num_presupuestos + EXCLUDED.num_presupuestos,
+        total = m.total + EXCLUDED.total;
+    DELETE FROM public.analitica_mensual_presupuestos
+    WHERE cliente_id = ANY (p_duplicados)
+      AND cliente_id <> p_destino
+      AND creado_por = p_user_id::integer;
+
+    DELETE FROM public.clientes
+    WHERE id = ANY (p_duplicados)
+      AND id <> p_destino
+      AND creado_por = p_user_id::integer;
+
+    RETURN v_movidos + v_archivados;
+END;
+$$;
+
+-- Los agregados por cliente cuentan también los presupuestos archivados: archivar no cambia
+-- el nº de presupuestos ni el total cotizado, y el listado no esconde clientes que no se pueden
+-- borrar (el archivo los referencia con ON DELETE RESTRICT)
+CREATE OR REPLACE FUNCTION public.clientes_detallados(p_user_id text, p_limit integer DEFAULT 48, p_offset integer DEFAULT 0, p_busqueda text DEFAULT NULL)
+RETURNS TABLE (
+    id integer,
+    nombre character varying,
+    alias character varying,
+    fecha_registro timestamp without time zone,
+    num_presupuestos bigint,
+    total_cotizado numeric,
+    ultimo_presupuesto timestamp without time zone,
+    total_clientes bigint
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (
+        SELECT '%' || replace(replace(replace(p_busqueda, '\', '\\'), '%', '\%'), '_', '\_') || '%' AS patron
+    ),
+    todos AS (
+        SELECT p.id, p.cliente_id, p.total, p.fecha_creacion FROM public.presupuestos p
+        WHERE p.creado_por = p_user_id::integer
+        UNION ALL
+        SELECT p.id, p.cliente_id, p.total, p.fecha_creacion FROM public.presupuestos_archivo p
+        WHERE p.creado_por = p_user_id::integer
+    )
+    SELECT c.id, c.nombre, c.alias, c.fecha_registro,
+           count(p.id), coalesce(sum(p.total), 0), max(p.fecha_creacion),
+           count(*) OVER ()
+    FROM public.clientes c
+    CROSS JOIN q
+    LEFT JOIN todos p ON p.cliente_id = c.id
+    WHERE c.creado_por = p_user_id::integer
+      AND (p_busqueda IS NULL
+           OR c.nombre ILIKE q.patron
+           OR c.alias ILIKE q.patron
+           OR p_busqueda <% c.nombre)
+    GROUP BY c.id
+    ORDER BY CASE WHEN p_busqueda IS NULL THEN 0 ELSE word_similarity(p_busqueda, c.nombre) END DESC, c.nombre
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+-- Búsqueda: con p_incluir_archivo también busca en los presupuestos archivados
+DROP FUNCTION IF EXISTS public.buscar_presupuestos(text, text, integer, integer);
+CREATE OR REPLACE FUNCTION public.buscar_presupuestos(p_user_id text, p_query text, p_limit integer DEFAULT 20, p_offset integer DEFAULT 0, p_incluir_archivo boolean DEFAULT false)
+RETURNS TABLE (
+    id integer,
+    fecha_creacion timestamp without time zone,
+    total numeric,
+    descripcion text,
+    cliente text,
+    lugar text,
+    coincidencia text,
+    relevancia real,
+    total_hits bigint,
+    suma_hits numeric,
+    archivado boolean
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (
+        SELECT websearch_to_tsquery('spanish', p_query) AS tsq, '%' || p_query || '%' AS patron
+    ),
+    propios AS (
+        SELECT p.id, p.fecha_creacion, p.total, p.descripcion, p.cliente_id, p.lugar_trabajo_id, p.busqueda, false AS archivado
+        FROM public.presupuestos p WHERE p.creado_por = p_user_id::integer
+        UNION ALL
+        SELECT p.id, p.fecha_creacion, p.total, p.descripcion, p.cliente_id, p.lugar_trabajo_id, p.busqueda, true
+        FROM public.presupuestos_archivo p WHERE p_incluir_archivo AND p.creado_por = p_user_id::integer
+    ),
+    items AS (
+        SELECT i.presupuesto_id, i.nombre_personalizado, i.busqueda FROM public.items_en_presupuesto i
+        UNION ALL
+        SELECT i.presupuesto_id, i.nombre_personalizado, i.busqueda FROM public.items_en_presupuesto_archivo i WHERE p_incluir_archivo
+    ),
+    hits AS (
+        SELECT p.id, ts_rank(p.busqueda, q.tsq) + word_similarity(p_query, p.descripcion) AS score, p.descripcion AS coincidencia
+        FROM propios p, q
+        WHERE p.busqueda @@ q.tsq OR p.descripcion ILIKE q.patron OR p_query <% p.descripcion
+        UNION ALL
+        SELECT i.presupuesto_id, ts_rank(i.busqueda, q.tsq) + word_similarity(p_query, i.nombre_personalizado), i.nombre_personalizado
+        FROM items i JOIN propios p ON p.id = i.presupuesto_id, q
+        WHERE i.busqueda @@ q.tsq OR i.nombre_personalizado ILIKE q.patron OR p_query <% i.nombre_personalizado
+        UNION ALL
+        SELECT p.id, word_similarity(p_query, c.nombre), c.nombre
+        FROM propios p JOIN public.clientes c ON c.id = p.cliente_id, q
+        WHERE c.nombre ILIKE q.patron OR p_query <% c.nombre
+        UNION ALL
+        SELECT p.id, word_similarity(p_query, l.nombre), l.nombre
+        FROM propios p JOIN public.lugares_trabajo l ON l.id = p.lugar_trabajo_id, q
+        WHERE l.nombre ILIKE q.patron OR p_query <% l.nombre
+    ),
+    mejores AS (
+        SELECT DISTINCT ON (h.id) h.id, h.score, h.coincidencia FROM hits h ORDER BY h.id, h.score DESC
+    )
+    SELECT p.id, p.fecha_creacion, p.total, p.descripcion, c.nombre, l.nombre, m.coincidencia, m.score::real,
+           count(*) OVER (), sum(p.total) OVER (), p.archivado
+    FROM mejores m
+    JOIN propios p ON p.id = m.id
+    LEFT JOIN public.clientes c ON c.id = p.cliente_id
+    LEFT JOIN public.lugares_trabajo l ON l.id = p.lugar_trabajo_id
+    ORDER BY m.score DESC, p.fecha_creacion DESC
+    LIMIT p_limit OFFSET p_offset;
+$$;
+
+-- =============================================
+-- RESUMEN DEL HISTORIAL (CONTEO Y SUMA EN LA DB)
+-- =============================================
+-- Las métricas del historial se calculan aquí con los mismos filtros que la página, en vez de
+-- bajar la columna total de cada presupuesto (O(N) y cortada por PostgREST a 1000 filas).
+CREATE OR REPLACE FUNCTION public.resumen_presupuestos(
+    p_user_id text,
+    p_cliente_id integer DEFAULT NULL,
+    p_lugar_trabajo_id integer DEFAULT NULL,
+    p_fecha_inicio timestamp without time zone DEFAULT NULL,
+    p_incluir_archivo boolean DEFAULT false
+)
+RETURNS TABLE (num_presupuestos bigint, suma numeric)
+LANGUAGE sql STABLE
+AS $$
+    WITH propios AS (
+        SELECT p.total FROM public.presupuestos p
+        WHERE p.creado_por = p_user_id::integer
+          AND (p_cliente_id IS NULL OR p.cliente_id = p_cliente_id)
+          AND (p_lugar_trabajo_id IS NULL OR p.lugar_trabajo_id = p_lugar_trabajo_id)
+          AND (p_fecha_inicio IS NULL OR p.fecha_creacion >= p_fecha_inicio)
+        UNION ALL
+        SELECT p.total FROM public.presupuestos_archivo p
+        WHERE p_incluir_archivo
+          AND p.creado_por = p_user_id::integer
+          AND (p_cliente_id IS NULL OR p.cliente_id = p_cliente_id)
+          AND (p_lugar_trabajo_id IS NULL OR p.lugar_trabajo_id = p_lugar_trabajo_id)
+          AND (p_fecha_inicio IS NULL OR p.fecha_creacion >= p_fecha_inicio)
+    )
+    SELECT count(*), coalesce(sum(total), 0) FROM propios;
+$$;
+
+-- =============================================
+-- IMPORTACIÓN MASIVA EN UNA TRANSACCIÓN
+-- =============================================
+-- Categorías y lugares son de cada usuario: el nombre único global hacía que una importación
+-- reutilizara (y enlazara) los de otro usuario en vez de crear los propios.
+ALTER TABLE public.categorias DROP CONSTRAINT categorias_nombre_key;
+ALTER TABLE public.categorias ADD CONSTRAINT categorias_usuario_nombre_key UNIQUE (creado_por, nombre);
+ALTER TABLE public.lugares_trabajo DROP CONSTRAINT lugares_trabajo_nombre_key;
+ALTER TABLE public.lugares_trabajo ADD CONSTRAINT lugares_trabajo_usuario_nombre_key UNIQUE (creado_por, nombre);
+
+-- La misma normalización que clientes.nombre_normalizado y utils.database.normalizar_nombre
+CREATE OR REPLACE FUNCTION public.normalizar_nombre(p_nombre text)
+RETURNS text
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT lower(regexp_replace(btrim(p_nombre), '\s+', ' ', 'g'));
+$$;
+
+-- Una fila por importación hecha: la clave (hash del archivo validado) hace que un reintento o
+-- una segunda subida del mismo archivo devuelva el resultado de la primera en vez de duplicarla
+CREATE TABLE public.importaciones (
+    clave text PRIMARY KEY,
+    creado_por integer,
+    resumen jsonb NOT NULL,
+    creado_en timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE public.importaciones ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "permitir_todo_importaciones" ON public.importaciones FOR ALL USING (true);
+
+-- p_presupuestos: [{ref, cliente, lugar, descripcion, fecha, items: [{categoria, item, unidad, cantidad, precio_unitario, notas}]}]
+-- Todo o nada: catálogos faltantes del usuario, presupuestos e ítems en la misma transacción.
+CREATE OR REPLACE FUNCTION public.importar_presupuestos(p_user_id text, p_clave text, p_presupuestos jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user integer := p_user_id::integer;
+    v_resumen jsonb;
+    v_clientes integer;
+    v_lugares integer;
+    v_categorias integer;
+    v_presupuestos integer;
+    v_items integer;
+BEGIN
+    -- Dos envíos simultáneos de la misma importación: el segundo espera y ve la fila del primero
+    PERFORM pg_advisory_xact_lock(hashtext(p_clave));
+    SELECT resumen INTO v_resumen FROM public.importaciones WHERE clave = p_clave AND creado_por = v_user;
+    IF FOUND THEN
+        RETURN v_resumen || jsonb_build_object('repetida', true);
+    END IF;
+
+    WITH nombres AS (
+        SELECT DISTINCT ON (public.normalizar_nombre(p->>'cliente')) btrim(p->>'cliente') AS nombre
+        FROM jsonb_array_elements(p_presupuestos) p
+        ORDER BY public.normalizar_nombre(p->>'cliente')
+    ), nuevos AS (
+        INSERT INTO public.clientes (nombre, alias, creado_por)
+        SELECT n.nombre, replace(lower(n.nombre), ' ', '-') || '-' || left(md5(random()::text), 8), v_user
+        FROM nombres n
+        ON CONFLICT (creado_por, nombre_normalizado) DO NOTHING
+        RETURNING id
+    )
+    SELECT count(*) INTO v_clientes FROM nuevos;
+
+    WITH nombres AS (
+        SELECT DISTINCT ON (public.normalizar_nombre(p->>'lugar')) btrim(p->>'lugar') AS nombre
+        FROM jsonb_array_elements(p_presupuestos) p
+        ORDER BY public.normalizar_nombre(p->>'lugar')
+    ), nuevos AS (
+        INSERT INTO public.lugares_trabajo (nombre, creado_por)
+        SELECT n.nombre, v_user FROM nombres n
+        WHERE NOT EXISTS (SELECT 1 FROM public.lugares_trabajo l
+                          WHERE l.creado_por = v_user AND public.normalizar_nombre(l.nombre) = public.normalizar_nombre(n.nombre))
+        ON CONFLICT (creado_por, nombre) DO NOTHING
+        RETURNING id
+    )
+    SELECT count(*) INTO v_lugares FROM nuevos;
+
+    WITH nombres AS (
+        SELECT DISTINCT ON (public.normalizar_nombre(i->>'categoria')) btrim(i->>'categoria') AS nombre
+        FROM jsonb_array_elements(p_presupuestos) p, jsonb_array_elements(p->'items') i
+        ORDER BY public.normalizar_nombre(i->>'categoria')
+    ), nuevos AS (
+        INSERT INTO public.categorias (nombre, creado_por)
+        SELECT n.nombre, v_user FROM nombres n
+        WHERE NOT EXISTS (SELECT 1 FROM public.categorias c
+                          WHERE c.creado_por = v_user AND public.normalizar_nombre(c.nombre) = public.normalizar_nombre(n.nombre))
+        ON CONFLICT (creado_por, nombre) DO NOTHING
+        RETURNING id
+    )
+    SELECT count(*) INTO v_categorias FROM nuevos;
+
+    -- Cada presupuesto lleva clave_idempotencia = clave:ref, que sirve también para enlazar sus ítems
+    WITH lugares AS (
+        SELECT DISTINCT ON (public.normalizar_nombre(nombre)) public.normalizar_nombre(nombre) AS normalizado, id
+        FROM public.lugares_trabajo WHERE creado_por = v_user
+        ORDER BY public.normalizar_nombre(nombre), id
+    ), nuevos AS (
+        INSERT INTO public.presupuestos (creado_por, cliente_id, lugar_trabajo_id, descripcion, total, fecha_creacion, clave_idempotencia)
+        SELECT v_user, c.id, l.id, p->>'descripcion',
+               (SELECT coalesce(sum((i->>'cantidad')::integer * (i->>'precio_unitario')::numeric), 0)
+                FROM jsonb_array_elements(p->'items') i),
+               coalesce((p->>'fecha')::timestamp, CURRENT_TIMESTAMP),
+               p_clave || ':' || (p->>'ref')
+        FROM jsonb_array_elements(p_presupuestos) p
+        JOIN public.clientes c ON c.creado_por = v_user AND c.nombre_normalizado = public.normalizar_nombre(p->>'cliente')
+        JOIN lugares l ON l.normalizado = public.normalizar_nombre(p->>'lugar')
+        RETURNING id
+    )
+    SELECT count(*) INTO v_presupuestos FROM nuevos;
+
+    WITH categorias AS (
+        SELECT DISTINCT ON (public.normalizar_nombre(nombre)) public.normalizar_nombre(nombre) AS normalizado, id
+        FROM public.categorias WHERE creado_por = v_user
+        ORDER BY public.normalizar_nombre(nombre), id
+    ), nuevos AS (
+        INSERT INTO public.items_en_presupuesto (presupuesto_id, categoria_id, nombre_personalizado, unidad, cantidad, precio_unitario, notas)
+        SELECT pr.id, cat.id, i->>'item', i->>'unidad', (i->>'cantidad')::integer, (i->>'precio_unitario')::numeric, i->>'notas'
+        FROM jsonb_array_elements(p_presupuestos) p
+        JOIN public.presupuestos pr ON pr.clave_idempotencia = p_clave || ':' || (p->>'ref')
+        CROSS JOIN jsonb_array_elements(p->'items') i
+        JOIN categorias cat ON cat.normalizado = public.normalizar_nombre(i->>'categoria')
+        RETURNING 1
+    )
+    SELECT count(*) INTO v_items FROM nuevos;
+
+    v_resumen := jsonb_build_object(
+        'presupuestos', v_presupuestos,
+        'items', v_items,
+        'clientes_nuevos', v_clientes,
+        'lugares_nuevos', v_lugares,
+        'categorias_nuevas', v_categorias
+    );
+    INSERT INTO public.importaciones (clave, creado_por, resumen) VALUES (p_clave, v_user, v_resumen);
+    RETURN v_resumen || jsonb_build_object('repetida', false);
+END;
+$$;
@@ -0,0 +1,160 @@
+import csv
+import os
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional
+from utils.db import get_supabase_client
+from utils.resiliencia import ejecutar
+
+# ==================== CONFIGURACIÓN ====================
+LOTE_PRESUPUESTOS = 500
+LOTE_ITEMS = 1000
+
+# Tablas activas y de archivo (presupuestos, ítems): la exportación completa recorre ambas
+TABLAS = (
+    ('presupuestos', 'items_en_presupuesto'),
+    ('presupuestos_archivo', 'items_en_presupuesto_archivo'),
+)
+
+COLUMNAS = [
+    'presupuesto_id', 'fecha', 'cliente', 'lugar', 'descripcion', 'total_presupuesto',
+    'item_id', 'categoria', 'item', 'unidad', 'cantidad', 'precio_unitario', 'total_item', 'notas'
+]
+
+FORMATOS = {
+    'CSV': ('csv', 'text/csv'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+# ==================== LECTURA PAGINADA ====================
+def _lotes_presupuestos(user_id: str, tamano: int, tabla: str = 'presupuestos') -> Iterator[List[Dict[str, Any]]]:
+    """Recorre los presupuestos del usuario por id (keyset), un lote por request"""
+    supabase = get_supabase_client()
+    ultimo_id = 0
+    while True:
+        response = ejecutar(supabase.table(tabla).select(
+            "id, fecha_creacion, descripcion, total, cliente:cliente_id(nombre), lugar:lugar_trabajo_id(nombre)"
+        ).eq("creado_por", user_id).gt("id", ultimo_id).order("id").limit(tamano), 'lote')
+        lote = response.data or []
+        if not lote:
+            return
+        yield lote
+        ultimo_id = lote[-1]['id']
+        if len(lote) < tamano:
+            return
+
+def _items_de_lote(presupuesto_ids: List[int], tamano: int, tabla: str = 'items_en_presupuesto') -> Iterator[Dict[str, Any]]:
+    """Ítems de un lote de presupuestos, pedidos por rangos para no cargar todo de una vez"""
+    supabase = get_supabase_client()
+    inicio = 0
+    while True:
+        response = ejecutar(supabase.table(tabla).select(
+            "id, presupuesto_id, nombre_personalizado, unidad, cantidad, precio_unitario, total, notas, categoria:categoria_id(nombre)"
+        ).in_("presupuesto_id", presupuesto_ids).order("presupuesto_id").order("id").range(inicio, inicio + tamano - 1), 'lote')
+        lote = response.data or []
+        yield from lote
+        if len(lote) < tamano:
+            return
+        inicio += tamano
+
+def iter_filas_exportacion(user_id: str, lote_presupuestos: int = LOTE_PRESUPUESTOS, lote_items: int = LOTE_ITEMS) -> Iterator[Dict[str, Any]]:
+    """Genera una fila por ítem (o una fila vacía si el presupuesto no tiene ítems), incluidos los archivados"""
+    for tabla, tabla_items in TABLAS:
+        for presupuestos in _lotes_presupuestos(user_id, lote_presupuestos, tabla):
+            por_id = {p['id']: p for p in presupuestos}
+            con_items = set()
+            for item in _items_de_lote(list(por_id), lote_items, tabla_items):
+                con_items.add(item['presupuesto_id'])
+                yield _fila(por_id[item['presupuesto_id']], item)
+            for p in presupuestos:
+                if p['id'] not in con_items:
+                    yield _fila(p, None)
+
+def _fila(p: Dict[str, Any], item: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    item = item or {}
+    return {
+        'presupuesto_id': p['id'],
+        'fecha': str(p.get('fecha_creacion') or '')[:19],
+        'cliente': (p.get('cliente') or {}).get('nombre'),
+        'lugar': (p.get('lugar') or {}).get('nombre'),
+        'descripcion': p.get('descripcion'),
+        'total_presupuesto': float(p.get('total') or 0),
+        'item_id': item.get('id'),
+        'categoria': (item.get('categoria') or {}).get('nombre'),
+        'item': item.get('nombre_personalizado'),
+        'unidad': item.get('unidad'),
+        'cantidad': float(item['cantidad']) if item.get('cantidad') is not None else None,
+        'precio_unitario': float(item['precio_unitario']) if item.get('precio_unitario') is not None else None,
+        'total_item': float(item['total']) if item.get('total') is not None else None,
+        'notas': item.get('notas'),
+    }
+
+# ==================== ESCRITORES INCREMENTALES ====================
+def _en_bloques(filas: Iterator[Dict[str, Any]], tamano: int) -> Iterator[List[Dict[str, Any]]]:
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+def escribir_csv(filas: Iterator[Dict[str, Any]], destino) -> int:
+    writer = csv.DictWriter(destino, fieldnames=COLUMNAS)
+    writer.writeheader()
+    n = 0
+    for fila in filas:
+        writer.writerow(fila)
+        n += 1
+    return n
+
+def escribir_xlsx(filas: Iterator[Dict[str, Any]], destino) -> int:
+    # Modo write_only: openpyxl vuelca las filas sin mantener la hoja en memoria
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Historial")
+    ws.append(COLUMNAS)
+    n = 0
+    for fila in filas:
+        ws.append([fila[c] for c in COLUMNAS])
+        n += 1
+    wb.save(destino)
+    return n
+
+def escribir_parquet(filas: Iterator[Dict[str, Any]], destino, tamano_bloque: int = 10000) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ('presupuesto_id', pa.int64()), ('fecha', pa.string()), ('cliente', pa.string()), ('lugar', pa.string()),
+        ('descripcion', pa.string()), ('total_presupuesto', pa.float64()), ('item_id', pa.int64()),
+        ('categoria', pa.string()), ('item', pa.string()), ('unidad', pa.string()), ('cantidad', pa.float64()),
+        ('precio_unitario', pa.float64()), ('total_item', pa.float64()), ('notas', pa.string()),
+    ])
+    n = 0
+    with pq.ParquetWriter(destino, schema) as writer:
+        for bloque in _en_bloques(filas, tamano_bloque):
+            writer.write_table(pa.Table.from_pylist(bloque, schema=schema))
+            n += len(bloque)
+    return n
+
+def exportar_historial(user_id: str, formato: str):
+    """Escribe el historial completo en un archivo temporal y lo devuelve abierto para lectura.
+    La memoria queda acotada al tamaño de lote, no al total de ítems."""
+    extension, _ = FORMATOS[formato]
+    fd, ruta = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+    filas = iter_filas_exportacion(user_id)
+    try:
+        if formato == 'CSV':
+            with open(ruta, "w", newline="", encoding="utf-8-sig") as f:
+                escribir_csv(filas, f)
+        elif formato == 'XLSX':
+            escribir_xlsx(filas, ruta)
+        else:
+            escribir_parquet(filas, ruta)
+        archivo = open(ruta, "rb")
+    finally:
+        # El archivo abierto sigue siendo legible; así no quedan temporales huérfanos
+        os.unlink(ruta)
+    return archivo
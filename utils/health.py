@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import streamlit as st
+from supabase import Client
+
+from utils.db import get_cliente_compartido
+
+# ==================== CONFIGURACIÓN ====================
+# Tabla real y liviana usada como sonda (solo se pide 1 id)
+TABLA_SONDA = "categorias"
+INTERVALO_SEGUNDOS = 30.0
+VENTANA_MUESTRAS = 120
+# Límites superiores (ms) de cada balde del histograma; el último es "más lento"
+BALDES_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+
+# ==================== MONITOR EN SEGUNDO PLANO ====================
+class HealthMonitor:
+    """Sondea Supabase periódicamente en un hilo y guarda el último estado y latencias."""
+
+    def __init__(self, supabase_client: Client, intervalo: float = INTERVALO_SEGUNDOS, ventana: int = VENTANA_MUESTRAS):
+        self._client = supabase_client
+        self._intervalo = intervalo
+        self._lock = threading.Lock()
+        self._latencias: Deque[float] = deque(maxlen=ventana)
+        self._ok: Optional[bool] = None
+        self._ultimo_error: Optional[str] = None
+        self._ultima_sonda: Optional[datetime] = None
+        self._sondas = 0
+        self._fallos = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="grino-health", daemon=True)
+
+    def start(self) -> "HealthMonitor":
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def probe(self) -> bool:
+        """Ejecuta una sonda y registra su resultado"""
+        inicio = time.perf_counter()
+        error = None
+        try:
+            response = self._client.table(TABLA_SONDA).select("id").limit(1).execute()
+            ok = response is not None and response.data is not None
+            if not ok:
+                error = "Respuesta de la API no válida"
+        except Exception as e:
+            ok = False
+            error = str(e)
+        latencia_ms = (time.perf_counter() - inicio) * 1000
+
+        with self._lock:
+            self._sondas += 1
+            self._ok = ok
+            self._ultima_sonda = datetime.now()
+            self._ultimo_error = error
+            if ok:
+                self._latencias.append(latencia_ms)
+            else:
+                self._fallos += 1
+        return ok
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.probe()
+            self._stop.wait(self._intervalo)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Devuelve el último estado cacheado sin tocar la red"""
+        with self._lock:
+            latencias = list(self._latencias)
+            estado = {
+                "ok": self._ok,
+                "ultima_sonda": self._ultima_sonda.isoformat() if self._ultima_sonda else None,
+                "ultimo_error": self._ultimo_error,
+                "sondas": self._sondas,
+                "fallos": self._fallos,
+            }
+        estado["latencia_ms"] = _resumen_latencias(latencias)
+        estado["histograma_ms"] = _histograma(latencias)
+        return estado
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+def _resumen_latencias(latencias: List[float]) -> Dict[str, Optional[float]]:
+    if not latencias:
+        return {"ultima": None, "p50": None, "p95": None, "max": None}
+    return {
+        "ultima": round(latencias[-1], 1),
+        "p50": round(_percentil(latencias, 50), 1),
+        "p95": round(_percentil(latencias, 95), 1),
+        "max": round(max(latencias), 1),
+    }
+
+def _histograma(latencias: List[float]) -> Dict[str, int]:
+    etiquetas = [f"<={b}" for b in BALDES_MS] + [f">{BALDES_MS[-1]}"]
+    conteo = dict.fromkeys(etiquetas, 0)
+    for valor in latencias:
+        idx = next((i for i, b in enumerate(BALDES_MS) if valor <= b), len(BALDES_MS))
+        conteo[etiquetas[idx]] += 1
+    return conteo
+
+
+# ==================== ACCESO GLOBAL ====================
+@st.cache_resource
+def get_health_monitor() -> HealthMonitor:
+    """Instancia única por proceso; arranca el hilo la primera vez que se pide."""
+    return HealthMonitor(get_cliente_compartido()).start()
+
+def get_health_snapshot() -> Dict[str, Any]:
+    """Estado de salud cacheado, listo para la barra lateral o la página de operaciones"""
+    return get_health_monitor().snapshot()
+
+def show_health_sidebar() -> None:
+    """Muestra el estado de conexión en la barra lateral leyendo solo la caché"""
+    estado = get_health_snapshot()
+    latencia = estado["latencia_ms"]["ultima"]
+    if estado["ok"] is None:
+        st.info("⏳ Verificando conexión a Supabase...")
+    elif estado["ok"]:
+        st.success(f"✅ Conexión a Supabase OK ({latencia:.0f} ms)" if latencia is not None else "✅ Conexión a Supabase OK")
+    else:
+        st.warning("⚠️ Error en la conexión a Supabase.")
+        if estado["ultimo_error"]:
+            st.caption(estado["ultimo_error"])
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Tuple
+import pandas as pd
+from utils.cambios import publicar_local
+from utils.db import get_supabase_client
+from utils.database import normalizar_nombre
+from utils.resiliencia import ejecutar, ejecutar_paginado
+
+# ==================== CONFIGURACIÓN ====================
+COLUMNAS_REQUERIDAS = ['presupuesto', 'cliente', 'lugar', 'categoria', 'item', 'cantidad', 'precio_unitario']
+COLUMNAS_OPCIONALES = {'fecha': None, 'descripcion': '', 'unidad': 'Unidad', 'notas': ''}
+
+# ==================== LECTURA Y VALIDACIÓN ====================
+def leer_archivo(archivo, nombre: str) -> pd.DataFrame:
+    """Lee un CSV o XLSX y normaliza los encabezados (minúsculas, sin espacios extra)"""
+    if nombre.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(archivo, dtype=str)
+    else:
+        df = pd.read_csv(archivo, dtype=str, sep=None, engine='python')
+    df.columns = [str(c).strip().lower().replace(' ', '_') for c in df.columns]
+    return df
+
+def _a_numero(serie: pd.Series) -> pd.Series:
+    """Convierte montos como '$5.489', '5489.00' o '12,5' a número (NaN si no se puede)"""
+    texto = serie.fillna('').astype(str).str.replace(r'[$\s]', '', regex=True)
+    miles = texto.str.fullmatch(r'\d{1,3}(\.\d{3})+')
+    texto = texto.where(~miles, texto.str.replace('.', '', regex=False))
+    return pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce')
+
+def validar(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+    """Valida y limpia el archivo. Devuelve (filas válidas, errores legibles por fila)"""
+    faltantes = [c for c in COLUMNAS_REQUERIDAS if c not in df.columns]
+    if faltantes:
+        return df.iloc[0:0], [f"Faltan columnas obligatorias: {', '.join(faltantes)}"]
+
+    df = df.copy()
+    for col, defecto in COLUMNAS_OPCIONALES.items():
+        if col not in df.columns:
+            df[col] = defecto
+    for col in ['presupuesto', 'cliente', 'lugar', 'categoria', 'item', 'unidad', 'descripcion', 'notas']:
+        df[col] = df[col].fillna('').astype(str).str.strip()
+    df['unidad'] = df['unidad'].replace('', 'Unidad')
+    df['cantidad'] = _a_numero(df['cantidad'])
+    df['precio_unitario'] = _a_numero(df['precio_unitario'])
+    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce', dayfirst=True)
+
+    errores = []
+    invalido = pd.Series(False, index=df.index)
+    for col in ['presupuesto', 'cliente', 'lugar', 'categoria', 'item']:
+        vacio = df[col] == ''
+        invalido |= vacio
+        errores += [f"Fila {i + 2}: '{col}' vacío" for i in df.index[vacio]]
+    for col in ['cantidad', 'precio_unitario']:
+        malo = df[col].isna() | (df[col] < 0)
+        invalido |= malo
+        errores += [f"Fila {i + 2}: '{col}' no es un número válido" for i in df.index[malo]]
+    # La columna cantidad es entera: redondear cambiaría los totales sin avisar
+    fraccion = ~df['cantidad'].isna() & (df['cantidad'] % 1 != 0)
+    invalido |= fraccion
+    errores += [f"Fila {i + 2}: 'cantidad' debe ser un número entero ({df.at[i, 'cantidad']:g})" for i in df.index[fraccion]]
+
+    # Todas las filas de un presupuesto tienen que describir la misma cabecera
+    cabecera = pd.DataFrame({
+        'cliente': df['cliente'].map(normalizar_nombre),
+        'lugar': df['lugar'].map(normalizar_nombre),
+        'descripcion': df['descripcion'],
+        'fecha': df['fecha'],
+    })
+    distintas = cabecera.groupby(df['presupuesto']).nunique(dropna=False)
+    for ref, fila in distintas.iterrows():
+        columnas = [c for c in cabecera.columns if fila[c] > 1]
+        if ref == '' or not columnas:
+            continue
+        del_presupuesto = df['presupuesto'] == ref
+        invalido |= del_presupuesto
+        errores.append(f"Presupuesto '{ref}': sus filas no coinciden en {', '.join(columnas)} "
+                       f"(filas {', '.join(str(i + 2) for i in df.index[del_presupuesto])})")
+
+    validas = df[~invalido].copy()
+    validas['cantidad'] = validas['cantidad'].astype(int)
+    return validas, errores
+
+# ==================== CATÁLOGOS ====================
+def _contar_nuevos(supabase, tabla: str, nombres: List[str], user_id: str) -> int:
+    """Cuántos nombres no existen todavía entre los del usuario (misma normalización que la RPC)"""
+    existentes = {normalizar_nombre(d['nombre']) for d in ejecutar_paginado(
+        lambda: supabase.table(tabla).select("id, nombre").eq("creado_por", user_id).order("id")
+    )}
+    return len({normalizar_nombre(n) for n in nombres} - existentes)
+
+# ==================== IMPORTACIÓN ====================
+def _presupuestos_a_importar(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Un presupuesto por valor de la columna 'presupuesto', con sus ítems, listo para la RPC
+    (validar() ya descartó los presupuestos cuyas filas no coinciden en la cabecera)"""
+    presupuestos = []
+    for ref, g in df.groupby('presupuesto', sort=False):
+        primera = g.iloc[0]
+        presupuestos.append({
+            "ref": str(ref),
+            "cliente": primera['cliente'],
+            "lugar": primera['lugar'],
+            "descripcion": primera['descripcion'],
+            "fecha": primera['fecha'].isoformat() if pd.notna(primera['fecha']) else None,
+            "items": [{
+                "categoria": r.categoria,
+                "item": r.item,
+                "unidad": r.unidad,
+                "cantidad": int(r.cantidad),
+                "precio_unitario": float(r.precio_unitario),
+                "notas": r.notas,
+            } for r in g.itertuples(index=False)],
+        })
+    return presupuestos
+
+def clave_importacion(user_id: str, presupuestos: List[Dict[str, Any]]) -> str:
+    """Misma clave para el mismo contenido: reintentar o volver a subir el archivo no lo duplica"""
+    contenido = json.dumps([str(user_id), presupuestos], sort_keys=True, ensure_ascii=False)
+    return f"importacion-{hashlib.sha256(contenido.encode('utf-8')).hexdigest()}"
+
+def importar(df: pd.DataFrame, user_id: str, dry_run: bool = True) -> Dict[str, Any]:
+    """Importa presupuestos e ítems ya validados en una sola transacción (RPC importar_presupuestos).
+    Con dry_run solo cuenta lo que se crearía."""
+    supabase = get_supabase_client()
+    tiempos = {}
+    inicio = time.perf_counter()
+    presupuestos = _presupuestos_a_importar(df)
+
+    if dry_run:
+        t = time.perf_counter()
+        reporte = {
+            'dry_run': True,
+            'repetida': False,
+            'presupuestos': len(presupuestos),
+            'items': len(df),
+            'clientes_nuevos': _contar_nuevos(supabase, "clientes", df['cliente'].unique().tolist(), user_id),
+            'lugares_nuevos': _contar_nuevos(supabase, "lugares_trabajo", df['lugar'].unique().tolist(), user_id),
+            'categorias_nuevas': _contar_nuevos(supabase, "categorias", df['categoria'].unique().tolist(), user_id),
+        }
+        tiempos['entidades'] = time.perf_counter() - t
+    else:
+        # Todo o nada: si falla no quedan presupuestos sin ítems, y el reintento con la misma
+        # clave devuelve el resultado de la importación ya hecha en vez de duplicarla
+        t = time.perf_counter()
+        clave = clave_importacion(user_id, presupuestos)
+        resumen = ejecutar(supabase.rpc("importar_presupuestos", {
+            "p_user_id": str(user_id),
+            "p_clave": clave,
+            "p_presupuestos": presupuestos
+        }), 'lote', clave).data
+        tiempos['importacion'] = time.perf_counter() - t
+        reporte = {'dry_run': False, **resumen}
+        if not resumen.get('repetida'):
+            for tabla in ('clientes', 'lugares_trabajo', 'categorias', 'presupuestos'):
+                publicar_local(tabla, user_id)
+
+    segundos = time.perf_counter() - inicio
+    reporte['segundos'] = segundos
+    reporte['tiempos'] = tiempos
+    reporte['filas_por_segundo'] = len(df) / segundos if segundos else 0.0
+    return reporte
@@ -2,8 +2,9 @@ import tempfile
 import os
 import base64
 from datetime import datetime
-from fpdf import FPDF
-from utils.database import save_presupuesto_completo, get_presupuesto_detallado
+from utils.database import save_presupuesto_completo
+from utils.cache import get_detalle_cacheado
+from utils.perfil import perfilado
 
 # ==================== UTILIDADES ====================
 def capitalizar(texto: str) -> str:
@@ -28,7 +29,19 @@ CONTACTO_TELEFONO = "+569 6904 2513"
 CONTACTO_EMAIL = "jhonnynicolasalvarez@gmail.com"
 
 # ==================== GENERAR PDF ====================
+def precalentar_pdf() -> None:
+    """Importa fpdf2 y genera un PDF mínimo en memoria: el primer PDF real ya no paga la
+    importación ni la carga de la fuente"""
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=11)
+    pdf.cell(0, 6, "GRINO")
+    pdf.output()
+
+@perfilado("pdf.generar_pdf", bytes_de=os.path.getsize)
 def generar_pdf(cliente_nombre, categorias, lugar_cliente, descripcion=""):
+    from fpdf import FPDF  # fpdf2 se carga con el primer PDF, no al abrir la página
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=11)
@@ -131,43 +144,32 @@ def guardar_presupuesto_completo(presupuesto_id: int, categorias: dict, cliente_
 
 # ==================== DESCARGA PRESUPUESTO ====================
 def mostrar_boton_descarga_pdf(presupuesto_id: int):
-    """Muestra el botón para descargar un presupuesto existente"""
-    presupuesto = get_presupuesto_detallado(presupuesto_id)
+    """Genera el PDF de un presupuesto existente; devuelve (bytes, nombre de archivo, éxito)"""
+    presupuesto = get_detalle_cacheado(presupuesto_id)
     if not presupuesto:
-        return "Presupuesto no encontrado", False
+        return None, None, False
     
-    categorias = {}
-    for item in presupuesto['items']:
-        cat_nombre = item.get('categoria') or 'Sin categoría'
-        if cat_nombre not in categorias:
-            categorias[cat_nombre] = {'items': [], 'mano_obra': 0}
-        
-        if item['nombre'].lower() == 'mano de obra':
-            categorias[cat_nombre]['mano_obra'] = safe_float(item['precio_unitario'])
-        else:
-            categorias[cat_nombre]['items'].append({
-                'nombre': item['nombre'],
-                'unidad': item['unidad'],
-                'cantidad': safe_float(item['cantidad']),
-                'precio_unitario': safe_float(item['precio_unitario']),
-                'total': safe_float(item['total'])
-            })
+    # El detalle cacheado ya viene agrupado por categoría y con la mano de obra separada
+    categorias = {
+        cat: {'items': data['items'].to_dict('records'), 'mano_obra': data['mano_obra']}
+        for cat, data in presupuesto['categorias'].items()
+    }
     
-    pdf = generar_pdf(
-        presupuesto['cliente']['nombre'],
+    lugar_nombre = presupuesto['lugar'].get('nombre', '')
+    pdf_path = generar_pdf(
+        presupuesto['cliente'].get('nombre', ''),
         categorias,
-        presupuesto['lugar']['nombre']
+        lugar_nombre,
+        descripcion=presupuesto.get('descripcion', '')
     )
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmpfile:
-        pdf.output(tmpfile.name)
-        tmpfile.seek(0)
-        pdf_bytes = tmpfile.read()
-    
-    b64 = base64.b64encode(pdf_bytes).decode()
-    href = f'<a href="data:application/octet-stream;base64,{b64}" download="presupuesto_{presupuesto_id}.pdf">⬇️ Descargar PDF</a>'
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+    os.unlink(pdf_path)
     
-    return href, True
+    lugar_nombre_limpio = lugar_nombre.strip().replace(" ", "_").replace("/", "_")
+    file_name = f"Presupuesto_{lugar_nombre_limpio}_{presupuesto_id}.pdf"
+    return pdf_bytes, file_name, True
 
 # ==================== OBTENER PDF EN BYTES ====================
 def get_pdf_bytes(presupuesto_id: int) -> bytes:
@@ -0,0 +1,222 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# ==================== CONFIGURACIÓN ====================
+# Apagado por defecto: se activa con GRINO_PERFIL=1 o con [perfil] activo = true en secrets.toml.
+# Cada span (nombre, duración, filas, bytes) se agrupa por rerun, se muestra en la barra lateral
+# y se agrega como una línea JSON a un log rotativo para analizarlo después.
+PERFIL_KEY = 'perfil_rerun'
+LOG_PERFIL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "perfil", "spans.jsonl")
+MAX_MB_LOG = 5
+RESPALDOS_LOG = 5
+
+@functools.lru_cache(maxsize=1)
+def _config() -> Dict[str, Any]:
+    try:
+        config = dict(st.secrets.get("perfil", {}))
+    except Exception:
+        config = {}
+    if os.environ.get("GRINO_PERFIL") == "1":
+        config["activo"] = True
+    return config
+
+def perfil_activo() -> bool:
+    """True si el perfilador está encendido para este proceso"""
+    return bool(_config().get("activo", False))
+
+# ==================== LOG ROTATIVO ====================
+# Se usa el handler directamente (sin pasar por un logger) para que la configuración de logging
+# de la app o de Streamlit no silencie ni duplique los spans
+_lock_log = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _handler_log() -> RotatingFileHandler:
+    config = _config()
+    ruta = config.get("log", LOG_PERFIL)
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    return RotatingFileHandler(
+        ruta,
+        maxBytes=int(float(config.get("max_mb", MAX_MB_LOG)) * 1024 * 1024),
+        backupCount=int(config.get("respaldos", RESPALDOS_LOG)),
+        encoding="utf-8",
+    )
+
+def _escribir(span: Dict[str, Any]) -> None:
+    try:
+        with _lock_log:
+            handler = _handler_log()
+        handler.handle(logging.makeLogRecord({'msg': json.dumps(span, ensure_ascii=False, default=str)}))
+    except Exception as e:
+        print(f"Error al escribir el log de perfil: {e}")
+
+# ==================== SPANS ====================
+# Pila de spans abiertos por hilo: da el nivel de anidamiento (una sección que llama a la DB)
+_pila = threading.local()
+
+def _rerun_actual() -> Optional[Dict[str, Any]]:
+    """Registro del rerun en curso de esta sesión (None en hilos sin contexto de Streamlit)"""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    rerun = st.session_state.get(PERFIL_KEY)
+    return rerun if rerun and rerun.get('abierto') else None
+
+def contar_filas(resultado: Any) -> Optional[int]:
+    """Filas de un resultado típico de utils/database.py: lista, (filas, total, ...) o detalle"""
+    if isinstance(resultado, list):
+        return len(resultado)
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], list):
+        return len(resultado[0])
+    if isinstance(resultado, dict) and isinstance(resultado.get('items'), list):
+        return len(resultado['items'])
+    return None
+
+def contar_bytes(resultado: Any) -> Optional[int]:
+    """Tamaño aproximado del payload: bytes tal cual, el resto serializado como JSON"""
+    if resultado is None:
+        return None
+    if isinstance(resultado, (bytes, bytearray)):
+        return len(resultado)
+    try:
+        return len(json.dumps(resultado, ensure_ascii=False, default=str).encode("utf-8"))
+    except Exception:
+        return None
+
+def registrar_span(nombre: str, ms: float, filas: Optional[int] = None, bytes_: Optional[int] = None,
+                   error: Optional[str] = None, nivel: int = 0, padre: Optional[str] = None) -> Dict[str, Any]:
+    """Agrega un span al rerun en curso (si lo hay) y lo escribe en el log"""
+    rerun = _rerun_actual()
+    span = {
+        'ts': time.time(),
+        'rerun': rerun['id'] if rerun else None,
+        'pagina': rerun['pagina'] if rerun else None,
+        'nombre': nombre,
+        'ms': round(ms, 2),
+        'filas': filas,
+        'bytes': bytes_,
+        'nivel': nivel,
+        'padre': padre,
+        'hilo': threading.current_thread().name,
+        'error': error,
+    }
+    if rerun is not None:
+        rerun['spans'].append(span)
+    _escribir(span)
+    return span
+
+@contextmanager
+def medir(nombre: str) -> Iterator[Dict[str, Any]]:
+    """Mide un bloque; quien lo usa puede completar 'filas' y 'bytes' en el dict que recibe"""
+    if not perfil_activo():
+        yield {}
+        return
+    datos: Dict[str, Any] = {'filas': None, 'bytes': None}
+    pila = getattr(_pila, 'spans', None)
+    if pila is None:
+        pila = _pila.spans = []
+    nivel = len(pila)
+    padre = pila[-1] if pila else None
+    pila.append(nombre)
+    inicio = time.perf_counter()
+    error = None
+    try:
+        yield datos
+    except BaseException as e:
+        # st.rerun()/st.stop() también pasan por aquí: quedan registrados con el nombre de la excepción
+        error = type(e).__name__
+        raise
+    finally:
+        pila.pop()
+        registrar_span(nombre, (time.perf_counter() - inicio) * 1000, datos['filas'], datos['bytes'], error, nivel, padre)
+
+def perfilado(nombre: Optional[str] = None, datos: bool = True,
+              bytes_de: Optional[Callable[[Any], Optional[int]]] = None) -> Callable[[Callable], Callable]:
+    """Decorador: cada llamada queda como span. Con datos=True se cuentan filas y bytes del resultado
+    (bytes_de reemplaza la medida por defecto, p. ej. el tamaño del archivo si devuelve una ruta)."""
+    def decorador(funcion: Callable) -> Callable:
+        etiqueta = nombre or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not perfil_activo():
+                return funcion(*args, **kwargs)
+            with medir(etiqueta) as span:
+                resultado = funcion(*args, **kwargs)
+                if datos:
+                    span['filas'] = contar_filas(resultado)
+                    span['bytes'] = (bytes_de or contar_bytes)(resultado)
+                return resultado
+        return envoltura
+    return decorador
+
+def instrumentar(espacio: Dict[str, Any], prefijo: str, excluir: Iterable[str] = ()) -> None:
+    """Envuelve con @perfilado todas las funciones públicas definidas en un módulo (se llama
+    al final de sus definiciones, con globals()). Quien importe después recibe la versión medida."""
+    modulo = espacio['__name__']
+    excluir = set(excluir)
+    for nombre, valor in list(espacio.items()):
+        if (nombre.startswith('_') or nombre in excluir or not callable(valor) or isinstance(valor, type)
+                or getattr(valor, '__module__', None) != modulo):
+            continue
+        espacio[nombre] = perfilado(f"{prefijo}.{nombre}")(valor)
+
+# ==================== RERUN Y PANEL ====================
+@contextmanager
+def perfil_rerun(pagina: str) -> Iterator[None]:
+    """Agrupa los spans de un rerun de la página y al terminar los muestra en la barra lateral"""
+    if not perfil_activo():
+        yield
+        return
+    rerun = {'id': uuid.uuid4().hex[:12], 'pagina': pagina, 'abierto': True, 'spans': []}
+    st.session_state[PERFIL_KEY] = rerun
+    panel = st.sidebar.empty()
+    try:
+        with medir(f"pagina.{pagina}"):
+            yield
+    finally:
+        # Tras st.stop()/st.rerun() Streamlit ya no acepta elementos: esos reruns quedan solo en el log
+        rerun['abierto'] = False
+        _mostrar_panel(panel, rerun)
+
+def resumen_rerun(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totales de un rerun: tiempo de página, tiempo y filas/bytes en la DB, y span más lento"""
+    pagina = [s for s in spans if s['nombre'].startswith('pagina.')]
+    # Solo las llamadas a la DB hechas desde fuera de utils/database.py (las internas ya están dentro)
+    db = [s for s in spans if s['nombre'].startswith('db.') and not (s['padre'] or '').startswith('db.')]
+    internos = [s for s in spans if not s['nombre'].startswith('pagina.')]
+    return {
+        'total_ms': pagina[-1]['ms'] if pagina else sum(s['ms'] for s in spans if s['nivel'] == 0),
+        'db_ms': sum(s['ms'] for s in db),
+        'db_llamadas': len(db),
+        'filas': sum(s['filas'] or 0 for s in db),
+        'bytes': sum(s['bytes'] or 0 for s in db),
+        'mas_lento': max(internos, key=lambda s: s['ms'])['nombre'] if internos else None,
+    }
+
+def _mostrar_panel(panel, rerun: Dict[str, Any]) -> None:
+    spans = rerun['spans']
+    resumen = resumen_rerun(spans)
+    with panel.container():
+        with st.expander(f"⏱️ Perfil · {resumen['total_ms']:.0f} ms", expanded=False):
+            st.caption(f"Rerun `{rerun['id']}` · DB: {resumen['db_llamadas']} llamadas, {resumen['db_ms']:.0f} ms, "
+                       f"{resumen['filas']} filas, {resumen['bytes'] / 1024:.1f} KB")
+            if resumen['mas_lento']:
+                st.caption(f"Más lento: `{resumen['mas_lento']}`")
+            # Orden de cierre → orden de inicio aproximado, con sangría por nivel
+            filas = [{
+                'span': "· " * s['nivel'] + s['nombre'],
+                'ms': s['ms'],
+                'filas': s['filas'],
+                'KB': round(s['bytes'] / 1024, 1) if s['bytes'] is not None else None,
+                'error': s['error'],
+            } for s in sorted(spans, key=lambda s: s['ts'] - s['ms'] / 1000)]
+            st.dataframe(filas, hide_index=True, width='stretch')
@@ -0,0 +1,652 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import streamlit as st
+from utils.cambios import publicar_local
+from utils.db import con_cliente_actual, get_supabase_client
+from utils.resiliencia import ServicioNoDisponible, ejecutar, ejecutar_paginado, es_transitorio, llamar
+
+# ==================== CONFIGURACIÓN ====================
+RUTA_REPLICA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "replica.sqlite3")
+INTERVALO_SYNC_SEG = 60
+LOTE_IDS = 200
+# Lo que guarda el servidor en filas_borradas (db_schema.sql): una réplica sin sincronizar por
+# más tiempo puede haberse perdido borrados y se recarga entera
+RETENCION_LAPIDAS_DIAS = 90
+# actualizado_en y borrado_en son de cuando se escribió la fila, no de cuando se confirmó: una
+# transacción larga (p. ej. importar_presupuestos) confirma filas con marcas anteriores a lo que
+# ya se trajo. Cada pull vuelve a pedir este margen hacia atrás (traerlas de nuevo no hace daño).
+MARGEN_PULL_SEG = 600
+
+TABLAS_CATALOGO = ('clientes', 'lugares_trabajo', 'categorias')
+TABLA_POR_OPERACION = {
+    'crear_cliente': 'clientes',
+    'crear_lugar_trabajo': 'lugares_trabajo',
+    'crear_categoria': 'categorias',
+    'renombrar_cliente': 'clientes',
+    'eliminar_cliente': 'clientes',
+    'eliminar_presupuesto': 'presupuestos',
+}
+COLUMNAS_PRESUPUESTO = "id, creado_por, cliente_id, lugar_trabajo_id, fecha_creacion, descripcion, total, actualizado_en"
+COLUMNAS_ITEM = "id, presupuesto_id, categoria_id, nombre_personalizado, unidad, cantidad, precio_unitario, total, notas"
+COLUMNAS_MANO_OBRA = "presupuesto_id, categoria_id, monto"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS clientes (
+    id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, creado_por TEXT NOT NULL, actualizado_en TEXT
+);
+CREATE TABLE IF NOT EXISTS lugares_trabajo (
+    id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, creado_por TEXT NOT NULL, actualizado_en TEXT
+);
+CREATE TABLE IF NOT EXISTS categorias (
+    id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, creado_por TEXT NOT NULL, actualizado_en TEXT
+);
+CREATE TABLE IF NOT EXISTS presupuestos (
+    id INTEGER PRIMARY KEY, creado_por TEXT NOT NULL, cliente_id INTEGER, lugar_trabajo_id INTEGER,
+    fecha_creacion TEXT, descripcion TEXT, total REAL, actualizado_en TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_presupuestos_usuario_fecha ON presupuestos (creado_por, fecha_creacion DESC);
+CREATE TABLE IF NOT EXISTS items_en_presupuesto (
+    id INTEGER PRIMARY KEY, presupuesto_id INTEGER NOT NULL, categoria_id INTEGER, nombre_personalizado TEXT,
+    unidad TEXT, cantidad REAL, precio_unitario REAL, total REAL, notas TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_items_presupuesto ON items_en_presupuesto (presupuesto_id);
+CREATE TABLE IF NOT EXISTS mano_obra_presupuesto (
+    presupuesto_id INTEGER NOT NULL, categoria_id INTEGER NOT NULL, monto REAL NOT NULL,
+    PRIMARY KEY (presupuesto_id, categoria_id)
+);
+-- Escrituras hechas sin conexión, en orden, pendientes de enviar a Supabase
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, creado_por TEXT NOT NULL, operacion TEXT NOT NULL, datos TEXT NOT NULL,
+    clave TEXT NOT NULL, estado TEXT NOT NULL DEFAULT 'pendiente', intentos INTEGER NOT NULL DEFAULT 0,
+    error TEXT, creado_en REAL NOT NULL
+);
+-- Ids negativos (locales) ya confirmados por el servidor
+CREATE TABLE IF NOT EXISTS mapa_ids (
+    tabla TEXT NOT NULL, id_local INTEGER NOT NULL, id_remoto INTEGER NOT NULL, PRIMARY KEY (tabla, id_local)
+);
+-- Último id local entregado por tabla: los ids temporales nunca se repiten (un id reutilizado
+-- heredaría la fila de mapa_ids del anterior y apuntaría a otra fila del servidor)
+CREATE TABLE IF NOT EXISTS secuencia_local (
+    tabla TEXT PRIMARY KEY, ultimo INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_estado (
+    creado_por TEXT PRIMARY KEY, ultimo_pull TEXT, ultima_sync REAL, ultimo_error TEXT
+);
+"""
+
+def replica_activa() -> bool:
+    """La réplica se activa con GRINO_REPLICA=1 o con [replica] activa = true en secrets.toml"""
+    if os.environ.get("GRINO_REPLICA") == "1":
+        return True
+    try:
+        return bool(st.secrets.get("replica", {}).get("activa", False))
+    except Exception:
+        return False
+
+# ==================== CONEXIÓN LOCAL ====================
+_lock = threading.RLock()
+_conexion: Optional[sqlite3.Connection] = None
+_sync_en_curso: Dict[str, threading.Thread] = {}
+
+def _db() -> sqlite3.Connection:
+    """Conexión única al archivo SQLite; todos los accesos pasan por _lock"""
+    global _conexion
+    if _conexion is None:
+        os.makedirs(os.path.dirname(RUTA_REPLICA), exist_ok=True)
+        _conexion = sqlite3.connect(RUTA_REPLICA, check_same_thread=False, isolation_level=None)
+        _conexion.row_factory = sqlite3.Row
+        _conexion.execute("PRAGMA journal_mode=WAL")
+        _conexion.executescript(ESQUEMA)
+    return _conexion
+
+def _consultar(sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+    with _lock:
+        return _db().execute(sql, params).fetchall()
+
+def _id_local(tabla: str, cantidad: int = 1) -> int:
+    """Id temporal negativo para filas creadas sin conexión; con cantidad > 1 reserva los ids
+    id, id - 1, ..., id - cantidad + 1. Se llama con _lock tomado."""
+    # La secuencia arranca por debajo de todo id local ya usado (réplicas anteriores a la secuencia)
+    _db().execute(
+        f"INSERT OR IGNORE INTO secuencia_local (tabla, ultimo) "
+        f"SELECT ?, MIN(COALESCE((SELECT MIN(id) FROM {tabla}), 0), "
+        f"COALESCE((SELECT MIN(id_local) FROM mapa_ids WHERE tabla = ?), 0), 0)",
+        (tabla, tabla)
+    )
+    fila = _db().execute(
+        "UPDATE secuencia_local SET ultimo = ultimo - ? WHERE tabla = ? RETURNING ultimo", (cantidad, tabla)
+    ).fetchone()
+    return fila[0] + cantidad - 1
+
+def _encolar(user_id: str, operacion: str, datos: Dict[str, Any], clave: Optional[str] = None) -> None:
+    _db().execute(
+        "INSERT INTO outbox (creado_por, operacion, datos, clave, creado_en) VALUES (?, ?, ?, ?, ?)",
+        (str(user_id), operacion, json.dumps(datos), clave or uuid.uuid4().hex, time.time())
+    )
+    publicar_local(TABLA_POR_OPERACION.get(operacion, 'presupuestos'), user_id)
+
+# ==================== LECTURAS (mismas firmas que utils/database.py) ====================
+def _catalogo(tabla: str, user_id: str) -> List[Tuple[int, str]]:
+    asegurar_replica(user_id)
+    filas = _consultar(f"SELECT id, nombre FROM {tabla} WHERE creado_por = ? ORDER BY nombre", (str(user_id),))
+    return [(f['id'], f['nombre']) for f in filas]
+
+def get_clientes(user_id: str) -> List[Tuple[int, str]]:
+    return _catalogo("clientes", user_id)
+
+def get_lugares_trabajo(user_id: str) -> List[Tuple[int, str]]:
+    return _catalogo("lugares_trabajo", user_id)
+
+def get_categorias(user_id: str) -> List[Tuple[int, str]]:
+    return _catalogo("categorias", user_id)
+
+def _where_filtros(user_id: str, filtros: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+    filtros = filtros or {}
+    condiciones, params = ["p.creado_por = ?"], [str(user_id)]
+    if filtros.get('cliente_id'):
+        condiciones.append("p.cliente_id = ?")
+        params.append(filtros['cliente_id'])
+    if filtros.get('lugar_trabajo_id'):
+        condiciones.append("p.lugar_trabajo_id = ?")
+        params.append(filtros['lugar_trabajo_id'])
+    if filtros.get('fecha_inicio'):
+        condiciones.append("p.fecha_creacion >= ?")
+        params.append(filtros['fecha_inicio'].isoformat())
+    return " AND ".join(condiciones), params
+
+_SELECT_PRESUPUESTO = """
+    SELECT p.id, p.fecha_creacion, p.total, p.descripcion, c.nombre AS cliente, l.nombre AS lugar,
+           (SELECT COUNT(*) FROM items_en_presupuesto i WHERE i.presupuesto_id = p.id) AS num_items
+    FROM presupuestos p
+    LEFT JOIN clientes c ON c.id = p.cliente_id
+    LEFT JOIN lugares_trabajo l ON l.id = p.lugar_trabajo_id
+"""
+
+def _fila_presupuesto(f: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": f['id'], "fecha_creacion": f['fecha_creacion'], "total": f['total'], "descripcion": f['descripcion'],
+        "cliente": {"nombre": f['cliente']}, "lugar": {"nombre": f['lugar']}, "num_items": f['num_items'],
+    }
+
+def get_presupuestos_usuario(user_id: str, filtros: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    asegurar_replica(user_id)
+    where, params = _where_filtros(user_id, filtros)
+    filas = _consultar(f"{_SELECT_PRESUPUESTO} WHERE {where} ORDER BY p.fecha_creacion DESC", tuple(params))
+    return [_fila_presupuesto(f) for f in filas]
+
+def get_presupuestos_pagina(user_id: str, filtros: Optional[Dict[str, Any]] = None, pagina: int = 0, por_pagina: int = 20) -> Tuple[List[Dict[str, Any]], int]:
+    asegurar_replica(user_id)
+    where, params = _where_filtros(user_id, filtros)
+    total = _consultar(f"SELECT COUNT(*) FROM presupuestos p WHERE {where}", tuple(params))[0][0]
+    filas = _consultar(
+        f"{_SELECT_PRESUPUESTO} WHERE {where} ORDER BY p.fecha_creacion DESC LIMIT ? OFFSET ?",
+        tuple(params) + (por_pagina, pagina * por_pagina)
+    )
+    return [_fila_presupuesto(f) for f in filas], total
+
+def get_resumen_presupuestos(user_id: str, filtros: Optional[Dict[str, Any]] = None) -> Tuple[int, float]:
+    asegurar_replica(user_id)
+    where, params = _where_filtros(user_id, filtros)
+    fila = _consultar(f"SELECT COUNT(*), COALESCE(SUM(p.total), 0) FROM presupuestos p WHERE {where}", tuple(params))[0]
+    return fila[0], float(fila[1])
+
+def get_presupuesto_detallado(presupuesto_id: int) -> Optional[Dict[str, Any]]:
+    filas = _consultar(
+        "SELECT p.*, c.nombre AS cliente_nombre, l.nombre AS lugar_nombre FROM presupuestos p "
+        "LEFT JOIN clientes c ON c.id = p.cliente_id LEFT JOIN lugares_trabajo l ON l.id = p.lugar_trabajo_id "
+        "WHERE p.id = ?", (presupuesto_id,)
+    )
+    if not filas:
+        return None
+    p = filas[0]
+    items = _consultar(
+        "SELECT i.*, cat.nombre AS categoria_nombre FROM items_en_presupuesto i "
+        "LEFT JOIN categorias cat ON cat.id = i.categoria_id WHERE i.presupuesto_id = ? ORDER BY i.id",
+        (presupuesto_id,)
+    )
+    mano_obra = _consultar(
+        "SELECT m.categoria_id, m.monto, cat.nombre AS categoria_nombre FROM mano_obra_presupuesto m "
+        "LEFT JOIN categorias cat ON cat.id = m.categoria_id WHERE m.presupuesto_id = ?", (presupuesto_id,)
+    )
+    return {
+        "id": p['id'],
+        "creado_por": p['creado_por'],
+        "fecha": p['fecha_creacion'],
+        "total": p['total'] or 0,
+        "descripcion": p['descripcion'] or '',
+        "cliente": {"id": p['cliente_id'], "nombre": p['cliente_nombre']},
+        "lugar": {"id": p['lugar_trabajo_id'], "nombre": p['lugar_nombre']},
+        "items": [{**{k: i[k] for k in i.keys() if k != 'categoria_nombre'}, "categoria": {"nombre": i['categoria_nombre']}} for i in items],
+        "mano_obra": [{"categoria_id": m['categoria_id'], "monto": m['monto'], "categoria": {"nombre": m['categoria_nombre']}} for m in mano_obra],
+    }
+
+def get_presupuestos_detallados(presupuesto_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    detalles = {presupuesto_id: get_presupuesto_detallado(presupuesto_id) for presupuesto_id in presupuesto_ids}
+    return {presupuesto_id: d for presupuesto_id, d in detalles.items() if d}
+
+# ==================== ESCRITURAS (locales + outbox) ====================
+def _crear_catalogo(tabla: str, operacion: str, nombre: str, user_id: str) -> Optional[int]:
+    from utils.database import normalizar_nombre
+    nombre = nombre.strip()
+    with _lock:
+        for f in _db().execute(f"SELECT id, nombre FROM {tabla} WHERE creado_por = ?", (str(user_id),)):
+            if normalizar_nombre(f['nombre']) == normalizar_nombre(nombre):
+                return f['id']
+        nuevo_id = _id_local(tabla)
+        _db().execute("BEGIN")
+        _db().execute(f"INSERT INTO {tabla} (id, nombre, creado_por) VALUES (?, ?, ?)", (nuevo_id, nombre, str(user_id)))
+        _encolar(user_id, operacion, {"id": nuevo_id, "nombre": nombre})
+        _db().execute("COMMIT")
+    programar_sync(user_id)
+    return nuevo_id
+
+def create_cliente(nombre: str, user_id: str) -> Optional[int]:
+    return _crear_catalogo("clientes", "crear_cliente", nombre, user_id)
+
+def create_lugar_trabajo(nombre: str, user_id: str) -> Optional[int]:
+    return _crear_catalogo("lugares_trabajo", "crear_lugar_trabajo", nombre, user_id)
+
+def create_categoria(nombre: str, user_id: str) -> Optional[int]:
+    return _crear_catalogo("categorias", "crear_categoria", nombre, user_id)
+
+def save_presupuesto_completo(user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str, items_data: Dict[str, Any], total: float, clave_idempotencia: Optional[str] = None) -> Optional[int]:
+    from utils.database import construir_filas_items, construir_filas_mano_obra
+    with _lock:
+        presupuesto_id = _id_local("presupuestos")
+        items = construir_filas_items(presupuesto_id, items_data)
+        mano_obra = construir_filas_mano_obra(presupuesto_id, items_data)
+        _db().execute("BEGIN")
+        _db().execute(
+            "INSERT INTO presupuestos (id, creado_por, cliente_id, lugar_trabajo_id, fecha_creacion, descripcion, total) "
+            "VALUES (?, ?, ?, ?, datetime('now'), ?, ?)",
+            (presupuesto_id, str(user_id), cliente_id, lugar_trabajo_id, descripcion, total)
+        )
+        item_id = _id_local("items_en_presupuesto", max(len(items), 1))
+        for n, item in enumerate(items):
+            _db().execute(
+                "INSERT INTO items_en_presupuesto (id, presupuesto_id, categoria_id, nombre_personalizado, unidad, cantidad, precio_unitario, total, notas) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item_id - n, presupuesto_id, item['categoria_id'], item['nombre_personalizado'], item['unidad'],
+                 item['cantidad'], item['precio_unitario'], item['total'], item['notas'])
+            )
+        _db().executemany(
+            "INSERT INTO mano_obra_presupuesto (presupuesto_id, categoria_id, monto) VALUES (?, ?, ?)",
+            [(m['presupuesto_id'], m['categoria_id'], m['monto']) for m in mano_obra]
+        )
+        _encolar(user_id, "guardar_presupuesto", {
+            "id": presupuesto_id, "cliente_id": cliente_id, "lugar_trabajo_id": lugar_trabajo_id,
+            "descripcion": descripcion, "total": total, "items": items, "mano_obra": mano_obra,
+        }, clave_idempotencia)
+        _db().execute("COMMIT")
+    programar_sync(user_id)
+    return presupuesto_id
+
+def _version(tabla: str, fila_id: int) -> Optional[str]:
+    fila = _db().execute(f"SELECT actualizado_en FROM {tabla} WHERE id = ?", (fila_id,)).fetchone()
+    return fila['actualizado_en'] if fila else None
+
+def update_cliente(cliente_id: int, nombre: str, user_id: str) -> bool:
+    with _lock:
+        base = _version("clientes", cliente_id)
+        _db().execute("BEGIN")
+        _db().execute("UPDATE clientes SET nombre = ? WHERE id = ?", (nombre, cliente_id))
+        _encolar(user_id, "renombrar_cliente", {"id": cliente_id, "nombre": nombre, "base": base})
+        _db().execute("COMMIT")
+    programar_sync(user_id)
+    return True
+
+def delete_cliente(cliente_id: int, user_id: str) -> bool:
+    with _lock:
+        if _db().execute("SELECT 1 FROM presupuestos WHERE cliente_id = ? LIMIT 1", (cliente_id,)).fetchone():
+            st.error("❌ Error al eliminar cliente (¿tiene presupuestos asociados?)")
+            return False
+        base = _version("clientes", cliente_id)
+        _db().execute("BEGIN")
+        _db().execute("DELETE FROM clientes WHERE id = ?", (cliente_id,))
+        _encolar(user_id, "eliminar_cliente", {"id": cliente_id, "base": base})
+        _db().execute("COMMIT")
+    programar_sync(user_id)
+    return True
+
+def delete_presupuesto(presupuesto_id: int, user_id: str) -> bool:
+    with _lock:
+        base = _version("presupuestos", presupuesto_id)
+        _db().execute("BEGIN")
+        _db().execute("DELETE FROM items_en_presupuesto WHERE presupuesto_id = ?", (presupuesto_id,))
+        _db().execute("DELETE FROM mano_obra_presupuesto WHERE presupuesto_id = ?", (presupuesto_id,))
+        _db().execute("DELETE FROM presupuestos WHERE id = ?", (presupuesto_id,))
+        _encolar(user_id, "eliminar_presupuesto", {"id": presupuesto_id, "base": base})
+        _db().execute("COMMIT")
+    programar_sync(user_id)
+    return True
+
+def save_edited_presupuesto(presupuesto_id: int, user_id: str, cliente_id: int, lugar_trabajo_id: int, descripcion: str,
+                            items_data: Dict[str, Any], total_general: float, original: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """Las ediciones no pasan por el outbox: editar_presupuesto compara contra la versión del servidor.
+    Se guardan en línea, y solo si lo que se editó es lo que hay en el servidor."""
+    from utils.database import _guardar_edicion
+    pendientes = _consultar("SELECT 1 FROM outbox WHERE creado_por = ? AND estado = 'pendiente' LIMIT 1", (str(user_id),))
+    if pendientes or min(presupuesto_id, cliente_id or 0, lugar_trabajo_id or 0) < 0:
+        st.error("❌ Hay cambios hechos sin conexión que aún no llegan al servidor. Sincronice (barra lateral) y vuelva a abrir el presupuesto para editarlo.")
+        return None
+    try:
+        remoto = ejecutar(get_supabase_client().table("presupuestos").select("version, actualizado_en").eq(
+            "id", presupuesto_id).eq("creado_por", user_id)).data or []
+    except Exception:
+        st.error("❌ Sin conexión: editar un presupuesto necesita el servidor. Los cambios siguen en pantalla; guarde de nuevo cuando vuelva la conexión.")
+        return None
+    local = _consultar("SELECT actualizado_en FROM presupuestos WHERE id = ?", (presupuesto_id,))
+    if not remoto or not local or remoto[0]['actualizado_en'] != local[0]['actualizado_en']:
+        # La réplica está atrasada: lo que se editó no es la versión vigente
+        programar_sync(user_id, forzar=True)
+        st.error("❌ Otra sesión guardó cambios en este presupuesto. Vuelva a abrirlo desde el historial para editar la versión actual.")
+        return None
+    resultado = _guardar_edicion(presupuesto_id, user_id, cliente_id, lugar_trabajo_id, descripcion, items_data,
+                                 total_general, original and {**original, 'version': remoto[0]['version']})
+    if resultado:
+        programar_sync(user_id, forzar=True)
+    return resultado
+
+# ==================== SINCRONIZACIÓN: PUSH ====================
+def _remoto(tabla: str, fila_id: Optional[int]) -> Optional[int]:
+    """Traduce un id local (negativo) al id del servidor, si ya se confirmó"""
+    if fila_id is None or fila_id > 0:
+        return fila_id
+    fila = _consultar("SELECT id_remoto FROM mapa_ids WHERE tabla = ? AND id_local = ?", (tabla, fila_id))
+    if not fila:
+        raise RuntimeError(f"{tabla} {fila_id} todavía no existe en el servidor")
+    return fila[0][0]
+
+def _confirmar_id(tabla: str, id_local: int, id_remoto: int) -> None:
+    """Reemplaza el id temporal por el del servidor en la réplica y en las referencias"""
+    referencias = {
+        'clientes': [("presupuestos", "cliente_id")],
+        'lugares_trabajo': [("presupuestos", "lugar_trabajo_id")],
+        'categorias': [("items_en_presupuesto", "categoria_id"), ("mano_obra_presupuesto", "categoria_id")],
+        'presupuestos': [("items_en_presupuesto", "presupuesto_id"), ("mano_obra_presupuesto", "presupuesto_id")],
+    }
+    with _lock:
+        _db().execute("BEGIN")
+        _db().execute("INSERT OR REPLACE INTO mapa_ids VALUES (?, ?, ?)", (tabla, id_local, id_remoto))
+        _db().execute(f"DELETE FROM {tabla} WHERE id = ?", (id_remoto,))
+        _db().execute(f"UPDATE {tabla} SET id = ? WHERE id = ?", (id_remoto, id_local))
+        for tabla_ref, columna in referencias[tabla]:
+            _db().execute(f"UPDATE {tabla_ref} SET {columna} = ? WHERE {columna} = ?", (id_remoto, id_local))
+        _db().execute("COMMIT")
+
+def _condicional(consulta, base: Optional[str]):
+    # Solo se aplica si nadie cambió la fila en el servidor desde que se leyó (detección de conflicto)
+    return consulta.eq("actualizado_en", base) if base else consulta
+
+def _enviar(supabase, user_id: str, operacion: str, datos: Dict[str, Any], clave: str) -> str:
+    """Envía una operación del outbox. Devuelve 'enviado' o 'conflicto'."""
+    if operacion.startswith("crear_"):
+        from utils.database import normalizar_nombre
+        tabla = TABLA_POR_OPERACION[operacion]
+        fila = {"nombre": datos['nombre'], "creado_por": user_id}
+        if tabla == "clientes":
+            fila["alias"] = f"{datos['nombre'].lower().replace(' ', '-')}-{clave[:8]}"
+            ejecutar(supabase.table(tabla).upsert(fila, on_conflict="creado_por,nombre_normalizado", ignore_duplicates=True), 'escritura', clave)
+            creado = ejecutar(supabase.table(tabla).select("id").eq("creado_por", user_id).eq("nombre_normalizado", normalizar_nombre(datos['nombre'])))
+        else:
+            ejecutar(supabase.table(tabla).upsert(fila, on_conflict="creado_por,nombre", ignore_duplicates=True), 'escritura', clave)
+            creado = ejecutar(supabase.table(tabla).select("id").eq("creado_por", user_id).eq("nombre", datos['nombre']))
+        _confirmar_id(tabla, datos['id'], creado.data[0]['id'])
+        return 'enviado'
+
+    if operacion == "guardar_presupuesto":
+        from utils.database import _insertar_items_reintentable
+        respuesta = ejecutar(supabase.table("presupuestos").upsert({
+            "creado_por": user_id,
+            "cliente_id": _remoto("clientes", datos['cliente_id']),
+            "lugar_trabajo_id": _remoto("lugares_trabajo", datos['lugar_trabajo_id']),
+            "descripcion": datos['descripcion'],
+            "total": datos['total'],
+            "clave_idempotencia": clave,
+        }, on_conflict="clave_idempotencia"), 'escritura', clave)
+        presupuesto_id = respuesta.data[0]['id']
+        items = [{**i, "presupuesto_id": presupuesto_id, "categoria_id": _remoto("categorias", i['categoria_id'])} for i in datos['items']]
+        if items:
+            llamar(_insertar_items_reintentable(supabase, presupuesto_id, items, reemplazar=True), 'escritura', clave)
+        mano_obra = [{**m, "presupuesto_id": presupuesto_id, "categoria_id": _remoto("categorias", m['categoria_id'])}
+                     for m in datos.get('mano_obra', [])]
+        if mano_obra:
+            ejecutar(supabase.table("mano_obra_presupuesto").upsert(mano_obra, on_conflict="presupuesto_id,categoria_id"), 'escritura', clave)
+        _confirmar_id("presupuestos", datos['id'], presupuesto_id)
+        # Los ítems locales tienen ids temporales: se reemplazan por los del servidor
+        _guardar_items_remotos(supabase, [presupuesto_id])
+        return 'enviado'
+
+    # Renombrar / eliminar: los ítems de un presupuesto se borran en cascada en la DB
+    tabla = TABLA_POR_OPERACION[operacion]
+    fila_id = _remoto(tabla, datos['id'])
+    if operacion == "renombrar_cliente":
+        consulta = supabase.table(tabla).update({"nombre": datos['nombre']}).eq("id", fila_id)
+    else:
+        consulta = supabase.table(tabla).delete().eq("id", fila_id)
+    respuesta = ejecutar(_condicional(consulta.eq("creado_por", user_id), datos.get('base')), 'escritura', clave)
+    if respuesta.data:
+        return 'enviado'
+    existe = ejecutar(supabase.table(tabla).select("id").eq("id", fila_id))
+    # Si la fila ya no existe, el efecto buscado (o un borrado ajeno) ya está aplicado
+    return 'conflicto' if existe.data else 'enviado'
+
+def _push(supabase, user_id: str) -> Dict[str, int]:
+    resumen = {'enviados': 0, 'conflictos': 0, 'errores': 0}
+    pendientes = _consultar(
+        "SELECT id, operacion, datos, clave FROM outbox WHERE creado_por = ? AND estado = 'pendiente' ORDER BY id",
+        (str(user_id),)
+    )
+    for entrada in pendientes:
+        try:
+            estado = _enviar(supabase, user_id, entrada['operacion'], json.loads(entrada['datos']), entrada['clave'])
+            error = None
+        except Exception as e:
+            if isinstance(e, ServicioNoDisponible) or es_transitorio(e):
+                # Sin conexión: se conserva el orden y se reintenta en la próxima sincronización
+                with _lock:
+                    _db().execute("UPDATE outbox SET intentos = intentos + 1, error = ? WHERE id = ?", (str(e), entrada['id']))
+                raise
+            estado, error = 'error', str(e)
+        with _lock:
+            _db().execute("UPDATE outbox SET estado = ?, error = ?, intentos = intentos + 1 WHERE id = ?",
+                          (estado, error, entrada['id']))
+        resumen[{'enviado': 'enviados', 'conflicto': 'conflictos', 'error': 'errores'}[estado]] += 1
+    return resumen
+
+# ==================== SINCRONIZACIÓN: PULL ====================
+def _reemplazar_filas(tabla: str, columnas: List[str], filas: List[Dict[str, Any]]) -> None:
+    marcadores = ", ".join("?" for _ in columnas)
+    with _lock:
+        _db().executemany(
+            f"INSERT OR REPLACE INTO {tabla} ({', '.join(columnas)}) VALUES ({marcadores})",
+            [tuple(f.get(c) for c in columnas) for f in filas]
+        )
+
+def _guardar_items_remotos(supabase, presupuesto_ids: List[int]) -> None:
+    """Ítems y mano de obra de esos presupuestos, tal como están en el servidor"""
+    columnas = [c.strip() for c in COLUMNAS_ITEM.split(",")]
+    columnas_mo = [c.strip() for c in COLUMNAS_MANO_OBRA.split(",")]
+    for i in range(0, len(presupuesto_ids), LOTE_IDS):
+        lote = presupuesto_ids[i:i + LOTE_IDS]
+        # 200 presupuestos pueden tener más ítems que una respuesta de PostgREST: se pagina
+        items = ejecutar_paginado(lambda: supabase.table("items_en_presupuesto").select(COLUMNAS_ITEM)
+                                  .in_("presupuesto_id", lote).order("id"), 'lote')
+        mano_obra = ejecutar_paginado(lambda: supabase.table("mano_obra_presupuesto").select(COLUMNAS_MANO_OBRA)
+                                      .in_("presupuesto_id", lote).order("presupuesto_id").order("categoria_id"), 'lote')
+        with _lock:
+            _db().execute("BEGIN")
+            _db().executemany("DELETE FROM items_en_presupuesto WHERE presupuesto_id = ?", [(p,) for p in lote])
+            _db().executemany("DELETE FROM mano_obra_presupuesto WHERE presupuesto_id = ?", [(p,) for p in lote])
+            _reemplazar_filas("items_en_presupuesto", columnas, items)
+            _reemplazar_filas("mano_obra_presupuesto", columnas_mo, mano_obra)
+            _db().execute("COMMIT")
+
+def _marca_vencida(marca: Optional[str]) -> bool:
+    """True si la última sincronización es más vieja que las lápidas que guarda el servidor"""
+    if not marca:
+        return False
+    limite = datetime.now(timezone.utc) - timedelta(days=RETENCION_LAPIDAS_DIAS)
+    try:
+        fecha = datetime.fromisoformat(marca.replace("Z", "+00:00"))
+    except ValueError:
+        return True
+    return (fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)) < limite
+
+def _desde_marca(marca: str) -> str:
+    """Desde dónde pedir cambios: la marca menos MARGEN_PULL_SEG"""
+    try:
+        fecha = datetime.fromisoformat(marca.replace("Z", "+00:00"))
+    except ValueError:
+        return marca
+    return (fecha - timedelta(seconds=MARGEN_PULL_SEG)).isoformat()
+
+def _borrar_locales(tabla: str, ids: List[int]) -> None:
+    filas = [(i,) for i in ids]
+    if tabla == "presupuestos":
+        _db().executemany("DELETE FROM items_en_presupuesto WHERE presupuesto_id = ?", filas)
+        _db().executemany("DELETE FROM mano_obra_presupuesto WHERE presupuesto_id = ?", filas)
+    _db().executemany(f"DELETE FROM {tabla} WHERE id = ?", filas)
+
+def _pull(supabase, user_id: str) -> None:
+    estado = _consultar("SELECT ultimo_pull FROM sync_estado WHERE creado_por = ?", (str(user_id),))
+    marca = estado[0][0] if estado else None
+    recarga = _marca_vencida(marca)
+    if recarga:
+        # Las lápidas de ese período ya se limpiaron: se trae todo y se descarta lo que no vino
+        marca = None
+    nueva_marca = marca
+    desde = _desde_marca(marca) if marca else None
+    cambiadas = set()
+
+    def cambios(consulta):
+        # Desde la marca menos el margen: las filas confirmadas tarde con una marca anterior no se pierden.
+        # Completo y paginado: la marca avanza hasta la fila más nueva recibida, así que una
+        # respuesta cortada dejaría filas sin traer para siempre
+        return ejecutar_paginado(lambda: (consulta().gte("actualizado_en", desde) if desde else consulta()).order("id"), 'lote')
+
+    recibidos: Dict[str, set] = {}
+    for tabla in TABLAS_CATALOGO:
+        filas = cambios(lambda: supabase.table(tabla).select("id, nombre, creado_por, actualizado_en").eq("creado_por", user_id))
+        _reemplazar_filas(tabla, ["id", "nombre", "creado_por", "actualizado_en"], filas)
+        recibidos[tabla] = {f['id'] for f in filas}
+        if filas:
+            cambiadas.add(tabla)
+        nueva_marca = max([nueva_marca or ""] + [f['actualizado_en'] for f in filas]) or None
+
+    presupuestos = cambios(lambda: supabase.table("presupuestos").select(COLUMNAS_PRESUPUESTO).eq("creado_por", user_id))
+    _reemplazar_filas("presupuestos", [c.strip() for c in COLUMNAS_PRESUPUESTO.split(",")], presupuestos)
+    _guardar_items_remotos(supabase, [p['id'] for p in presupuestos])
+    recibidos["presupuestos"] = {p['id'] for p in presupuestos}
+    if presupuestos:
+        cambiadas.add("presupuestos")
+    nueva_marca = max([nueva_marca or ""] + [p['actualizado_en'] for p in presupuestos]) or None
+
+    if recarga:
+        # Recarga completa: la lista recibida es todo lo que hay en el servidor
+        for tabla, ids in recibidos.items():
+            with _lock:
+                locales = {f[0] for f in _db().execute(f"SELECT id FROM {tabla} WHERE creado_por = ? AND id > 0", (str(user_id),))}
+                _borrar_locales(tabla, list(locales - ids))
+            cambiadas.add(tabla)
+    elif marca:
+        # Borrados: las lápidas del servidor desde la última sincronización (aplicarlas dos veces no
+        # hace daño: los ids no se reutilizan)
+        lapidas = ejecutar_paginado(lambda: supabase.table("filas_borradas").select("id, tabla, fila_id, borrado_en")
+                                    .eq("creado_por", user_id).gte("borrado_en", desde).order("id"), 'lote')
+        por_tabla: Dict[str, List[int]] = {}
+        for lapida in lapidas:
+            if lapida['tabla'] in recibidos:
+                por_tabla.setdefault(lapida['tabla'], []).append(lapida['fila_id'])
+        with _lock:
+            for tabla, ids in por_tabla.items():
+                _borrar_locales(tabla, ids)
+                cambiadas.add(tabla)
+        nueva_marca = max([nueva_marca or ""] + [l['borrado_en'] for l in lapidas]) or None
+
+    with _lock:
+        _db().execute(
+            "INSERT INTO sync_estado (creado_por, ultimo_pull, ultima_sync, ultimo_error) VALUES (?, ?, ?, NULL) "
+            "ON CONFLICT (creado_por) DO UPDATE SET ultimo_pull = excluded.ultimo_pull, ultima_sync = excluded.ultima_sync, ultimo_error = NULL",
+            (str(user_id), nueva_marca, time.time())
+        )
+    # Las cachés en memoria se llenaron desde la réplica: lo que trajo el pull las deja viejas
+    for tabla in cambiadas:
+        publicar_local(tabla, user_id)
+
+def sincronizar(user_id: str) -> Dict[str, Any]:
+    """Envía el outbox en orden y luego trae los cambios del servidor"""
+    supabase = get_supabase_client()
+    try:
+        resumen = _push(supabase, user_id)
+        _pull(supabase, user_id)
+        return {'ok': True, **resumen}
+    except Exception as e:
+        with _lock:
+            _db().execute(
+                "INSERT INTO sync_estado (creado_por, ultima_sync, ultimo_error) VALUES (?, ?, ?) "
+                "ON CONFLICT (creado_por) DO UPDATE SET ultima_sync = excluded.ultima_sync, ultimo_error = excluded.ultimo_error",
+                (str(user_id), time.time(), str(e))
+            )
+        print(f"Sincronización pendiente para {user_id}: {e}")
+        return {'ok': False, 'error': str(e)}
+
+def programar_sync(user_id: str, forzar: bool = False) -> None:
+    """Lanza una sincronización en segundo plano si toca (o si se fuerza) y no hay otra en curso"""
+    with _lock:
+        hilo = _sync_en_curso.get(str(user_id))
+        if hilo is not None and hilo.is_alive():
+            return
+        estado = _db().execute("SELECT ultima_sync FROM sync_estado WHERE creado_por = ?", (str(user_id),)).fetchone()
+        if not forzar and estado and estado[0] and time.time() - estado[0] < INTERVALO_SYNC_SEG:
+            return
+        # El hilo no tiene sesión de Streamlit: usa el cliente autenticado de la sesión actual
+        hilo = threading.Thread(target=con_cliente_actual(sincronizar), args=(user_id,), name="grino-sync", daemon=True)
+        _sync_en_curso[str(user_id)] = hilo
+        hilo.start()
+
+def asegurar_replica(user_id: str) -> None:
+    """La primera vez se sincroniza en primer plano (réplica vacía); después, en segundo plano"""
+    estado = _consultar("SELECT ultimo_pull FROM sync_estado WHERE creado_por = ?", (str(user_id),))
+    nunca_sincronizada = not estado or estado[0][0] is None
+    tiene_datos_locales = bool(_consultar("SELECT 1 FROM outbox WHERE creado_por = ? LIMIT 1", (str(user_id),)))
+    if nunca_sincronizada and not tiene_datos_locales:
+        hilo = _sync_en_curso.get(str(user_id))
+        if hilo is not None and hilo.is_alive():
+            hilo.join()
+        else:
+            sincronizar(user_id)
+    else:
+        programar_sync(user_id)
+
+# ==================== ESTADO ====================
+def get_estado_replica(user_id: str) -> Dict[str, Any]:
+    conteo = dict(_consultar(
+        "SELECT estado, COUNT(*) FROM outbox WHERE creado_por = ? GROUP BY estado", (str(user_id),)
+    ))
+    sync = _consultar("SELECT ultima_sync, ultimo_error FROM sync_estado WHERE creado_por = ?", (str(user_id),))
+    return {
+        'pendientes': conteo.get('pendiente', 0),
+        'conflictos': conteo.get('conflicto', 0),
+        'errores': conteo.get('error', 0),
+        'ultima_sync': sync[0][0] if sync else None,
+        'ultimo_error': sync[0][1] if sync else None,
+    }
+
+def show_replica_sidebar(user_id: str) -> None:
+    """Resumen de la réplica local en la barra lateral, con botón para sincronizar ya"""
+    estado = get_estado_replica(user_id)
+    if estado['ultimo_error']:
+        st.warning(f"📴 Sin conexión · {estado['pendientes']} cambios por enviar")
+    else:
+        st.caption(f"🔄 Réplica local · {estado['pendientes']} cambios por enviar")
+    if estado['conflictos'] or estado['errores']:
+        st.error(f"⚠️ {estado['conflictos']} conflictos y {estado['errores']} errores: se conservó la versión del servidor")
+    if st.button("🔄 Sincronizar ahora", width='stretch'):
+        programar_sync(user_id, forzar=True)
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from postgrest.exceptions import APIError
+from utils.db import timeout_llamada
+
+# ==================== CONFIGURACIÓN ====================
+# Presupuesto total de tiempo por tipo de operación (todos los intentos incluidos) y si admite
+# reintentos sin más. Las escrituras solo se reintentan si traen clave de idempotencia.
+OPERACIONES = {
+    'lectura': {'presupuesto_seg': 4.0, 'idempotente': True},
+    'busqueda': {'presupuesto_seg': 6.0, 'idempotente': True},
+    'escritura': {'presupuesto_seg': 10.0, 'idempotente': False},
+    'lote': {'presupuesto_seg': 30.0, 'idempotente': False},
+}
+MAX_INTENTOS = 3
+ESPERA_BASE_SEG = 0.2
+ESPERA_MAX_SEG = 2.0
+# Filas por respuesta que PostgREST devuelve como máximo (db-max-rows de Supabase): lo que pase
+# de ahí se corta sin aviso, así que las lecturas sin tope se piden por páginas de este tamaño
+FILAS_POR_PAGINA = 1000
+
+# Circuit breaker: tras UMBRAL_FALLOS fallos transitorios seguidos se deja de llamar durante
+# ENFRIAMIENTO_SEG; luego una sola llamada de prueba decide si se vuelve a cerrar
+UMBRAL_FALLOS = 5
+ENFRIAMIENTO_SEG = 30.0
+
+# Códigos de PostgREST/Postgres que indican un problema pasajero del backend
+CODIGOS_TRANSITORIOS = {
+    'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003',  # sin conexión / pool de la DB agotado
+    '40001', '40P01',                                # serialización / deadlock
+    '502', '503', '504', '520',
+}
+
+class ServicioNoDisponible(Exception):
+    """El circuito está abierto: Supabase falló repetidamente y se evita esperar otro timeout."""
+
+def es_transitorio(error: Exception) -> bool:
+    """True si el error es de red, timeout o sobrecarga (vale la pena reintentar)"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIError):
+        return str(error.code) in CODIGOS_TRANSITORIOS
+    return False
+
+# ==================== CIRCUIT BREAKER ====================
+class CircuitBreaker:
+    """Cerrado → abierto tras fallos seguidos → semiabierto (una prueba) → cerrado o abierto otra vez"""
+
+    def __init__(self, umbral: int = UMBRAL_FALLOS, enfriamiento: float = ENFRIAMIENTO_SEG):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self._lock = threading.Lock()
+        self._estado = 'cerrado'
+        self._fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._rechazadas = 0
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self._estado == 'cerrado':
+                return True
+            if self._estado == 'abierto' and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                self._estado = 'semiabierto'
+            if self._estado == 'semiabierto' and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            self._rechazadas += 1
+            return False
+
+    def exito(self) -> None:
+        with self._lock:
+            self._estado = 'cerrado'
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def fallo(self) -> None:
+        with self._lock:
+            self._fallos += 1
+            self._prueba_en_curso = False
+            if self._estado == 'semiabierto' or self._fallos >= self.umbral:
+                self._estado = 'abierto'
+                self._abierto_desde = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'estado': self._estado, 'fallos_seguidos': self._fallos, 'rechazadas': self._rechazadas}
+
+_breaker = CircuitBreaker()
+
+def get_estado_circuito() -> Dict[str, Any]:
+    """Estado del circuit breaker para la página de operaciones"""
+    return _breaker.snapshot()
+
+# ==================== LLAMADAS PROTEGIDAS ====================
+def llamar(funcion: Callable[[], Any], operacion: str = 'lectura', clave_idempotencia: Optional[str] = None) -> Any:
+    """Ejecuta funcion() con presupuesto de tiempo, reintentos con jitter y circuit breaker.
+
+    Solo se reintenta si la operación es idempotente (lecturas) o si el llamador pasa una clave
+    de idempotencia, es decir, si repetir la escritura no puede duplicar datos."""
+    config = OPERACIONES[operacion]
+    reintentable = config['idempotente'] or clave_idempotencia is not None
+    limite = time.monotonic() + config['presupuesto_seg']
+    intento = 0
+    while True:
+        if not _breaker.permitir():
+            raise ServicioNoDisponible("Supabase no responde; se reintentará en unos segundos")
+        restante = limite - time.monotonic()
+        try:
+            with timeout_llamada(max(restante, 0.1)):
+                resultado = funcion()
+        except Exception as e:
+            if not es_transitorio(e):
+                # Error de la petición (p. ej. restricción violada): el backend respondió bien
+                _breaker.exito()
+                raise
+            _breaker.fallo()
+            intento += 1
+            # Backoff exponencial con jitter completo, sin pasarse del presupuesto
+            espera = random.uniform(0, min(ESPERA_MAX_SEG, ESPERA_BASE_SEG * 2 ** intento))
+            if not reintentable or intento >= MAX_INTENTOS or time.monotonic() + espera >= limite:
+                raise
+            time.sleep(espera)
+        else:
+            _breaker.exito()
+            return resultado
+
+def ejecutar(consulta, operacion: str = 'lectura', clave_idempotencia: Optional[str] = None):
+    """Atajo para una consulta de PostgREST ya armada: ejecutar(query) en vez de query.execute()"""
+    return llamar(consulta.execute, operacion, clave_idempotencia)
+
+def ejecutar_paginado(construir: Callable[[], Any], operacion: str = 'lectura', tamano: int = FILAS_POR_PAGINA) -> List[Dict[str, Any]]:
+    """Todas las filas de una consulta, página por página con .range() hasta que llega una incompleta.
+
+    construir() arma la consulta de nuevo en cada página (los builders de PostgREST acumulan
+    parámetros) y debe ordenarla por una clave única para que las páginas no se solapen.
+    tamano no puede superar el db-max-rows del servidor."""
+    filas: List[Dict[str, Any]] = []
+    inicio = 0
+    while True:
+        pagina = ejecutar(construir().range(inicio, inicio + tamano - 1), operacion).data or []
+        filas.extend(pagina)
+        if len(pagina) < tamano:
+            return filas
+        inicio += tamano